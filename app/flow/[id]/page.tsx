@@ -674,7 +674,18 @@ export default function FlowBuilderPage({ params }: { params: Promise<{ id: stri
             if (n.id === nodeId) {
               const rt = n.data.runtime || {};
               const events = [...(rt.events || [])];
-              events.push({ ts: ev.ts || nowTs, ...ev });
+              const prev = events[events.length - 1];
+              if (ev.event === 'token' && prev?.event === 'token' && prev.field === ev.field) {
+                // Keep one entry per streamed field instead of one per chunk
+                events[events.length - 1] = { ...prev, chunk: (prev.chunk || '') + (ev.chunk || ''), chunks: (prev.chunks || 1) + (ev.chunks || 1), last: ev.last };
+              } else if (ev.event === 'token_reset') {
+                // The LM call failed after streaming and is being retried: drop that field's partial text
+                for (let i = events.length - 1; i >= 0 && events[i].event !== 'lm_start'; i--) {
+                  if (events[i].event === 'token' && events[i].field === ev.field) events.splice(i, 1);
+                }
+              } else {
+                events.push({ ts: ev.ts || nowTs, ...ev });
+              }
               let current = rt.current || null;
               if (ev.event === 'run_start') current = { kind: 'run', label: 'starting', startedAt: ev.ts || nowTs } as any;
               if (ev.event === 'lm_start') current = { kind: 'lm', label: 'prompting', startedAt: ev.ts || nowTs } as any;
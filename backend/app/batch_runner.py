@@ -0,0 +1,496 @@
+"""
+Dataset (batch) execution: run one node or a whole flow once per input row.
+
+`POST /api/flows/{id}/run/batch` sends a CSV (header row first) or JSONL
+dataset as the request body. The upload is spooled to disk like the NDJSON
+import, then rows are parsed from the spool lazily and run with at most
+`concurrency` rows in flight on the runner pool, going through the node memo
+cache like any other run. One `row` result line per row is streamed back in
+completion order, with periodic `batch_progress` lines (rows/sec) and a final
+`batch_end`. The next row is only read when a slot is free, and results pass
+through a bounded queue, so memory stays flat for any dataset size.
+
+Row columns map to node inputs by name when a `node_id` is given, otherwise
+to the outputs of the flow's `input` nodes (see `FlowGraph.inputs`).
+
+Every finished row is checkpointed in `batch_rows`. Posting the same dataset
+again with `batch_id` resumes the batch: rows that already succeeded are
+skipped by row index (read back from the DB in pages, not held in memory)
+and failed rows are retried.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import csv
+import json
+import os
+import time
+import uuid
+from typing import IO, Any, AsyncIterator
+
+from . import node_cache
+from .db import get_connection, get_executor, run_db
+from .flow_executor import FlowGraph, FlowGraphError, execute_flow
+from .lm_usage import TokenBudget
+from .runner_pool import RunnerError
+
+BATCH_CONCURRENCY = max(1, int(os.environ.get("BATCH_CONCURRENCY", "4")))
+BATCH_PROGRESS_MS = int(os.environ.get("BATCH_PROGRESS_MS", "2000"))
+# Longest accepted CSV record / JSONL line
+BATCH_MAX_RECORD_BYTES = int(os.environ.get("BATCH_MAX_RECORD_BYTES", str(1024 * 1024)))
+# Completed row indexes read per query when resuming
+RESUME_PAGE_SIZE = 1000
+
+_BATCH_COLS = "batch_id, flow_id, node_id, status, attempts, started_at, updated_at, duration_ms, rows_per_sec, error"
+
+# Batches currently executing in this process (a resume of one is rejected)
+_active: set[str] = set()
+
+
+class BatchError(Exception):
+    """The dataset cannot be read any further (malformed framing, oversized record)."""
+
+
+class BatchConflict(Exception):
+    """Resume refused: unknown batch or one started for another flow/node."""
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _line(obj: dict[str, Any]) -> bytes:
+    return (json.dumps(obj, default=str) + "\n").encode("utf-8")
+
+
+# ---- dataset parsing ----
+
+async def file_chunks(f: IO[bytes], size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    while True:
+        # The spool may be on disk: keep reads off the event loop
+        chunk = await asyncio.to_thread(f.read, size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    buf = b""
+    async for chunk in chunks:
+        buf += chunk
+        if b"\n" not in buf:
+            if len(buf) > BATCH_MAX_RECORD_BYTES:
+                raise BatchError(f"Record exceeds {BATCH_MAX_RECORD_BYTES} bytes")
+            continue
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            yield line
+    if buf:
+        yield buf
+
+
+async def read_rows(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[tuple[int, dict[str, Any] | None, str | None]]:
+    """Yield `(index, row, error)` per record; blank lines are not counted as rows."""
+    index = 0
+    if fmt == "jsonl":
+        async for raw in _lines(chunks):
+            if not raw.strip():
+                continue
+            try:
+                row = json.loads(raw)
+                if not isinstance(row, dict):
+                    raise ValueError("expected a JSON object")
+                yield index, row, None
+            except ValueError as e:
+                yield index, None, f"Invalid JSON row: {e}"
+            index += 1
+        return
+
+    header: list[str] | None = None
+    record = ""
+    async for raw in _lines(chunks):
+        try:
+            text = raw.decode("utf-8-sig" if header is None and not record else "utf-8")
+        except UnicodeDecodeError as e:
+            raise BatchError(f"Dataset is not UTF-8: {e}")
+        record = f"{record}\n{text}" if record else text
+        # A quoted field may contain newlines: wait for the closing quote
+        if record.count('"') % 2:
+            if len(record) > BATCH_MAX_RECORD_BYTES:
+                raise BatchError(f"Record exceeds {BATCH_MAX_RECORD_BYTES} bytes")
+            continue
+        text, record = record.rstrip("\r"), ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+        if len(values) != len(header):
+            yield index, None, f"Expected {len(header)} columns, got {len(values)}"
+        else:
+            yield index, dict(zip(header, values)), None
+        index += 1
+    if record:
+        raise BatchError("Unterminated quoted field at end of dataset")
+
+
+# ---- checkpoints ----
+
+def open_batch(batch_id: str | None, flow_id: str, node_id: str | None) -> tuple[str, bool]:
+    """Create a batch, or reopen `batch_id` for resuming; returns `(batch_id, resumed)`."""
+    now = _now_ms()
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if batch_id:
+            row = conn.execute("SELECT flow_id, node_id FROM batch_runs WHERE batch_id = ?", (batch_id,)).fetchone()
+            if row is None:
+                raise BatchConflict("Batch not found")
+            if row["flow_id"] != flow_id or row["node_id"] != node_id:
+                raise BatchConflict("Batch belongs to another flow or node")
+            conn.execute(
+                "UPDATE batch_runs SET status = 'running', attempts = attempts + 1, updated_at = ?, error = NULL "
+                "WHERE batch_id = ?",
+                (now, batch_id),
+            )
+            return batch_id, True
+        batch_id = uuid.uuid4().hex
+        conn.execute(
+            "INSERT INTO batch_runs (batch_id, flow_id, node_id, status, attempts, started_at, updated_at) "
+            "VALUES (?, ?, ?, 'running', 1, ?, ?)",
+            (batch_id, flow_id, node_id, now, now),
+        )
+        return batch_id, False
+
+
+def finish_batch(batch_id: str, status: str, duration_ms: int, rows_per_sec: float | None, error: str | None = None) -> None:
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE batch_runs SET status = ?, updated_at = ?, duration_ms = ?, rows_per_sec = ?, error = ? WHERE batch_id = ?",
+            (status, _now_ms(), duration_ms, rows_per_sec, error, batch_id),
+        )
+
+
+def record_row(batch_id: str, result: dict[str, Any]) -> None:
+    usage = result.get("usage") or {}
+    with get_connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO batch_rows (batch_id, row, status, outputs, error, cached, duration_ms,
+                                    prompt_tokens, completion_tokens, cost_usd, finished_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(batch_id, row) DO UPDATE SET
+                status = excluded.status,
+                outputs = excluded.outputs,
+                error = excluded.error,
+                cached = excluded.cached,
+                duration_ms = excluded.duration_ms,
+                prompt_tokens = excluded.prompt_tokens,
+                completion_tokens = excluded.completion_tokens,
+                cost_usd = excluded.cost_usd,
+                finished_at = excluded.finished_at
+            """,
+            (
+                batch_id,
+                result["row"],
+                result["status"],
+                None if result.get("outputs") is None else json.dumps(result["outputs"], default=str),
+                result.get("error"),
+                1 if result.get("cached") else 0,
+                result.get("duration_ms"),
+                usage.get("prompt_tokens"),
+                usage.get("completion_tokens"),
+                usage.get("cost_usd"),
+                _now_ms(),
+            ),
+        )
+
+
+def done_rows_after(batch_id: str, after: int, limit: int = RESUME_PAGE_SIZE) -> list[int]:
+    with get_connection() as conn:
+        cur = conn.execute(
+            "SELECT row FROM batch_rows WHERE batch_id = ? AND row > ? AND status = 'done' ORDER BY row LIMIT ?",
+            (batch_id, after, limit),
+        )
+        return [r[0] for r in cur.fetchall()]
+
+
+def _counts(conn, batch_id: str) -> dict[str, Any]:
+    row = conn.execute(
+        """
+        SELECT COUNT(*) AS rows, COALESCE(SUM(status = 'done'), 0) AS done, COALESCE(SUM(status = 'error'), 0) AS failed,
+               COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens, COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+               ROUND(SUM(cost_usd), 8) AS cost_usd
+        FROM batch_rows WHERE batch_id = ?
+        """,
+        (batch_id,),
+    ).fetchone()
+    return dict(row)
+
+
+def get_batch(batch_id: str) -> dict[str, Any] | None:
+    """Batch summary with row counts and token usage over all attempts."""
+    with get_connection() as conn:
+        row = conn.execute(f"SELECT {_BATCH_COLS} FROM batch_runs WHERE batch_id = ?", (batch_id,)).fetchone()
+        if row is None:
+            return None
+        return {**dict(row), **_counts(conn, batch_id)}
+
+
+def recent_batches(flow_id: str | None = None, limit: int = 50) -> list[dict[str, Any]]:
+    with get_connection() as conn:
+        if flow_id:
+            cur = conn.execute(
+                f"SELECT {_BATCH_COLS} FROM batch_runs WHERE flow_id = ? ORDER BY started_at DESC LIMIT ?",
+                (flow_id, limit),
+            )
+        else:
+            cur = conn.execute(f"SELECT {_BATCH_COLS} FROM batch_runs ORDER BY started_at DESC LIMIT ?", (limit,))
+        return [dict(r) for r in cur.fetchall()]
+
+
+def batch_rows(batch_id: str, after: int = -1, limit: int = 500, status: str | None = None) -> list[dict[str, Any]]:
+    """One page of checkpointed row results in row order."""
+    sql = (
+        "SELECT row, status, outputs, error, cached, duration_ms, prompt_tokens, completion_tokens, cost_usd "
+        "FROM batch_rows WHERE batch_id = ? AND row > ?"
+    )
+    params: list[Any] = [batch_id, after]
+    if status:
+        sql += " AND status = ?"
+        params.append(status)
+    sql += " ORDER BY row LIMIT ?"
+    params.append(limit)
+    with get_connection() as conn:
+        rows = []
+        for r in conn.execute(sql, params).fetchall():
+            d = dict(r)
+            d["outputs"] = json.loads(d["outputs"]) if d["outputs"] else None
+            d["cached"] = bool(d["cached"])
+            rows.append(d)
+        return rows
+
+
+class _DoneRows:
+    """Ascending indexes of rows a previous attempt completed, paged from the DB."""
+
+    def __init__(self, batch_id: str):
+        self.batch_id = batch_id
+        self._page: list[int] = []
+        self._pos = 0
+        self._exhausted = False
+
+    async def contains(self, index: int) -> bool:
+        while True:
+            while self._pos < len(self._page) and self._page[self._pos] < index:
+                self._pos += 1
+            if self._pos < len(self._page):
+                return self._page[self._pos] == index
+            if self._exhausted:
+                return False
+            after = self._page[-1] if self._page else -1
+            self._page = await run_db(done_rows_after, self.batch_id, after)
+            self._pos = 0
+            self._exhausted = len(self._page) < RESUME_PAGE_SIZE
+
+
+# ---- execution ----
+
+def _add_usage(total: dict[str, Any], usage: dict[str, Any] | None) -> None:
+    if not usage:
+        return
+    total["prompt_tokens"] += usage.get("prompt_tokens") or 0
+    total["completion_tokens"] += usage.get("completion_tokens") or 0
+    if usage.get("cost_usd") is not None:
+        total["cost_usd"] = (total["cost_usd"] or 0.0) + usage["cost_usd"]
+
+
+def _new_usage() -> dict[str, Any]:
+    return {"prompt_tokens": 0, "completion_tokens": 0, "cost_usd": None}
+
+
+async def _run_node_row(flow_id: str, graph: FlowGraph, node_id: str, row: dict[str, Any], token_budget: int | None) -> dict[str, Any]:
+    payload = graph.build_payload(node_id, {}, row)
+    # Rows only keep the final result
+    payload["stream_tokens"] = False
+    budget = TokenBudget(token_budget) if token_budget else None
+    res: dict[str, Any] = {"status": "error", "error": "Run ended without a result", "usage": _new_usage()}
+    async for raw in node_cache.memoized_stream(flow_id, payload, budget=budget):
+        try:
+            ev = json.loads(raw)
+        except Exception:
+            continue
+        kind = ev.get("event")
+        if kind == "lm_end":
+            _add_usage(res["usage"], ev.get("usage"))
+        elif kind == "result":
+            res.update(status="done", error=None, outputs=ev.get("outputs") or {}, cached=bool(ev.get("cached")))
+        elif kind in ("error", "cancelled", "timeout"):
+            res.update(status="error", error=ev.get("message"))
+    return res
+
+
+async def _run_flow_row(flow_id: str, state: dict[str, Any], row: dict[str, Any], token_budget: int | None) -> dict[str, Any]:
+    res: dict[str, Any] = {"status": "error", "error": "Run ended without flow_end", "usage": _new_usage()}
+    async for raw in execute_flow(flow_id, state, token_budget=token_budget, inputs=row):
+        ev = json.loads(raw)
+        if ev.get("event") == "flow_end":
+            res.update(
+                status="done" if ev["status"] == "done" else "error",
+                error=ev.get("message") or (None if ev["status"] == "done" else f"{ev['failed']} node(s) failed"),
+                outputs=ev.get("outputs"),
+                usage={k: ev["usage"][k] for k in ("prompt_tokens", "completion_tokens", "cost_usd")},
+                flow_run_id=ev.get("flow_run_id"),
+            )
+        elif ev.get("event") == "flow_error":
+            res["error"] = ev.get("message")
+    return res
+
+
+def validate(state: dict[str, Any], node_id: str | None) -> None:
+    """Raise FlowGraphError if the node or flow cannot be batch-run."""
+    graph = FlowGraph(state)
+    if node_id is None:
+        graph.toposort(graph.select())
+    elif not graph.is_compute(node_id):
+        raise FlowGraphError(f"Node {node_id} is not a compute node of this flow")
+
+
+async def execute_batch(
+    flow_id: str,
+    state: dict[str, Any],
+    rows: AsyncIterator[tuple[int, dict[str, Any] | None, str | None]],
+    *,
+    batch_id: str,
+    resumed: bool,
+    node_id: str | None = None,
+    concurrency: int | None = None,
+    token_budget: int | None = None,
+) -> AsyncIterator[bytes]:
+    """Run every row of `rows` and yield NDJSON result and progress lines."""
+    limit = max(1, concurrency or BATCH_CONCURRENCY)
+    graph = FlowGraph(state)
+    done_before = _DoneRows(batch_id) if resumed else None
+    started = time.perf_counter()
+    stats = {"done": 0, "failed": 0, "skipped": 0}
+    usage = _new_usage()
+    fatal: list[str] = []
+
+    sem = asyncio.Semaphore(limit)
+    # Bounded so a slow reader applies backpressure to the row tasks
+    out: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=limit * 2)
+    tasks: set[asyncio.Task] = set()
+
+    async def run_row(index: int, row: dict[str, Any] | None, error: str | None) -> None:
+        t0 = time.perf_counter()
+        try:
+            if row is None:
+                res: dict[str, Any] = {"status": "error", "error": error}
+            elif node_id is not None:
+                res = await _run_node_row(flow_id, graph, node_id, row, token_budget)
+            else:
+                res = await _run_flow_row(flow_id, state, row, token_budget)
+        except (FlowGraphError, RunnerError) as e:
+            res = {"status": "error", "error": str(e)}
+        except Exception as e:
+            # One broken row must not end the batch
+            res = {"status": "error", "error": f"Row failed: {e}"}
+        finally:
+            sem.release()
+        res["row"] = index
+        res["duration_ms"] = int((time.perf_counter() - t0) * 1000)
+        stats["done" if res["status"] == "done" else "failed"] += 1
+        _add_usage(usage, res.get("usage"))
+        try:
+            await run_db(record_row, batch_id, res)
+        except Exception as e:
+            res["checkpoint_error"] = str(e)
+        await out.put(_line({"event": "row", **res}))
+
+    async def produce() -> None:
+        try:
+            async for index, row, error in rows:
+                if done_before is not None and await done_before.contains(index):
+                    stats["skipped"] += 1
+                    continue
+                # Only pull the next row from the body once a slot is free
+                await sem.acquire()
+                task = asyncio.create_task(run_row(index, row, error))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except BatchError as e:
+            fatal.append(str(e))
+        except Exception as e:
+            # Upload aborted or unreadable body
+            fatal.append(f"Reading dataset failed: {e}")
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await out.put(None)
+
+    def progress() -> dict[str, Any]:
+        elapsed = time.perf_counter() - started
+        processed = stats["done"] + stats["failed"]
+        return {
+            **stats,
+            "in_flight": len(tasks),
+            "elapsed_ms": int(elapsed * 1000),
+            "rows_per_sec": round(processed / elapsed, 3) if elapsed > 0 else None,
+        }
+
+    _active.add(batch_id)
+    yield _line({"event": "batch_start", "batch_id": batch_id, "flow_id": flow_id, "node_id": node_id, "resumed": resumed, "concurrency": limit})
+    producer = asyncio.create_task(produce())
+    finished = False
+    try:
+        next_progress = time.perf_counter() + BATCH_PROGRESS_MS / 1000
+        while True:
+            try:
+                item = await asyncio.wait_for(out.get(), max(0.0, next_progress - time.perf_counter()))
+            except asyncio.TimeoutError:
+                item = b""
+            if item is None:
+                break
+            if item:
+                yield item
+            if time.perf_counter() >= next_progress:
+                next_progress = time.perf_counter() + BATCH_PROGRESS_MS / 1000
+                yield _line({"event": "batch_progress", "batch_id": batch_id, **progress()})
+        finished = True
+    finally:
+        _active.discard(batch_id)
+        if not finished:
+            # Cancelled (or abandoned): stop reading and running; finished rows are checkpointed
+            producer.cancel()
+            for t in list(tasks):
+                t.cancel()
+            summary = progress()
+            get_executor().submit(
+                finish_batch, batch_id, "interrupted", summary["elapsed_ms"], summary["rows_per_sec"], "Batch stopped before finishing"
+            )
+
+    summary = progress()
+    status = "error" if fatal or stats["failed"] else "done"
+    error = fatal[0] if fatal else None
+    await run_db(finish_batch, batch_id, status, summary["elapsed_ms"], summary["rows_per_sec"], error)
+    totals = await run_db(get_batch, batch_id)
+    if error:
+        yield _line({"event": "batch_error", "batch_id": batch_id, "message": error})
+    yield _line({
+        "event": "batch_end",
+        "batch_id": batch_id,
+        "status": status,
+        **summary,
+        "usage": {
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage["completion_tokens"],
+            "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"],
+            "cost_usd": None if usage["cost_usd"] is None else round(usage["cost_usd"], 8),
+        },
+        # Over all attempts of this batch
+        "totals": {k: totals[k] for k in ("rows", "done", "failed")} if totals else None,
+    })
+
+
+def is_active(batch_id: str) -> bool:
+    return batch_id in _active
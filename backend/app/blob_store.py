@@ -0,0 +1,84 @@
+"""
+Content-addressed storage for large run payloads (LM prompts and responses).
+
+Runner workers write any prompt or response of EVENT_BLOB_MIN_CHARS or more to
+`data/blobs/<sha256>.txt`; the event keeps a short preview in the field and a
+`<field>_blob` reference (hash, byte size, URL), so long agent traces are not
+sent over the stream, copied into the browser's event list and recorded in
+run history in full. `GET /api/runs/blobs/{hash}` serves the text on demand.
+
+Identical text is stored once; writing it again refreshes the file's mtime,
+and blobs untouched for longer than history keeps event payloads are swept.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from .db import DATA_DIR
+
+BLOB_DIR = Path(os.environ.get("BLOB_DIR", str(DATA_DIR / "blobs")))
+# Shorter strings stay inline; 0 turns offloading off
+EVENT_BLOB_MIN_CHARS = int(os.environ.get("EVENT_BLOB_MIN_CHARS", "8192"))
+EVENT_BLOB_PREVIEW_CHARS = int(os.environ.get("EVENT_BLOB_PREVIEW_CHARS", "400"))
+
+_HASH = re.compile(r"^[0-9a-f]{64}$")
+
+
+def path_for(digest: str) -> Path | None:
+    """Filesystem path of a stored blob, or None for malformed hashes."""
+    if not _HASH.match(digest):
+        return None
+    return BLOB_DIR / f"{digest}.txt"
+
+
+def put_text(text: str) -> tuple[str, int]:
+    """Store text as UTF-8 under its hash (idempotent); returns (hash, byte size)."""
+    raw = text.encode("utf-8", "replace")
+    digest = hashlib.sha256(raw).hexdigest()
+    path = BLOB_DIR / f"{digest}.txt"
+    try:
+        # Already stored by an earlier call: keep it from being swept
+        os.utime(path)
+    except FileNotFoundError:
+        BLOB_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(raw)
+        os.replace(tmp, path)
+    return digest, len(raw)
+
+
+def offload(event: dict[str, Any], field: str) -> None:
+    """Move a long `event[field]` string to a blob, leaving a preview and `<field>_blob`."""
+    text = event.get(field)
+    if EVENT_BLOB_MIN_CHARS <= 0 or not isinstance(text, str) or len(text) < EVENT_BLOB_MIN_CHARS:
+        return
+    try:
+        digest, size = put_text(text)
+    except OSError:
+        # Disk trouble: send it inline (field caps still apply)
+        return
+    event[field] = text[:EVENT_BLOB_PREVIEW_CHARS]
+    event[f"{field}_blob"] = {"hash": digest, "size": size, "chars": len(text), "url": f"/api/runs/blobs/{digest}"}
+
+
+def sweep(max_age_days: float) -> int:
+    """Delete blobs (and stale temp files) not written for `max_age_days`."""
+    if not BLOB_DIR.exists():
+        return 0
+    cutoff = time.time() - max_age_days * 86_400
+    removed = 0
+    for p in BLOB_DIR.iterdir():
+        try:
+            if p.stat().st_mtime < cutoff:
+                p.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
@@ -1,23 +1,265 @@
+import asyncio
+import contextvars
+import functools
+import os
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable
+from typing import Any, Callable, Iterator, TypeVar
+
+from .metrics import DB_QUERY_SECONDS, route_label
 
 DATA_DIR = Path(__file__).resolve().parent.parent / "data"
 DB_PATH = DATA_DIR / "flows.db"
 
+DB_POOL_SIZE = max(1, int(os.environ.get("DB_POOL_SIZE", "8")))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+
+class DbMetrics:
+    """Running totals for pool waits and statement execution times."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquires = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.queries = 0
+        self.query_ms_total = 0.0
+        self.query_ms_max = 0.0
+
+    def observe_wait(self, ms: float) -> None:
+        with self._lock:
+            self.acquires += 1
+            self.wait_ms_total += ms
+            self.wait_ms_max = max(self.wait_ms_max, ms)
+
+    def observe_query(self, ms: float) -> None:
+        DB_QUERY_SECONDS.observe(ms / 1000, route=route_label())
+        with self._lock:
+            self.queries += 1
+            self.query_ms_total += ms
+            self.query_ms_max = max(self.query_ms_max, ms)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "acquires": self.acquires,
+                "wait_ms_avg": round(self.wait_ms_total / self.acquires, 3) if self.acquires else 0.0,
+                "wait_ms_max": round(self.wait_ms_max, 3),
+                "queries": self.queries,
+                "query_ms_avg": round(self.query_ms_total / self.queries, 3) if self.queries else 0.0,
+                "query_ms_max": round(self.query_ms_max, 3),
+            }
+
+
+metrics = DbMetrics()
+
+
+class _TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that records statement execution time."""
+
+    def execute(self, sql, parameters=(), /):  # type: ignore[override]
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_query((time.perf_counter() - t0) * 1000)
+
+    def executemany(self, sql, seq_of_parameters, /):  # type: ignore[override]
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe_query((time.perf_counter() - t0) * 1000)
 
-def get_connection() -> sqlite3.Connection:
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+
+def _open(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, factory=_TimedConnection)
     conn.row_factory = sqlite3.Row
+    # WAL lets autosave writes proceed without blocking readers
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
     # Ensure FK constraints are enforced for this connection
-    try:
-        conn.execute("PRAGMA foreign_keys = ON")
-    except Exception:
-        pass
+    conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
 
+class ConnectionPool:
+    """Fixed-size, thread-safe pool of configured SQLite connections."""
+
+    def __init__(self, path: Path, size: int = DB_POOL_SIZE):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.size = size
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> sqlite3.Connection:
+        t0 = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._created < self.size
+                if grow:
+                    self._created += 1
+            if grow:
+                try:
+                    conn = _open(self.path)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=DB_POOL_TIMEOUT)
+                except queue.Empty:
+                    raise RuntimeError("Timed out waiting for a database connection")
+        metrics.observe_wait((time.perf_counter() - t0) * 1000)
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            # Broken connection: drop it and let the pool open a new one
+            with self._lock:
+                self._created -= 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        self._idle.put(conn)
+
+    def stats(self) -> dict[str, Any]:
+        return {"size": self.size, "open": self._created, "idle": self._idle.qsize()}
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+
+@contextmanager
+def get_connection() -> Iterator[sqlite3.Connection]:
+    """Borrow a pooled connection; commits on success and rolls back on error."""
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        pool.release(conn)
+
+
+T = TypeVar("T")
+
+# Dedicated executor for blocking SQLite work, sized to the connection pool so
+# a queued call never waits on a connection. Keeps DB calls off the event loop
+# and out of Starlette's shared threadpool.
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+_pending = 0
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+    return _executor
+
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking data-access function on the DB executor and await its result."""
+    global _pending
+    loop = asyncio.get_running_loop()
+    _pending += 1
+    # Carry the request context over so query metrics are labelled by route
+    ctx = contextvars.copy_context()
+    try:
+        return await loop.run_in_executor(get_executor(), functools.partial(ctx.run, fn, *args, **kwargs))
+    finally:
+        _pending -= 1
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+def db_stats() -> dict[str, Any]:
+    return {"pool": get_pool().stats(), "executor": {"workers": DB_POOL_SIZE, "pending": _pending}, **metrics.snapshot()}
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    """Add a column to an existing table unless it is already there."""
+    cols = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _init_flows_fts(conn: sqlite3.Connection) -> None:
+    """External-content FTS5 index over flow names, maintained by triggers.
+
+    Skipped silently when SQLite is built without FTS5; name search then
+    falls back to LIKE.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'flows_fts'").fetchone()
+    if exists:
+        return
+    try:
+        conn.execute("CREATE VIRTUAL TABLE flows_fts USING fts5(name, content='flows', content_rowid='rowid')")
+    except sqlite3.OperationalError:
+        return
+    conn.executescript(
+        """
+        CREATE TRIGGER IF NOT EXISTS flows_fts_ai AFTER INSERT ON flows BEGIN
+            INSERT INTO flows_fts(rowid, name) VALUES (new.rowid, new.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS flows_fts_ad AFTER DELETE ON flows BEGIN
+            INSERT INTO flows_fts(flows_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+        END;
+        CREATE TRIGGER IF NOT EXISTS flows_fts_au AFTER UPDATE OF name ON flows BEGIN
+            INSERT INTO flows_fts(flows_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+            INSERT INTO flows_fts(rowid, name) VALUES (new.rowid, new.name);
+        END;
+        """
+    )
+    conn.execute("INSERT INTO flows_fts(flows_fts) VALUES ('rebuild')")
+
+
 def init_db() -> None:
     with get_connection() as conn:
         conn.execute(
@@ -31,6 +273,10 @@ def init_db() -> None:
             )
             """
         )
+        _add_column(conn, "flows", "last_run_at", "TEXT")
+        # Dashboard listing pages through flows newest-first
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_flows_created ON flows(created_at DESC, id DESC)")
+        _init_flows_fts(conn)
         # Store the latest saved graph/state per flow as a JSON blob
         conn.execute(
             """
@@ -42,6 +288,61 @@ def init_db() -> None:
             )
             """
         )
+        # `version` is the head version (bumped by every PUT/PATCH);
+        # `snapshot_version` is the version `data` was materialized at
+        _add_column(conn, "flow_states", "version", "INTEGER NOT NULL DEFAULT 0")
+        _add_column(conn, "flow_states", "snapshot_version", "INTEGER NOT NULL DEFAULT 0")
+        # Denormalized for the dashboard summary; backfilled from the snapshot
+        _add_column(conn, "flow_states", "node_count", "INTEGER")
+        conn.execute(
+            "UPDATE flow_states SET node_count = json_array_length(data, '$.nodes') WHERE node_count IS NULL"
+        )
+        # Version the flow_nodes/flow_edges rows reflect (-1: never indexed)
+        _add_column(conn, "flow_states", "graph_version", "INTEGER NOT NULL DEFAULT -1")
+        # Deltas applied on top of the snapshot, folded back in by compaction
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS flow_state_patches (
+                flow_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                patch TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (flow_id, version),
+                FOREIGN KEY(flow_id) REFERENCES flows(id) ON DELETE CASCADE
+            )
+            """
+        )
+        # Normalized copy of the state's nodes/edges for per-node access
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS flow_nodes (
+                flow_id TEXT NOT NULL,
+                node_id TEXT NOT NULL,
+                kind TEXT,
+                title TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (flow_id, node_id),
+                FOREIGN KEY(flow_id) REFERENCES flows(id) ON DELETE CASCADE
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS flow_edges (
+                flow_id TEXT NOT NULL,
+                edge_id TEXT NOT NULL,
+                source TEXT,
+                target TEXT,
+                source_handle TEXT,
+                target_handle TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (flow_id, edge_id),
+                FOREIGN KEY(flow_id) REFERENCES flows(id) ON DELETE CASCADE
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_flow_edges_source ON flow_edges(flow_id, source)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_flow_edges_target ON flow_edges(flow_id, target)")
         # Per-flow custom schemas, stored as JSON for flexibility
         conn.execute(
             """
@@ -68,4 +369,132 @@ def init_db() -> None:
             )
             """
         )
+        # Preview bytes live in content-addressed files (app.preview_store);
+        # `image` only holds legacy data URLs until they are migrated out
+        _add_column(conn, "flow_previews", "image_ref", "TEXT")
+        _add_column(conn, "flow_previews", "thumb_ref", "TEXT")
+        _add_column(conn, "flow_previews", "size", "INTEGER")
+        # Memoized node results keyed by a hash of signature, inputs and model
+        # (not tied to a flow so identical nodes share results)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS node_run_cache (
+                key TEXT PRIMARY KEY,
+                flow_id TEXT,
+                node_id TEXT,
+                outputs TEXT NOT NULL,
+                reasoning TEXT,
+                created_at TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        # Run history (app.run_log): one summary row per node run plus its events.
+        # Not tied to flows by foreign key so history outlives deleted flows
+        # until retention removes it. Timestamps are epoch milliseconds.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                flow_id TEXT,
+                node_id TEXT,
+                node_kind TEXT,
+                model TEXT,
+                status TEXT NOT NULL,
+                cached INTEGER NOT NULL DEFAULT 0,
+                started_at INTEGER NOT NULL,
+                ended_at INTEGER,
+                duration_ms INTEGER,
+                lm_calls INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_started ON runs(started_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_flow ON runs(flow_id, started_at)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS run_events (
+                id INTEGER PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                flow_id TEXT,
+                node_id TEXT,
+                event TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                call_id TEXT,
+                model TEXT,
+                duration_ms INTEGER,
+                error TEXT,
+                data TEXT
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_run_events_run ON run_events(run_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_run_events_ts ON run_events(ts)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_run_events_event ON run_events(event, ts)")
+        # Token usage and cost (app.lm_usage), per LM call, node run and flow run
+        for table in ("runs", "run_events"):
+            _add_column(conn, table, "prompt_tokens", "INTEGER")
+            _add_column(conn, table, "completion_tokens", "INTEGER")
+            _add_column(conn, table, "cost_usd", "REAL")
+        _add_column(conn, "runs", "flow_run_id", "TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_flow_run ON runs(flow_run_id)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS flow_runs (
+                flow_run_id TEXT PRIMARY KEY,
+                flow_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                started_at INTEGER NOT NULL,
+                ended_at INTEGER,
+                duration_ms INTEGER,
+                nodes INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                cost_usd REAL,
+                token_budget INTEGER,
+                error TEXT
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_flow_runs_flow ON flow_runs(flow_id, started_at)")
+        # Per-flow token budget; runs exceeding it are aborted (NULL = unlimited)
+        _add_column(conn, "flows", "token_budget", "INTEGER")
+        # Dataset batches (app.batch_runner): one row per batch plus a checkpoint
+        # per finished dataset row, keyed by its index, for resuming
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS batch_runs (
+                batch_id TEXT PRIMARY KEY,
+                flow_id TEXT NOT NULL,
+                node_id TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                started_at INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL,
+                duration_ms INTEGER,
+                rows_per_sec REAL,
+                error TEXT
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_batch_runs_flow ON batch_runs(flow_id, started_at)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS batch_rows (
+                batch_id TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                outputs TEXT,
+                error TEXT,
+                cached INTEGER NOT NULL DEFAULT 0,
+                duration_ms INTEGER,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                cost_usd REAL,
+                finished_at INTEGER NOT NULL,
+                PRIMARY KEY (batch_id, row)
+            ) WITHOUT ROWID
+            """
+        )
         conn.commit()
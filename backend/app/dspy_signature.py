@@ -1,7 +1,16 @@
 from __future__ import annotations
 
+import os
 from typing import Any
 
+import dspy
+
+from .utils import LRUCache, stable_hash
+
+SIGNATURE_CACHE_SIZE = int(os.environ.get("SIGNATURE_CACHE_SIZE", "256"))
+
+_signatures: LRUCache[type] = LRUCache(SIGNATURE_CACHE_SIZE)
+
 
 def py_type(t: str, array_item_type: str | None = None):
     t = (t or "string").lower()
@@ -35,11 +44,25 @@ def py_type(t: str, array_item_type: str | None = None):
     return str
 
 
+def signature_key(signature_name: str, description: str | None, inputs_schema: list[dict], outputs_schema: list[dict]) -> str:
+    """Canonical hash of everything that shapes the generated Signature class."""
+    return stable_hash([signature_name, description, inputs_schema, outputs_schema])
+
+
 def build_signature(signature_name: str, description: str | None, inputs_schema: list[dict], outputs_schema: list[dict]):
-    """Create a DSPy Signature class from simple field schemas.
+    """Create (or reuse) a DSPy Signature class from simple field schemas.
 
-    Skips internal-only input types like 'llm' and 'tool'.
+    Classes are cached by `signature_key` so long-lived runners only build each
+    distinct signature once. Skips internal-only input types like 'llm' and 'tool'.
     """
+    key = signature_key(signature_name, description, inputs_schema, outputs_schema)
+    return _signatures.get_or_create(
+        key,
+        lambda: _build_signature(signature_name, description, inputs_schema, outputs_schema),
+    )
+
+
+def _build_signature(signature_name: str, description: str | None, inputs_schema: list[dict], outputs_schema: list[dict]):
     annotations: dict[str, Any] = {}
     attrs: dict[str, Any] = {}
     if description:
@@ -51,14 +74,18 @@ def build_signature(signature_name: str, description: str | None, inputs_schema:
             continue
         name = f["name"]
         annotations[name] = py_type(f.get("type", "string"), f.get("arrayItemType"))
-        attrs[name] = getattr(__import__("dspy"), "InputField")(desc=f.get("description") or "")
+        attrs[name] = dspy.InputField(desc=f.get("description") or "")
 
     # Outputs
     for f in outputs_schema:
         name = f["name"]
         annotations[name] = py_type(f.get("type", "string"), f.get("arrayItemType"))
-        attrs[name] = getattr(__import__("dspy"), "OutputField")(desc=f.get("description") or "")
+        attrs[name] = dspy.OutputField(desc=f.get("description") or "")
 
     attrs["__annotations__"] = annotations
-    Sig = type(signature_name, (getattr(__import__("dspy"), "Signature"),), attrs)
+    Sig = type(signature_name, (dspy.Signature,), attrs)
     return Sig
+
+
+def signature_cache_stats() -> dict[str, int]:
+    return _signatures.stats()
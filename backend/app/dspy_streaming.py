@@ -1,22 +1,75 @@
 from __future__ import annotations
 
 import json
+import os
+import threading
 import time
-from typing import Any, Callable
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
 
 from dspy.utils.callback import BaseCallback
 
+from . import blob_store, lm_cache, lm_usage
+
+
+def _parse_caps(spec: str) -> dict[str, int]:
+    caps: dict[str, int] = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            caps[name.strip()] = int(value)
+    return caps
+
+
+# Longest value (in characters) any event field may carry; longer strings are
+# cut and marked, longer structures are replaced by their cut JSON
+EVENT_FIELD_MAX_CHARS = int(os.environ.get("EVENT_FIELD_MAX_CHARS", "65536"))
+# Per-field overrides, e.g. "prompt=200000,inputs=8192"
+EVENT_FIELD_CAPS = _parse_caps(os.environ.get("EVENT_FIELD_CAPS", ""))
+# Events whose payload the API consumes (memoization, downstream nodes) are never cut
+_UNCAPPED = frozenset({"result", "example_end"})
+_MIN_CAP = min([EVENT_FIELD_MAX_CHARS, *EVENT_FIELD_CAPS.values()])
+
+# Index of the example being run on this thread (multi-example runs)
+_example = threading.local()
+
+
 def _now_ms() -> int:
     return int(time.time() * 1000)
 
 
+@contextmanager
+def example_row(index: int) -> Iterator[None]:
+    _example.row = index
+    try:
+        yield
+    finally:
+        _example.row = None
+
+
+def current_row() -> int | None:
+    return getattr(_example, "row", None)
+
+
+def tag_rows(emit: Callable[[dict[str, Any]], None]) -> Callable[[dict[str, Any]], None]:
+    """Wrap an emitter so events emitted while running an example carry its `row`."""
+
+    def _emit(obj: dict[str, Any]) -> None:
+        row = current_row()
+        if row is not None:
+            obj["row"] = row
+        emit(obj)
+
+    return _emit
+
+
 class StreamingCallback(BaseCallback):
     """
     Minimal DSPy callback that emits structured JSON events via a provided emitter.
 
-    The emitter is a callable that accepts a JSON-serializable dict. Typical usage
-    is to print a single line of JSON with flush=True so a parent process can parse
-    line-delimited events.
+    The emitter is a callable that accepts an event dict. Values are passed through
+    as-is; `encode_event` turns the dict into a single JSON line (stringifying
+    anything that is not JSON) so a parent process can parse line-delimited events.
     """
 
     def __init__(self, emit: Callable[[dict[str, Any]], None], run_id: str, node_meta: dict[str, Any] | None = None):
@@ -24,87 +77,179 @@ class StreamingCallback(BaseCallback):
         self._emit = emit
         self._run_id = run_id
         self._node_meta = node_meta or {}
+        # Tool calls already reported by `node_runner_stream.wrap_tool`
+        self._wrapped_calls: set[str] = set()
 
     # ---- Module lifecycle ----
-    def on_module_start(self, call_id, inputs):
+    def on_module_start(self, call_id, instance, inputs):
         self._emit({
             "event": "module_start",
             "ts": _now_ms(),
             "run_id": self._run_id,
             "node": self._node_meta,
             "call_id": str(call_id),
-            "inputs": _safe_json(inputs),
+            "module": type(instance).__name__,
+            "inputs": inputs,
         })
 
-    def on_module_end(self, call_id, outputs, exception):
+    def on_module_end(self, call_id, outputs, exception=None):
         self._emit({
             "event": "module_end",
             "ts": _now_ms(),
             "run_id": self._run_id,
             "node": self._node_meta,
             "call_id": str(call_id),
-            "outputs": _safe_json(outputs),
+            "outputs": outputs,
             "exception": _safe_str(exception),
         })
 
     # ---- LM calls ----
-    def on_lm_start(self, call_id, prompt, **kwargs):
-        self._emit({
+    def on_lm_start(self, call_id, instance, inputs):
+        inputs = inputs or {}
+        ev = {
             "event": "lm_start",
             "ts": _now_ms(),
             "run_id": self._run_id,
             "node": self._node_meta,
             "call_id": str(call_id),
-            "prompt": _safe_str(prompt),
-            "params": _safe_json(kwargs),
-        })
+            "model": _safe_str(getattr(instance, "model", None)),
+            "prompt": _format_prompt(inputs),
+            "params": inputs.get("kwargs"),
+        }
+        blob_store.offload(ev, "prompt")
+        self._emit(ev)
 
-    def on_lm_end(self, call_id, response, exception=None, **kwargs):
-        self._emit({
+    def on_lm_end(self, call_id, outputs, exception=None):
+        ev = {
             "event": "lm_end",
             "ts": _now_ms(),
             "run_id": self._run_id,
             "node": self._node_meta,
             "call_id": str(call_id),
-            "response": _safe_str(response),
+            "response": _format_response(outputs),
             "exception": _safe_str(exception),
-            "meta": _safe_json(kwargs),
-        })
+            # Set by CachedLM on this thread during the call that just finished
+            "cache_hit": bool(lm_cache.last_hit()),
+            "usage": lm_usage.last(),
+        }
+        blob_store.offload(ev, "response")
+        self._emit(ev)
 
     # ---- Tool calls (when DSPy wraps as Tool) ----
-    def on_tool_start(self, call_id, tool, inputs):
+    def on_tool_start(self, call_id, instance, inputs):
+        if getattr(getattr(instance, "func", None), "emits_events", False):
+            self._wrapped_calls.add(call_id)
+            return
         self._emit({
             "event": "tool_start",
             "ts": _now_ms(),
             "run_id": self._run_id,
             "node": self._node_meta,
             "call_id": str(call_id),
-            "tool": _safe_str(getattr(tool, "name", getattr(tool, "__name__", str(tool)))),
-            "inputs": _safe_json(inputs),
+            "tool": _safe_str(getattr(instance, "name", getattr(instance, "__name__", str(instance)))),
+            "inputs": inputs,
         })
 
-    def on_tool_end(self, call_id, tool, output, exception):
+    def on_tool_end(self, call_id, outputs, exception=None):
+        if call_id in self._wrapped_calls:
+            self._wrapped_calls.discard(call_id)
+            return
         self._emit({
             "event": "tool_end",
             "ts": _now_ms(),
             "run_id": self._run_id,
             "node": self._node_meta,
             "call_id": str(call_id),
-            "tool": _safe_str(getattr(tool, "name", getattr(tool, "__name__", str(tool)))),
-            "output": _safe_json(output),
+            "output": outputs,
             "exception": _safe_str(exception),
         })
 
 
-def _safe_json(x: Any) -> Any:
+def _format_prompt(inputs: dict[str, Any]) -> str | None:
+    messages = inputs.get("messages")
+    if isinstance(messages, list):
+        parts = []
+        for m in messages:
+            if isinstance(m, dict):
+                parts.append(f"[{m.get('role', 'user')}]\n{m.get('content', '')}")
+            else:
+                parts.append(_safe_str(m) or "")
+        return "\n\n".join(parts)
+    return _safe_str(inputs.get("prompt"))
+
+
+def _format_response(outputs: Any) -> str | None:
+    # dspy.LM returns a list of completions (strings or dicts with "text")
+    if isinstance(outputs, list):
+        texts = [o.get("text") if isinstance(o, dict) else o for o in outputs]
+        return "\n\n".join(_safe_str(t) or "" for t in texts)
+    return _safe_str(outputs)
+
+
+def _fallback(x: Any) -> Any:
+    # Non-JSON values (Predictions, tool objects, ...) are rendered with str()
+    try:
+        return str(x)
+    except Exception:
+        return f"<{type(x).__name__}>"
+
+
+_encoder = json.JSONEncoder(default=_fallback)
+
+
+def _truncate(s: str, cap: int) -> str:
+    return f"{s[:cap]}...[truncated {len(s) - cap} chars]"
+
+
+def _cap_fields(obj: dict[str, Any]) -> dict[str, Any] | None:
+    """Copy of `obj` with the fields over their cap cut, or None if none is."""
+    out: dict[str, Any] | None = None
+    for k, v in obj.items():
+        cap = EVENT_FIELD_CAPS.get(k, EVENT_FIELD_MAX_CHARS)
+        if isinstance(v, str):
+            if len(v) <= cap:
+                continue
+            v = _truncate(v, cap)
+        elif isinstance(v, (dict, list, tuple)):
+            enc = _encoder.encode(v)
+            if len(enc) <= cap:
+                continue
+            v = _truncate(enc, cap)
+        else:
+            continue
+        if out is None:
+            out = dict(obj)
+            out["truncated"] = []
+        out[k] = v
+        out["truncated"].append(k)
+    return out
+
+
+def _coerce(x: Any) -> Any:
     try:
-        json.dumps(x)
+        _encoder.encode(x)
         return x
     except Exception:
-        try:
-            return str(x)
-        except Exception:
-            return None
+        return _safe_str(x)
+
+
+def encode_event(obj: dict[str, Any]) -> str:
+    """Serialize an event to one JSON line (no newline) in a single pass.
+
+    Non-JSON values fall back to `str()`. Only an event longer than the
+    smallest field cap is checked field by field and re-encoded with the
+    oversized fields cut (listed under `truncated`).
+    """
+    try:
+        line = _encoder.encode(obj)
+    except (TypeError, ValueError):
+        # Non-string keys or circular references somewhere in a field
+        obj = {k: _coerce(v) for k, v in obj.items()}
+        line = _encoder.encode(obj)
+    if len(line) <= _MIN_CAP or obj.get("event") in _UNCAPPED or "event" not in obj:
+        return line
+    capped = _cap_fields(obj)
+    return line if capped is None else _encoder.encode(capped)
 
 
 def _safe_str(x: Any) -> str | None:
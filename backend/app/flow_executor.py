@@ -0,0 +1,479 @@
+"""
+Server-side execution of a whole saved flow.
+
+Mirrors the browser's `runAll`/`runWithDeps` logic (input resolution, model
+wiring, tool collection) but schedules compute nodes as a DAG: every node
+starts as soon as its upstream compute nodes have finished, with at most
+`concurrency` nodes in flight. Runner events from all nodes are multiplexed
+into one NDJSON stream and tagged with `node_id`.
+
+Token usage of all nodes counts against one budget; once the flow's
+`token_budget` is exceeded every node still running is cancelled and the run
+ends with status `aborted`.
+
+A flow run can also be stopped with `cancel_flow_run(flow_run_id)` or by its
+wall-clock `timeout`; it then ends with status `cancelled` or `timeout`.
+
+`inputs` replaces the values of `input` nodes by output name, which is how
+`app.batch_runner` runs the same flow once per dataset row.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator
+
+from . import node_cache, run_log
+from .lm_usage import TokenBudget
+from .runner_pool import RunnerError
+
+FLOW_RUN_CONCURRENCY = max(1, int(os.environ.get("FLOW_RUN_CONCURRENCY", "4")))
+
+COMPUTE_KINDS = {"predict", "chainofthought", "agent"}
+# Node events that mean the node itself failed
+_NODE_FAILED = frozenset({"error", "timeout"})
+
+# Keep in sync with `collectToolsForNode` in app/flow/[id]/page.tsx
+BUILTIN_TOOLS_CODE = {
+    "tool_wikipedia": (
+        "def search_wikipedia(query: str):\n"
+        "    results = dspy.ColBERTv2(url=\"http://20.102.90.50:2017/wiki17_abstracts\")(query, k=3)\n"
+        "    return [x[\"text\"] for x in results]\n"
+    ),
+    "tool_math": (
+        "def evaluate_math(expression: str):\n"
+        "    return dspy.PythonInterpreter({}).execute(expression)\n"
+    ),
+}
+
+
+class FlowGraphError(Exception):
+    """The saved graph cannot be executed (cycle, missing nodes, bad tools)."""
+
+
+# Node tasks of the flow runs in progress, for cancellation
+_running: dict[str, list[asyncio.Task]] = {}
+_cancelled: set[str] = set()
+
+
+def cancel_flow_run(flow_run_id: str) -> bool:
+    """Stop every node of a flow run in progress; False if there is none."""
+    tasks = _running.get(flow_run_id)
+    if tasks is None or flow_run_id in _cancelled:
+        return False
+    _cancelled.add(flow_run_id)
+    for t in tasks:
+        t.cancel()
+    return True
+
+
+def _port_id(handle: str | None, prefix: str) -> str:
+    handle = handle or ""
+    return handle[len(prefix):] if handle.startswith(prefix) else handle
+
+
+def _is_model_port(p: dict) -> bool:
+    return p.get("type") == "llm" and p.get("name") == "model"
+
+
+class FlowGraph:
+    """Indexed view over a saved `{nodes, edges}` state."""
+
+    def __init__(self, state: dict[str, Any], inputs: dict[str, Any] | None = None):
+        # Overrides for input node values, by output name
+        self.inputs = inputs or {}
+        self.nodes: dict[str, dict] = {}
+        for n in state.get("nodes") or []:
+            if isinstance(n, dict) and n.get("id"):
+                self.nodes[n["id"]] = n
+        self.edges: list[dict] = [e for e in state.get("edges") or [] if isinstance(e, dict)]
+        self._incoming: dict[str, list[dict]] = {}
+        for e in self.edges:
+            self._incoming.setdefault(e.get("target"), []).append(e)
+
+    def data(self, node_id: str) -> dict:
+        return self.nodes[node_id].get("data") or {}
+
+    def kind(self, node_id: str) -> str | None:
+        return self.data(node_id).get("kind")
+
+    def is_compute(self, node_id: str) -> bool:
+        return node_id in self.nodes and self.kind(node_id) in COMPUTE_KINDS
+
+    def incoming(self, node_id: str, port: dict | None = None) -> list[dict]:
+        edges = self._incoming.get(node_id, [])
+        if port is None:
+            return edges
+        handle = f"in-{port.get('id')}"
+        return [e for e in edges if e.get("targetHandle") == handle]
+
+    def dependencies(self, node_id: str) -> set[str]:
+        """Upstream compute nodes whose outputs feed this node's value inputs."""
+        deps: set[str] = set()
+        for p in self.data(node_id).get("inputs") or []:
+            if _is_model_port(p) or p.get("type") == "tool":
+                continue
+            for e in self.incoming(node_id, p)[:1]:
+                if self.is_compute(e.get("source")):
+                    deps.add(e["source"])
+        return deps
+
+    def select(self, targets: list[str] | None = None) -> set[str]:
+        """Compute nodes needed for `targets` (default: everything feeding output nodes)."""
+        if targets:
+            roots = [t for t in targets if t in self.nodes]
+        else:
+            roots = [nid for nid in self.nodes if self.kind(nid) == "output"]
+            if not roots:
+                roots = [nid for nid in self.nodes if self.is_compute(nid)]
+        selected: set[str] = set()
+        stack = list(roots)
+        seen: set[str] = set()
+        while stack:
+            nid = stack.pop()
+            if nid in seen or nid not in self.nodes:
+                continue
+            seen.add(nid)
+            if self.is_compute(nid):
+                selected.add(nid)
+            for p in self.data(nid).get("inputs") or []:
+                if _is_model_port(p) or p.get("type") == "tool":
+                    continue
+                for e in self.incoming(nid, p)[:1]:
+                    stack.append(e.get("source"))
+        return selected
+
+    def toposort(self, selected: set[str]) -> list[str]:
+        indegree = {nid: 0 for nid in selected}
+        children: dict[str, list[str]] = {nid: [] for nid in selected}
+        for nid in selected:
+            for dep in self.dependencies(nid) & selected:
+                indegree[nid] += 1
+                children[dep].append(nid)
+        ready = [nid for nid, d in indegree.items() if d == 0]
+        order: list[str] = []
+        while ready:
+            nid = ready.pop()
+            order.append(nid)
+            for child in children[nid]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    ready.append(child)
+        if len(order) != len(selected):
+            raise FlowGraphError("Flow graph contains a cycle between compute nodes")
+        return order
+
+    # ---- payload construction (mirrors the browser's runNode) ----
+    def _model_for(self, node_id: str) -> str | None:
+        data = self.data(node_id)
+        for p in data.get("inputs") or []:
+            if not _is_model_port(p):
+                continue
+            edges = self.incoming(node_id, p)
+            if edges:
+                src = self.nodes.get(edges[0].get("source")) or {}
+                return ((src.get("data") or {}).get("llm") or {}).get("model")
+            return (data.get("llm") or {}).get("model")
+        return None
+
+    def _tools_for(self, node_id: str) -> list[str]:
+        data = self.data(node_id)
+        if data.get("kind") != "agent":
+            return []
+        codes: list[str] = []
+        for p in data.get("inputs") or []:
+            if not (p.get("type") == "tool" and p.get("name") == "tools"):
+                continue
+            for e in self.incoming(node_id, p):
+                src = self.nodes.get(e.get("source"))
+                if not src:
+                    raise FlowGraphError("Missing tool source node")
+                skind = (src.get("data") or {}).get("kind")
+                if skind in BUILTIN_TOOLS_CODE:
+                    codes.append(BUILTIN_TOOLS_CODE[skind])
+                elif skind == "tool_python":
+                    code = ((src.get("data") or {}).get("values") or {}).get("code") or ""
+                    if not code.strip():
+                        raise FlowGraphError("Custom Python tool has empty code")
+                    codes.append(code)
+                else:
+                    raise FlowGraphError(f"Unsupported tool node: {skind}")
+        return codes
+
+    def resolve_value(self, edge: dict, outputs: dict[str, dict[str, Any]]) -> Any:
+        src = self.nodes.get(edge.get("source"))
+        if not src:
+            return None
+        sdata = src.get("data") or {}
+        port_id = _port_id(edge.get("sourceHandle"), "out-")
+        name = next((op.get("name") for op in sdata.get("outputs") or [] if op.get("id") == port_id), "")
+        if sdata.get("kind") == "input":
+            if name in self.inputs:
+                return self.inputs[name]
+            return (sdata.get("values") or {}).get(name)
+        return (outputs.get(src["id"]) or {}).get(name)
+
+    def build_payload(
+        self,
+        node_id: str,
+        outputs: dict[str, dict[str, Any]],
+        values_override: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
+        """Runner payload for a node; `values_override` supplies input values by name."""
+        data = self.data(node_id)
+        values: dict[str, Any] = {}
+        for p in data.get("inputs") or []:
+            if _is_model_port(p) or p.get("type") == "tool":
+                continue
+            edges = self.incoming(node_id, p)
+            if values_override and p.get("name") in values_override:
+                v = values_override[p.get("name")]
+            elif edges:
+                v = self.resolve_value(edges[0], outputs)
+                if v is None:
+                    raise FlowGraphError(f"Upstream value for {p.get('name')} not available")
+            else:
+                v = (data.get("values") or {}).get(p.get("name"))
+                if v is None or v == "":
+                    raise FlowGraphError(f"Input {p.get('name')} is not connected and has no value")
+            values[p.get("name")] = v
+
+        def field(p: dict) -> dict:
+            return {
+                "name": p.get("name"),
+                "type": p.get("type"),
+                "description": p.get("description"),
+                "arrayItemType": p.get("arrayItemType"),
+            }
+
+        llm = data.get("llm") or {}
+        lm_params = {k: llm.get(k) for k in ("temperature", "top_p", "max_tokens") if llm.get(k) is not None}
+        return {
+            "node_id": node_id,
+            "node_kind": data.get("kind"),
+            "node_title": data.get("title"),
+            "node_description": data.get("description"),
+            "inputs_schema": [field(p) for p in data.get("inputs") or [] if not _is_model_port(p) and p.get("type") != "tool"],
+            "outputs_schema": [field(p) for p in data.get("outputs") or []],
+            "inputs_values": values,
+            "model": self._model_for(node_id),
+            "lm_params": lm_params or None,
+            "tools_code": self._tools_for(node_id) or None,
+        }
+
+    def output_values(self, outputs: dict[str, dict[str, Any]]) -> dict[str, dict[str, Any]]:
+        """Values arriving at each output node after the run."""
+        res: dict[str, dict[str, Any]] = {}
+        for nid in self.nodes:
+            if self.kind(nid) != "output":
+                continue
+            vals: dict[str, Any] = {}
+            for p in self.data(nid).get("inputs") or []:
+                for e in self.incoming(nid, p)[:1]:
+                    vals[p.get("name")] = self.resolve_value(e, outputs)
+            res[nid] = vals
+        return res
+
+
+def _line(obj: dict[str, Any]) -> bytes:
+    return (json.dumps(obj) + "\n").encode("utf-8")
+
+
+async def execute_flow(
+    flow_id: str,
+    state: dict[str, Any],
+    *,
+    concurrency: int | None = None,
+    targets: list[str] | None = None,
+    token_budget: int | None = None,
+    inputs: dict[str, Any] | None = None,
+    timeout: float | None = None,
+    flow_run_id: str | None = None,
+) -> AsyncIterator[bytes]:
+    """Run the compute nodes of `state` and yield multiplexed NDJSON event lines."""
+    flow_run_id = flow_run_id or uuid.uuid4().hex
+    started_at = int(time.time() * 1000)
+    limit = max(1, concurrency or FLOW_RUN_CONCURRENCY)
+    graph = FlowGraph(state, inputs)
+    try:
+        order = graph.toposort(graph.select(targets))
+    except FlowGraphError as e:
+        yield _line({"event": "flow_error", "flow_id": flow_id, "message": str(e)})
+        return
+
+    budget = TokenBudget(token_budget)
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "cost_usd": None}
+    run_log.record_flow_run({
+        "flow_run_id": flow_run_id, "flow_id": flow_id, "status": "running", "started_at": started_at,
+        "nodes": len(order), "token_budget": token_budget,
+    })
+    yield _line({
+        "event": "flow_start", "flow_id": flow_id, "flow_run_id": flow_run_id, "nodes": order,
+        "concurrency": limit, "token_budget": token_budget,
+    })
+
+    queue: asyncio.Queue[bytes | None] = asyncio.Queue()
+    outputs: dict[str, dict[str, Any]] = {}
+    status: dict[str, str] = {}
+    done: dict[str, asyncio.Event] = {nid: asyncio.Event() for nid in order}
+    sem = asyncio.Semaphore(limit)
+
+    async def run_one(nid: str) -> None:
+        try:
+            deps = graph.dependencies(nid) & set(order)
+            for dep in deps:
+                await done[dep].wait()
+            failed = [d for d in deps if status.get(d) != "done"]
+            if failed:
+                status[nid] = "skipped"
+                await queue.put(_line({"event": "node_skipped", "node_id": nid, "reason": f"Upstream node failed: {', '.join(sorted(failed))}"}))
+                return
+            try:
+                payload = graph.build_payload(nid, outputs)
+            except FlowGraphError as e:
+                status[nid] = "error"
+                await queue.put(_line({"event": "error", "node_id": nid, "message": str(e)}))
+                return
+            async with sem:
+                try:
+                    async for raw in node_cache.memoized_stream(flow_id, payload, budget=budget, flow_run_id=flow_run_id):
+                        try:
+                            ev = json.loads(raw)
+                        except Exception:
+                            continue
+                        ev["node_id"] = nid
+                        if ev.get("event") in _NODE_FAILED:
+                            status[nid] = "error"
+                        elif ev.get("event") == "cancelled":
+                            status.setdefault(nid, "cancelled")
+                        if ev.get("event") == "lm_end" and ev.get("usage"):
+                            u = ev["usage"]
+                            usage["prompt_tokens"] += u.get("prompt_tokens") or 0
+                            usage["completion_tokens"] += u.get("completion_tokens") or 0
+                            if u.get("cost_usd") is not None:
+                                usage["cost_usd"] = (usage["cost_usd"] or 0.0) + u["cost_usd"]
+                        if ev.get("event") == "result":
+                            outputs[nid] = ev.get("outputs") or {}
+                            status[nid] = "done"
+                        await queue.put(_line(ev))
+                except RunnerError as e:
+                    status[nid] = "error"
+                    await queue.put(_line({"event": "error", "node_id": nid, "message": str(e)}))
+        except asyncio.CancelledError:
+            # Stopped by the flow (cancel, timeout, budget): counted as skipped, not failed
+            status.setdefault(nid, "cancelled")
+            raise
+        finally:
+            done[nid].set()
+
+    tasks = [asyncio.create_task(run_one(nid)) for nid in order]
+    watcher = asyncio.create_task(_close_when_done(tasks, queue))
+    _running[flow_run_id] = tasks
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout else None
+    timed_out = False
+    finished = False
+    try:
+        while True:
+            try:
+                if deadline is None or timed_out:
+                    item = await queue.get()
+                else:
+                    item = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                # Out of time: cancel like an exceeded budget
+                timed_out = True
+                for t in tasks:
+                    t.cancel()
+                continue
+            if item is None:
+                break
+            yield item
+            if budget.exceeded:
+                # Over budget: cancel the nodes still running or waiting;
+                # the watcher ends the stream once they have unwound
+                for t in tasks:
+                    t.cancel()
+        finished = True
+    finally:
+        # Consumer went away (or we finished): stop any node still running
+        for t in tasks:
+            t.cancel()
+        watcher.cancel()
+        _running.pop(flow_run_id, None)
+        cancelled = flow_run_id in _cancelled
+        _cancelled.discard(flow_run_id)
+        if not finished:
+            run_log.record_flow_run(_flow_run_row(flow_run_id, flow_id, started_at, order, usage, token_budget, "aborted", "Run stopped before finishing"))
+
+    counts = {s: sum(1 for v in status.values() if v == s) for s in ("done", "error")}
+    # Skipped upstream failures plus nodes the flow stopped (budget, timeout,
+    # cancel), whether they were waiting or in flight
+    counts["skipped"] = len(order) - counts["done"] - counts["error"]
+    reason = None
+    if cancelled:
+        flow_status, reason, error = "cancelled", "cancelled", "Flow run cancelled"
+    elif timed_out:
+        flow_status, reason, error = "timeout", "wall_clock", f"Flow run timed out after {timeout:g}s"
+    elif budget.exceeded:
+        flow_status, reason = "aborted", "token_budget"
+        error = f"Token budget exceeded ({budget.used} > {budget.limit} tokens)"
+    else:
+        flow_status = "done" if counts["done"] == len(order) else "error"
+        error = None
+    row = _flow_run_row(flow_run_id, flow_id, started_at, order, usage, token_budget, flow_status, error)
+    run_log.record_flow_run(row)
+    yield _line({
+        "event": "flow_end",
+        "flow_id": flow_id,
+        "flow_run_id": flow_run_id,
+        "status": flow_status,
+        **({"reason": reason, "message": error} if reason else {}),
+        "duration_ms": row["duration_ms"],
+        "completed": counts["done"],
+        "failed": counts["error"],
+        "skipped": counts["skipped"],
+        "usage": {
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage["completion_tokens"],
+            "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"],
+            "cost_usd": row["cost_usd"],
+        },
+        "outputs": graph.output_values(outputs),
+    })
+
+
+def _flow_run_row(
+    flow_run_id: str,
+    flow_id: str,
+    started_at: int,
+    order: list[str],
+    usage: dict[str, Any],
+    token_budget: int | None,
+    status: str,
+    error: str | None,
+) -> dict[str, Any]:
+    ended_at = int(time.time() * 1000)
+    return {
+        "flow_run_id": flow_run_id,
+        "flow_id": flow_id,
+        "status": status,
+        "started_at": started_at,
+        "ended_at": ended_at,
+        "duration_ms": ended_at - started_at,
+        "nodes": len(order),
+        "prompt_tokens": usage["prompt_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+        "cost_usd": None if usage["cost_usd"] is None else round(usage["cost_usd"], 8),
+        "token_budget": token_budget,
+        "error": error,
+    }
+
+
+async def _close_when_done(tasks: list[asyncio.Task], queue: asyncio.Queue) -> None:
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await queue.put(None)
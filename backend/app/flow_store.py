@@ -0,0 +1,858 @@
+"""
+Data access for the flows, flow_states, flow_schemas and flow_previews tables.
+
+Every function is synchronous and borrows a pooled connection; async route
+handlers call them through `app.db.run_db` so blocking SQLite work happens on
+the dedicated DB executor instead of the event loop or Starlette's threadpool.
+Functions return None/False for missing rows and leave HTTP errors to routes.
+"""
+
+from __future__ import annotations
+
+import base64
+import itertools
+import json
+import os
+import re
+import sqlite3
+import time
+from typing import IO, Any, Iterator
+
+from . import preview_store
+from .db import get_connection
+from .metrics import STATE_JSON_SECONDS
+from .state_patch import apply_state_patch
+from .utils import LRUCache, new_id, now_iso, slugify
+
+FLOW_COLUMNS = "id, name, slug, created_at, updated_at"
+SCHEMA_COLUMNS = "id, flow_id, name, description, fields, created_at, updated_at"
+
+# Fold state patches back into the snapshot after this many
+STATE_COMPACT_EVERY = max(1, int(os.environ.get("STATE_COMPACT_EVERY", "50")))
+STATE_CACHE_SIZE = int(os.environ.get("STATE_CACHE_SIZE", "64"))
+# Keep flow_nodes/flow_edges in sync on every save; when off they are
+# rebuilt on first use by the node endpoints instead
+FLOW_GRAPH_EAGER_SYNC = os.environ.get("FLOW_GRAPH_EAGER_SYNC", "1").lower() not in ("0", "false", "no")
+
+# flow_id -> (version, materialized state). States are never mutated in place
+# (patches are applied copy-on-write), so cached objects can be handed out as is.
+_states: LRUCache[tuple[int, dict[str, Any]]] = LRUCache(STATE_CACHE_SIZE)
+
+
+def _unique_slug(conn: sqlite3.Connection, base: str, exclude_id: str | None = None) -> str:
+    """Ensure slug uniqueness by suffixing -2, -3, ... when needed (uses the caller's connection)."""
+    slug = base
+    idx = 1
+    while True:
+        params: tuple = (slug,)
+        query = "SELECT id FROM flows WHERE slug = ?"
+        if exclude_id:
+            query += " AND id != ?"
+            params = (slug, exclude_id)
+        cur = conn.execute(query, params)
+        row = cur.fetchone()
+        if not row:
+            return slug
+        idx += 1
+        slug = f"{base}-{idx}"
+
+
+def _dumps_state(obj: Any) -> str:
+    """json.dumps for states and patches, timed for /metrics."""
+    t0 = time.perf_counter()
+    try:
+        return json.dumps(obj)
+    finally:
+        STATE_JSON_SECONDS.observe(time.perf_counter() - t0, op="encode")
+
+
+def _loads_state(raw: str) -> Any:
+    t0 = time.perf_counter()
+    try:
+        return json.loads(raw)
+    finally:
+        STATE_JSON_SECONDS.observe(time.perf_counter() - t0, op="decode")
+
+
+def _schema_dict(row: sqlite3.Row) -> dict[str, Any]:
+    d = dict(row)
+    d["fields"] = json.loads(d["fields"])
+    return d
+
+
+# ---- flows ----
+
+def flow_exists(flow_id: str) -> bool:
+    with get_connection() as conn:
+        return conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,)).fetchone() is not None
+
+
+class CursorError(ValueError):
+    """A pagination cursor could not be decoded."""
+
+
+def encode_cursor(created_at: str, flow_id: str) -> str:
+    raw = json.dumps([created_at, flow_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, flow_id = json.loads(raw)
+        return str(created_at), str(flow_id)
+    except Exception:
+        raise CursorError("Invalid cursor")
+
+
+def _fts_query(q: str) -> str | None:
+    # Prefix-match every word; quoting keeps FTS5 syntax characters literal
+    tokens = re.findall(r"\w+", q)
+    return " ".join(f'"{t}"*' for t in tokens) or None
+
+
+def _has_fts(conn: sqlite3.Connection) -> bool:
+    global _fts
+    if _fts is None:
+        _fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'flows_fts'").fetchone() is not None
+    return _fts
+
+
+_fts: bool | None = None
+
+
+def _page(
+    conn: sqlite3.Connection,
+    columns: str,
+    joins: str = "",
+    *,
+    limit: int | None,
+    cursor: str | None,
+    q: str | None,
+) -> tuple[list[dict[str, Any]], str | None]:
+    """Newest-first keyset page over `flows f` (index on created_at, id) plus the next cursor."""
+    where: list[str] = []
+    params: list[Any] = []
+    if cursor:
+        where.append("(f.created_at, f.id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+    if q and q.strip():
+        match = _fts_query(q) if _has_fts(conn) else None
+        if match:
+            where.append("f.rowid IN (SELECT rowid FROM flows_fts WHERE flows_fts MATCH ?)")
+            params.append(match)
+        else:
+            where.append("f.name LIKE ? ESCAPE '\\'")
+            params.append("%" + re.sub(r"([\\%_])", r"\\\1", q.strip()) + "%")
+    sql = f"SELECT {columns} FROM flows f {joins}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY f.created_at DESC, f.id DESC"
+    if limit:
+        # One extra row tells us whether there is a next page
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+    rows = [dict(r) for r in conn.execute(sql, params).fetchall()]
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
+
+
+def list_flows(
+    limit: int | None = None,
+    cursor: str | None = None,
+    q: str | None = None,
+) -> tuple[list[dict[str, Any]], str | None]:
+    """Flows newest-first, optionally filtered by name; returns (rows, next_cursor)."""
+    cols = ", ".join(f"f.{c.strip()}" for c in FLOW_COLUMNS.split(","))
+    with get_connection() as conn:
+        return _page(conn, cols, limit=limit, cursor=cursor, q=q)
+
+
+def list_summaries(
+    limit: int | None = None,
+    cursor: str | None = None,
+    q: str | None = None,
+) -> tuple[list[dict[str, Any]], str | None]:
+    """Dashboard rows: flow metadata, node count, last run time and thumbnail ref in one query."""
+    cols = (
+        "f.id, f.name, f.slug, f.created_at, f.updated_at, f.last_run_at, "
+        "COALESCE(s.node_count, 0) AS node_count, p.thumb_ref"
+    )
+    joins = (
+        "LEFT JOIN flow_states s ON s.flow_id = f.id "
+        "LEFT JOIN flow_previews p ON p.flow_id = f.id AND p.image_ref IS NOT NULL"
+    )
+    with get_connection() as conn:
+        return _page(conn, cols, joins, limit=limit, cursor=cursor, q=q)
+
+
+def mark_run(flow_id: str) -> dict[str, Any] | None:
+    """Record that a run of the flow started; returns its run settings ({token_budget}) or None if missing."""
+    with get_connection() as conn:
+        row = conn.execute(
+            "UPDATE flows SET last_run_at = ? WHERE id = ? RETURNING token_budget",
+            (now_iso(), flow_id),
+        ).fetchone()
+        return {"token_budget": row["token_budget"]} if row else None
+
+
+def set_token_budget(flow_id: str, token_budget: int | None) -> bool:
+    with get_connection() as conn:
+        return conn.execute("UPDATE flows SET token_budget = ? WHERE id = ?", (token_budget, flow_id)).rowcount > 0
+
+
+def get_token_budget(flow_id: str) -> dict[str, Any] | None:
+    with get_connection() as conn:
+        row = conn.execute("SELECT token_budget FROM flows WHERE id = ?", (flow_id,)).fetchone()
+        return {"token_budget": row["token_budget"]} if row else None
+
+
+def create_flow(name: str) -> dict[str, Any]:
+    flow_id = new_id()
+    created_at = updated_at = now_iso()
+    with get_connection() as conn:
+        slug = _unique_slug(conn, slugify(name))
+        conn.execute(
+            "INSERT INTO flows (id, name, slug, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (flow_id, name, slug, created_at, updated_at),
+        )
+    return {"id": flow_id, "name": name, "slug": slug, "created_at": created_at, "updated_at": updated_at}
+
+
+def get_flow(flow_id: str) -> dict[str, Any] | None:
+    with get_connection() as conn:
+        row = conn.execute(f"SELECT {FLOW_COLUMNS} FROM flows WHERE id = ?", (flow_id,)).fetchone()
+        return dict(row) if row else None
+
+
+def rename_flow(flow_id: str, name: str) -> dict[str, Any] | None:
+    with get_connection() as conn:
+        if not conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,)).fetchone():
+            return None
+        slug = _unique_slug(conn, slugify(name), exclude_id=flow_id)
+        conn.execute(
+            "UPDATE flows SET name = ?, slug = ?, updated_at = ? WHERE id = ?",
+            (name, slug, now_iso(), flow_id),
+        )
+        row = conn.execute(f"SELECT {FLOW_COLUMNS} FROM flows WHERE id = ?", (flow_id,)).fetchone()
+        return dict(row)
+
+
+def delete_flow(flow_id: str) -> bool:
+    _states.pop(flow_id)
+    with get_connection() as conn:
+        return conn.execute("DELETE FROM flows WHERE id = ?", (flow_id,)).rowcount > 0
+
+
+# ---- state ----
+
+class StateConflict(Exception):
+    """The caller's base version is not the flow's current state version."""
+
+    def __init__(self, version: int):
+        super().__init__(f"Flow state is at version {version}")
+        self.version = version
+
+
+def _empty_state() -> dict[str, Any]:
+    return {"nodes": [], "edges": []}
+
+
+def _node_count(state: dict[str, Any]) -> int:
+    nodes = state.get("nodes")
+    return len(nodes) if isinstance(nodes, list) else 0
+
+
+def _head(conn: sqlite3.Connection, flow_id: str) -> dict[str, Any] | None:
+    """Current state of a flow: the snapshot with pending patches applied.
+
+    Served from `_states` when the cached version matches, which skips reading
+    and parsing the snapshot blob. None when no state was ever saved.
+    """
+    row = conn.execute(
+        "SELECT version, snapshot_version, graph_version, updated_at FROM flow_states WHERE flow_id = ?",
+        (flow_id,),
+    ).fetchone()
+    if not row:
+        return None
+    head = dict(row)
+    cached = _states.get(flow_id)
+    if cached is not None and cached[0] == head["version"]:
+        head["data"] = cached[1]
+        return head
+
+    snap = conn.execute("SELECT data FROM flow_states WHERE flow_id = ?", (flow_id,)).fetchone()
+    state = _loads_state(snap["data"])
+    patches = conn.execute(
+        "SELECT patch FROM flow_state_patches WHERE flow_id = ? AND version > ? AND version <= ? ORDER BY version",
+        (flow_id, head["snapshot_version"], head["version"]),
+    )
+    for p in patches.fetchall():
+        state = apply_state_patch(state, _loads_state(p["patch"]))
+    _states.put(flow_id, (head["version"], state))
+    head["data"] = state
+    return head
+
+
+def _compact(conn: sqlite3.Connection, flow_id: str, version: int, state: dict[str, Any]) -> None:
+    """Fold patches up to `version` into the snapshot."""
+    conn.execute(
+        "UPDATE flow_states SET data = ?, snapshot_version = ? WHERE flow_id = ?",
+        (_dumps_state(state), version, flow_id),
+    )
+    conn.execute("DELETE FROM flow_state_patches WHERE flow_id = ? AND version <= ?", (flow_id, version))
+
+
+def get_state(flow_id: str) -> dict[str, Any] | None:
+    """Saved graph for a flow as {data, version, updated_at}; None if the flow does not exist."""
+    with get_connection() as conn:
+        if not conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,)).fetchone():
+            return None
+        head = _head(conn, flow_id)
+    if head is None:
+        # Empty default state if none saved yet
+        return {"data": _empty_state(), "version": 0, "updated_at": now_iso()}
+    return {"data": head["data"], "version": head["version"], "updated_at": head["updated_at"]}
+
+
+def put_state(flow_id: str, data: dict[str, Any], base_version: int | None = None) -> dict[str, Any] | None:
+    """Replace the saved graph with a new snapshot.
+
+    Returns {version, updated_at}, or None if the flow does not exist. Raises
+    StateConflict when `base_version` is given and is not the current version.
+    """
+    data_json = _dumps_state(data)
+    updated_at = now_iso()
+    with get_connection() as conn:
+        # Take the write lock up front so the version check and write are atomic
+        conn.execute("BEGIN IMMEDIATE")
+        if not conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,)).fetchone():
+            return None
+        prev = conn.execute("SELECT version, graph_version FROM flow_states WHERE flow_id = ?", (flow_id,)).fetchone()
+        current = prev["version"] if prev else 0
+        if base_version is not None and current != base_version:
+            raise StateConflict(current)
+        row = conn.execute(
+            """
+            INSERT INTO flow_states (flow_id, data, updated_at, version, snapshot_version, node_count)
+            VALUES (?, ?, ?, 1, 1, ?)
+            ON CONFLICT(flow_id) DO UPDATE SET
+                data = excluded.data,
+                updated_at = excluded.updated_at,
+                node_count = excluded.node_count,
+                version = flow_states.version + 1,
+                snapshot_version = flow_states.version + 1
+            RETURNING version
+            """,
+            (flow_id, data_json, updated_at, _node_count(data)),
+        ).fetchone()
+        version = row["version"]
+        conn.execute("DELETE FROM flow_state_patches WHERE flow_id = ?", (flow_id,))
+        if FLOW_GRAPH_EAGER_SYNC:
+            # Diff against the cached head when it is what the index holds
+            cached = _states.get(flow_id)
+            indexed = prev is not None and prev["graph_version"] == current
+            old = cached[1] if indexed and cached is not None and cached[0] == current else None
+            _sync_graph(conn, flow_id, version, data, old)
+    _states.put(flow_id, (version, data))
+    return {"version": version, "updated_at": updated_at}
+
+
+def patch_state(flow_id: str, base_version: int, patch: dict[str, Any]) -> dict[str, Any] | None:
+    """Apply a delta on top of `base_version` and store it as a patch row.
+
+    Only the delta is written; every STATE_COMPACT_EVERY patches the head is
+    folded back into the snapshot. Returns {version, updated_at, compacted},
+    None if the flow does not exist. Raises StateConflict on a stale base
+    version and `PatchError` if the delta does not apply.
+    """
+    updated_at = now_iso()
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if not conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,)).fetchone():
+            return None
+        head = _head(conn, flow_id)
+        if head is None:
+            head = {"version": 0, "snapshot_version": 0, "graph_version": -1, "data": _empty_state()}
+            conn.execute(
+                "INSERT INTO flow_states (flow_id, data, updated_at) VALUES (?, ?, ?)",
+                (flow_id, json.dumps(head["data"]), updated_at),
+            )
+        if head["version"] != base_version:
+            raise StateConflict(head["version"])
+
+        state = apply_state_patch(head["data"], patch)
+        version = base_version + 1
+        conn.execute(
+            "UPDATE flow_states SET version = ?, updated_at = ?, node_count = ? WHERE flow_id = ?",
+            (version, updated_at, _node_count(state), flow_id),
+        )
+        conn.execute(
+            "INSERT INTO flow_state_patches (flow_id, version, patch, created_at) VALUES (?, ?, ?, ?)",
+            (flow_id, version, _dumps_state(patch), updated_at),
+        )
+        compacted = version - head["snapshot_version"] >= STATE_COMPACT_EVERY
+        if compacted:
+            _compact(conn, flow_id, version, state)
+        if FLOW_GRAPH_EAGER_SYNC:
+            old = head["data"] if head.get("graph_version") == base_version else None
+            _sync_graph(conn, flow_id, version, state, old)
+    _states.put(flow_id, (version, state))
+    return {"version": version, "updated_at": updated_at, "compacted": compacted}
+
+
+def compact_state(flow_id: str) -> dict[str, Any] | None:
+    """Fold all pending patches into the snapshot now. None if the flow does not exist."""
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if not conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,)).fetchone():
+            return None
+        head = _head(conn, flow_id)
+        if head is None:
+            return {"version": 0, "folded": 0}
+        folded = head["version"] - head["snapshot_version"]
+        if folded:
+            _compact(conn, flow_id, head["version"], head["data"])
+    return {"version": head["version"], "folded": folded}
+
+
+# ---- normalized nodes/edges ----
+
+def _by_id(items: Any) -> dict[str, dict[str, Any]]:
+    return {
+        it["id"]: it
+        for it in items or []
+        if isinstance(it, dict) and isinstance(it.get("id"), str)
+    }
+
+
+def _node_row(flow_id: str, node: dict[str, Any]) -> tuple:
+    data = node.get("data") if isinstance(node.get("data"), dict) else {}
+    return (flow_id, node["id"], data.get("kind"), data.get("title"), json.dumps(node))
+
+
+def _edge_row(flow_id: str, edge: dict[str, Any]) -> tuple:
+    return (
+        flow_id,
+        edge["id"],
+        edge.get("source"),
+        edge.get("target"),
+        edge.get("sourceHandle"),
+        edge.get("targetHandle"),
+        json.dumps(edge),
+    )
+
+
+def _sync_graph(
+    conn: sqlite3.Connection,
+    flow_id: str,
+    version: int,
+    state: dict[str, Any],
+    old: dict[str, Any] | None = None,
+) -> None:
+    """Bring flow_nodes/flow_edges in line with `state`.
+
+    With `old` (the state the rows currently reflect) only added, changed and
+    removed items are written; patched states share unchanged node objects
+    with their base, so the comparison is mostly identity checks.
+    """
+    for table, key, items, old_items, to_row, cols in (
+        ("flow_nodes", "node_id", state.get("nodes"), old and old.get("nodes"), _node_row, 5),
+        ("flow_edges", "edge_id", state.get("edges"), old and old.get("edges"), _edge_row, 7),
+    ):
+        new_map = _by_id(items)
+        placeholders = ", ".join("?" * cols)
+        if old is None:
+            conn.execute(f"DELETE FROM {table} WHERE flow_id = ?", (flow_id,))
+            changed = list(new_map.values())
+        else:
+            old_map = _by_id(old_items)
+            removed = [(flow_id, k) for k in old_map.keys() - new_map.keys()]
+            if removed:
+                conn.executemany(f"DELETE FROM {table} WHERE flow_id = ? AND {key} = ?", removed)
+            changed = [
+                it for k, it in new_map.items()
+                if old_map.get(k) is not it and old_map.get(k) != it
+            ]
+        if changed:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})",
+                [to_row(flow_id, it) for it in changed],
+            )
+    conn.execute("UPDATE flow_states SET graph_version = ? WHERE flow_id = ?", (version, flow_id))
+
+
+def _ensure_graph(conn: sqlite3.Connection, flow_id: str) -> bool:
+    """Rebuild the node/edge rows if they lag the state. False if the flow does not exist."""
+    if not conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,)).fetchone():
+        return False
+    row = conn.execute("SELECT version, graph_version FROM flow_states WHERE flow_id = ?", (flow_id,)).fetchone()
+    if row and row["graph_version"] != row["version"]:
+        head = _head(conn, flow_id)
+        _sync_graph(conn, flow_id, head["version"], head["data"])
+    return True
+
+
+def get_node(flow_id: str, node_id: str) -> dict[str, Any] | None:
+    """One node of the saved graph; raises LookupError if the flow does not exist."""
+    with get_connection() as conn:
+        if not _ensure_graph(conn, flow_id):
+            raise LookupError("Flow not found")
+        row = conn.execute(
+            "SELECT data FROM flow_nodes WHERE flow_id = ? AND node_id = ?",
+            (flow_id, node_id),
+        ).fetchone()
+    return json.loads(row["data"]) if row else None
+
+
+_UPSTREAM_CTE = """
+    WITH RECURSIVE up(node_id) AS (
+        SELECT ?
+        UNION
+        SELECT e.source FROM up CROSS JOIN flow_edges e ON e.flow_id = ? AND e.target = up.node_id
+    )
+"""
+
+
+def get_upstream(flow_id: str, node_id: str) -> dict[str, Any] | None:
+    """A node plus everything feeding it (transitively) and the edges between them.
+
+    Returns None if the node does not exist; raises LookupError if the flow does not.
+    """
+    with get_connection() as conn:
+        if not _ensure_graph(conn, flow_id):
+            raise LookupError("Flow not found")
+        if not conn.execute(
+            "SELECT 1 FROM flow_nodes WHERE flow_id = ? AND node_id = ?",
+            (flow_id, node_id),
+        ).fetchone():
+            return None
+        nodes = conn.execute(
+            _UPSTREAM_CTE + "SELECT n.data FROM flow_nodes n JOIN up ON n.flow_id = ? AND n.node_id = up.node_id",
+            (node_id, flow_id, flow_id),
+        ).fetchall()
+        edges = conn.execute(
+            _UPSTREAM_CTE + "SELECT e.data FROM flow_edges e WHERE e.flow_id = ? AND e.target IN (SELECT node_id FROM up)",
+            (node_id, flow_id, flow_id),
+        ).fetchall()
+    return {
+        "nodes": [json.loads(r["data"]) for r in nodes],
+        "edges": [json.loads(r["data"]) for r in edges],
+    }
+
+
+# ---- schemas ----
+
+def list_schemas(flow_id: str, *, oldest_first: bool = False) -> list[dict[str, Any]] | None:
+    order = "ASC" if oldest_first else "DESC"
+    with get_connection() as conn:
+        if not conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,)).fetchone():
+            return None
+        cur = conn.execute(
+            f"SELECT {SCHEMA_COLUMNS} FROM flow_schemas WHERE flow_id = ? ORDER BY created_at {order}",
+            (flow_id,),
+        )
+        return [_schema_dict(row) for row in cur.fetchall()]
+
+
+def create_schema(flow_id: str, name: str, description: str | None, fields: list[dict]) -> dict[str, Any] | None:
+    schema_id = new_id()
+    now = now_iso()
+    with get_connection() as conn:
+        if not conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,)).fetchone():
+            return None
+        conn.execute(
+            f"INSERT INTO flow_schemas ({SCHEMA_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (schema_id, flow_id, name, description, json.dumps(fields), now, now),
+        )
+    return {
+        "id": schema_id,
+        "flow_id": flow_id,
+        "name": name,
+        "description": description,
+        "fields": fields,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def get_schema(flow_id: str, schema_id: str) -> dict[str, Any] | None:
+    with get_connection() as conn:
+        row = conn.execute(
+            f"SELECT {SCHEMA_COLUMNS} FROM flow_schemas WHERE id = ? AND flow_id = ?",
+            (schema_id, flow_id),
+        ).fetchone()
+        return _schema_dict(row) if row else None
+
+
+def update_schema(flow_id: str, schema_id: str, name: str, description: str | None, fields: list[dict]) -> dict[str, Any] | None:
+    now = now_iso()
+    with get_connection() as conn:
+        cur = conn.execute(
+            "UPDATE flow_schemas SET name = ?, description = ?, fields = ?, updated_at = ? WHERE id = ? AND flow_id = ?",
+            (name, description, json.dumps(fields), now, schema_id, flow_id),
+        )
+        if cur.rowcount == 0:
+            return None
+    return {
+        "id": schema_id,
+        "flow_id": flow_id,
+        "name": name,
+        "description": description,
+        "fields": fields,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def delete_schema(flow_id: str, schema_id: str) -> bool:
+    with get_connection() as conn:
+        return conn.execute(
+            "DELETE FROM flow_schemas WHERE id = ? AND flow_id = ?",
+            (schema_id, flow_id),
+        ).rowcount > 0
+
+
+# ---- import/export ----
+
+NDJSON_FORMAT = "dspy-builder/flows"
+NDJSON_VERSION = 1
+
+
+class BundleError(ValueError):
+    """An import stream is malformed; nothing from it was saved."""
+
+
+def _insert_flow(conn: sqlite3.Connection, name: str) -> dict[str, Any]:
+    flow_id = new_id()
+    created_at = updated_at = now_iso()
+    slug = _unique_slug(conn, slugify(name))
+    conn.execute(
+        "INSERT INTO flows (id, name, slug, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (flow_id, name, slug, created_at, updated_at),
+    )
+    return {"id": flow_id, "name": name, "slug": slug, "created_at": created_at, "updated_at": updated_at}
+
+
+def _insert_schemas(conn: sqlite3.Connection, flow_id: str, schemas: list[dict[str, Any]]) -> None:
+    """Insert schemas under new ids, repointing nested references between them.
+
+    References to schemas that are not part of `schemas` are left unchanged.
+    """
+    id_map = {s["id"]: new_id() for s in schemas}
+    now = now_iso()
+    for schema in schemas:
+        new_fields: list[dict] = []
+        for fd in schema.get("fields") or []:
+            # Repoint nested schema references, if present
+            obj_id = fd.get("objectSchemaId")
+            if obj_id and obj_id in id_map:
+                fd["objectSchemaId"] = id_map[obj_id]
+            arr_id = fd.get("arrayItemSchemaId")
+            if arr_id and arr_id in id_map:
+                fd["arrayItemSchemaId"] = id_map[arr_id]
+            new_fields.append(fd)
+        conn.execute(
+            f"INSERT INTO flow_schemas ({SCHEMA_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                id_map[schema["id"]],
+                flow_id,
+                schema.get("name"),
+                schema.get("description"),
+                json.dumps(new_fields),
+                now,
+                now,
+            ),
+        )
+
+
+def _strip_runtime(node: Any) -> None:
+    data = node.get("data") if isinstance(node, dict) else None
+    if isinstance(data, dict):
+        data.pop("runtime", None)
+
+
+def _insert_state(conn: sqlite3.Connection, flow_id: str, state: dict[str, Any]) -> None:
+    conn.execute(
+        "INSERT INTO flow_states (flow_id, data, updated_at, node_count) VALUES (?, ?, ?, ?)",
+        (flow_id, _dumps_state(state), now_iso(), _node_count(state)),
+    )
+
+
+def import_bundle(name: str, state: dict[str, Any], schemas: list[dict[str, Any]]) -> dict[str, Any]:
+    """Create a new flow from exported parts, re-mapping schema ids. Returns the flow row."""
+    with get_connection() as conn:
+        flow = _insert_flow(conn, name)
+        # Re-map schema ids while preserving internal references
+        _insert_schemas(conn, flow["id"], schemas)
+
+        # Save state (strip ephemeral runtime if present)
+        try:
+            for n in state.get("nodes") or []:
+                _strip_runtime(n)
+        except Exception:
+            # If structure is unexpected, store as-is
+            pass
+        _insert_state(conn, flow["id"], state)
+    return flow
+
+
+def _line(record: dict[str, Any]) -> bytes:
+    return (json.dumps(record) + "\n").encode("utf-8")
+
+
+def ndjson_header() -> bytes:
+    return _line({"type": "header", "format": NDJSON_FORMAT, "version": NDJSON_VERSION})
+
+
+def export_ndjson(flow_id: str) -> Iterator[bytes] | None:
+    """One flow as NDJSON records: flow, schemas, state meta, then one line per node and edge.
+
+    Lines are encoded lazily from the head state (consume with `next_chunk`),
+    so a very large graph is never held a second time as encoded lines. The
+    header line is written separately so several flows can share a stream.
+    """
+    with get_connection() as conn:
+        row = conn.execute(f"SELECT {FLOW_COLUMNS} FROM flows WHERE id = ?", (flow_id,)).fetchone()
+        if not row:
+            return None
+        head = _head(conn, flow_id)
+        schemas = conn.execute(
+            f"SELECT {SCHEMA_COLUMNS} FROM flow_schemas WHERE flow_id = ? ORDER BY created_at ASC",
+            (flow_id,),
+        ).fetchall()
+    state = head["data"] if head else _empty_state()
+
+    def lines() -> Iterator[bytes]:
+        yield _line({"type": "flow", "flow": dict(row)})
+        for s in schemas:
+            yield _line({"type": "schema", "schema": _schema_dict(s)})
+        # Top-level state keys other than the graph itself (viewport etc.)
+        meta = {k: v for k, v in state.items() if k not in ("nodes", "edges")}
+        if meta:
+            yield _line({"type": "meta", "meta": meta})
+        for n in state.get("nodes") or []:
+            yield _line({"type": "node", "node": n})
+        for e in state.get("edges") or []:
+            yield _line({"type": "edge", "edge": e})
+
+    return lines()
+
+
+def next_chunk(lines: Iterator[bytes], max_lines: int) -> bytes:
+    """Up to `max_lines` lines of an export joined together; b"" once it is exhausted."""
+    return b"".join(itertools.islice(lines, max_lines))
+
+
+def import_ndjson(stream: IO[bytes]) -> list[dict[str, Any]]:
+    """Create flows from an NDJSON export, reading it one line at a time.
+
+    Everything is written in a single transaction: a malformed line raises
+    BundleError and nothing from the stream is kept. Only the flow currently
+    being read is held in memory. Returns the created flow rows.
+    """
+    created: list[dict[str, Any]] = []
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        flow: dict[str, Any] | None = None
+        state: dict[str, Any] = _empty_state()
+        # Inserted with the flow's state, once every schema id of the flow is known
+        schemas: list[dict[str, Any]] = []
+
+        def finish() -> None:
+            if flow is not None:
+                _insert_schemas(conn, flow["id"], schemas)
+                _insert_state(conn, flow["id"], state)
+
+        lineno = 0
+        seen_header = False
+        for raw in stream:
+            lineno += 1
+            if not raw.strip():
+                continue
+            try:
+                rec = json.loads(raw)
+                kind = rec["type"]
+                if kind == "header":
+                    if rec.get("format") != NDJSON_FORMAT or rec.get("version") != NDJSON_VERSION:
+                        raise BundleError(f"Unsupported export format {rec.get('format')!r} v{rec.get('version')}")
+                    seen_header = True
+                    continue
+                if not seen_header:
+                    raise BundleError("Missing header line")
+                if kind == "flow":
+                    finish()
+                    flow = _insert_flow(conn, rec["flow"]["name"])
+                    created.append(flow)
+                    state = _empty_state()
+                    schemas = []
+                    continue
+                if flow is None:
+                    raise BundleError(f"'{kind}' record before any flow")
+                if kind == "schema":
+                    schema = rec["schema"]
+                    if not isinstance(schema["id"], str) or not all(isinstance(f, dict) for f in schema.get("fields") or []):
+                        raise BundleError("Schema needs a string 'id' and a list of field objects")
+                    schemas.append(schema)
+                elif kind == "node":
+                    _strip_runtime(rec["node"])
+                    state["nodes"].append(rec["node"])
+                elif kind == "edge":
+                    state["edges"].append(rec["edge"])
+                elif kind == "meta":
+                    state.update({k: v for k, v in rec["meta"].items() if k not in ("nodes", "edges")})
+                else:
+                    raise BundleError(f"Unknown record type {kind!r}")
+            except BundleError as e:
+                raise BundleError(f"Line {lineno}: {e}")
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                raise BundleError(f"Line {lineno}: invalid record ({e!r})")
+        finish()
+    return created
+
+
+# ---- previews ----
+
+def get_preview(flow_id: str) -> dict[str, Any] | None:
+    """Preview refs for a flow; raises LookupError if the flow itself does not exist."""
+    with get_connection() as conn:
+        if not conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,)).fetchone():
+            raise LookupError("Flow not found")
+        row = conn.execute(
+            "SELECT image_ref, thumb_ref, size, updated_at FROM flow_previews WHERE flow_id = ? AND image_ref IS NOT NULL",
+            (flow_id,),
+        ).fetchone()
+        return dict(row) if row else None
+
+
+def put_preview(flow_id: str, image: str) -> dict[str, Any] | None:
+    """Store a data-URL preview as blob files and point the flow at them.
+
+    Returns the new refs, or None if the flow does not exist. Raises
+    `preview_store.PreviewError` for unusable images.
+    """
+    if not flow_exists(flow_id):
+        return None
+    stored = preview_store.store_image(image)
+    updated_at = now_iso()
+    with get_connection() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO flow_previews (flow_id, image, image_ref, thumb_ref, size, updated_at)
+            SELECT id, '', ?, ?, ?, ? FROM flows WHERE id = ?
+            ON CONFLICT(flow_id) DO UPDATE SET
+                image = '',
+                image_ref = excluded.image_ref,
+                thumb_ref = excluded.thumb_ref,
+                size = excluded.size,
+                updated_at = excluded.updated_at
+            """,
+            (stored["image_ref"], stored["thumb_ref"], stored["size"], updated_at, flow_id),
+        )
+        if cur.rowcount == 0:
+            # Flow deleted while the image was being stored
+            return None
+    return {**stored, "updated_at": updated_at}
@@ -0,0 +1,182 @@
+"""
+Persistent, content-addressed cache for LM responses.
+
+Entries are keyed by a SHA-256 of (model, request params, rendered messages)
+and stored in their own SQLite file so every runner process can share them.
+WAL mode plus a busy timeout lets concurrent workers read and write safely.
+Entries expire after `LM_CACHE_TTL` seconds, and the least recently used
+ones are evicted once the cache grows past `LM_CACHE_MAX_MB`.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+LM_CACHE_PATH = Path(os.environ.get("LM_CACHE_PATH", str(DATA_DIR / "lm_cache.db")))
+LM_CACHE_ENABLED = os.environ.get("LM_CACHE_ENABLED", "1").lower() not in {"0", "false", "no"}
+LM_CACHE_TTL = float(os.environ.get("LM_CACHE_TTL", str(7 * 24 * 3600)))
+LM_CACHE_MAX_MB = float(os.environ.get("LM_CACHE_MAX_MB", "256"))
+
+# Request params that never change the completion
+_IGNORED_PARAMS = {"api_key", "api_base", "base_url", "cache", "num_retries"}
+# Check the size budget every N writes rather than on every put
+_EVICT_EVERY = 32
+
+_local = threading.local()
+_puts = 0
+_puts_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+    LM_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(LM_CACHE_PATH, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS lm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            response BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_lm_cache_accessed ON lm_cache(accessed_at)")
+    _local.conn = conn
+    return conn
+
+
+def make_key(model: str | None, params: dict[str, Any], messages: list[dict[str, Any]]) -> str:
+    """Stable hash of everything that determines the provider's answer."""
+    material = {
+        "model": model,
+        "params": {k: v for k, v in sorted(params.items()) if k not in _IGNORED_PARAMS},
+        "messages": messages,
+    }
+    raw = json.dumps(material, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Any | None:
+    """Return the cached response for `key`, or None if missing/expired/unreadable."""
+    try:
+        conn = _connect()
+        row = conn.execute(
+            "SELECT response FROM lm_cache WHERE key = ? AND created_at >= ?",
+            (key, time.time() - LM_CACHE_TTL),
+        ).fetchone()
+        if not row:
+            return None
+        conn.execute(
+            "UPDATE lm_cache SET accessed_at = ?, hits = hits + 1 WHERE key = ?",
+            (time.time(), key),
+        )
+        return pickle.loads(row["response"])
+    except Exception:
+        return None
+
+
+def put(key: str, model: str | None, response: Any) -> None:
+    global _puts
+    try:
+        blob = pickle.dumps(response)
+    except Exception:
+        return
+    now = time.time()
+    try:
+        _connect().execute(
+            "INSERT OR REPLACE INTO lm_cache (key, model, response, size, created_at, accessed_at, hits) VALUES (?, ?, ?, ?, ?, ?, 0)",
+            (key, model, blob, len(blob), now, now),
+        )
+    except Exception:
+        return
+    with _puts_lock:
+        _puts += 1
+        due = _puts % _EVICT_EVERY == 0
+    if due:
+        evict()
+
+
+def evict() -> int:
+    """Drop expired entries, then LRU entries until under the size budget."""
+    conn = _connect()
+    removed = conn.execute("DELETE FROM lm_cache WHERE created_at < ?", (time.time() - LM_CACHE_TTL,)).rowcount
+    budget = int(LM_CACHE_MAX_MB * 1024 * 1024)
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM lm_cache").fetchone()[0]
+    if total <= budget:
+        return removed
+    excess = total - budget
+    freed = 0
+    victims: list[str] = []
+    for row in conn.execute("SELECT key, size FROM lm_cache ORDER BY accessed_at ASC"):
+        victims.append(row["key"])
+        freed += row["size"]
+        if freed >= excess:
+            break
+    conn.executemany("DELETE FROM lm_cache WHERE key = ?", [(k,) for k in victims])
+    return removed + len(victims)
+
+
+def stats() -> dict[str, Any]:
+    conn = _connect()
+    row = conn.execute(
+        "SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS size, COALESCE(SUM(hits), 0) AS hits, MIN(created_at) AS oldest, MAX(accessed_at) AS last_access FROM lm_cache"
+    ).fetchone()
+    models = conn.execute(
+        "SELECT model, COUNT(*) AS entries, COALESCE(SUM(hits), 0) AS hits FROM lm_cache GROUP BY model ORDER BY entries DESC"
+    ).fetchall()
+    return {
+        "enabled": LM_CACHE_ENABLED,
+        "path": str(LM_CACHE_PATH),
+        "ttl_s": LM_CACHE_TTL,
+        "max_mb": LM_CACHE_MAX_MB,
+        "entries": row["entries"],
+        "size_mb": round(row["size"] / (1024 * 1024), 3),
+        "hits": row["hits"],
+        "oldest": row["oldest"],
+        "last_access": row["last_access"],
+        "models": [dict(m) for m in models],
+    }
+
+
+def entries(limit: int = 50) -> list[dict[str, Any]]:
+    rows = _connect().execute(
+        "SELECT key, model, size, created_at, accessed_at, hits FROM lm_cache ORDER BY accessed_at DESC LIMIT ?",
+        (limit,),
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def clear(model: str | None = None) -> int:
+    conn = _connect()
+    if model:
+        return conn.execute("DELETE FROM lm_cache WHERE model = ?", (model,)).rowcount
+    return conn.execute("DELETE FROM lm_cache").rowcount
+
+
+# ---- per-thread hit tracking for the streaming callback ----
+
+def mark_hit(hit: bool) -> None:
+    _local.last_hit = hit
+
+
+def last_hit() -> bool | None:
+    """Whether the most recent LM call on this thread was served from the cache."""
+    return getattr(_local, "last_hit", None)
@@ -0,0 +1,151 @@
+"""
+Token usage and cost accounting for LM calls.
+
+`CachedLM` records the usage of each provider response on the calling thread
+and `StreamingCallback.on_lm_end` attaches it to the `lm_end` event (one-shot
+runs collect the same events with `node_runner.LMCallCollector`). Costs
+come from a local price table (USD per million tokens) that can be extended
+or overridden with a JSON file at `LM_PRICES_PATH`:
+
+    {"openai/gpt-4o-mini": {"input": 0.15, "output": 0.6}}
+
+`TokenBudget` is used on the API side to abort runs that exceed a flow's
+token budget.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Iterable
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+LM_PRICES_PATH = Path(os.environ.get("LM_PRICES_PATH", str(DATA_DIR / "lm_prices.json")))
+
+# USD per 1M tokens; keys without a provider prefix match any provider
+DEFAULT_PRICES: dict[str, dict[str, float]] = {
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "output": 10.00},
+    "gpt-4.1-nano": {"input": 0.10, "output": 0.40},
+    "gpt-4.1-mini": {"input": 0.40, "output": 1.60},
+    "gpt-4.1": {"input": 2.00, "output": 8.00},
+    "o3-mini": {"input": 1.10, "output": 4.40},
+    "o4-mini": {"input": 1.10, "output": 4.40},
+    "claude-3-5-haiku": {"input": 0.80, "output": 4.00},
+    "claude-3-5-sonnet": {"input": 3.00, "output": 15.00},
+    "claude-3-7-sonnet": {"input": 3.00, "output": 15.00},
+    "claude-sonnet-4": {"input": 3.00, "output": 15.00},
+    "gemini-1.5-flash": {"input": 0.075, "output": 0.30},
+    "gemini-1.5-pro": {"input": 1.25, "output": 5.00},
+    "gemini-2.0-flash": {"input": 0.10, "output": 0.40},
+    "gemini-2.5-flash": {"input": 0.30, "output": 2.50},
+    "gemini-2.5-pro": {"input": 1.25, "output": 10.00},
+}
+
+_prices: dict[str, dict[str, float]] | None = None
+_local = threading.local()
+
+
+def prices() -> dict[str, dict[str, float]]:
+    global _prices
+    if _prices is None:
+        table = dict(DEFAULT_PRICES)
+        try:
+            table.update(json.loads(LM_PRICES_PATH.read_text()))
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # A broken override file should not break runs; fall back to defaults
+            pass
+        _prices = table
+    return _prices
+
+
+def price_for(model: str | None) -> dict[str, float] | None:
+    """Exact match, then without the provider prefix, then the longest prefix (dated model versions)."""
+    if not model:
+        return None
+    table = prices()
+    if model in table:
+        return table[model]
+    bare = model.split("/", 1)[-1]
+    if bare in table:
+        return table[bare]
+    best = max((k for k in table if bare.startswith(k)), key=len, default=None)
+    return table[best] if best else None
+
+
+def cost(model: str | None, prompt_tokens: int, completion_tokens: int) -> float | None:
+    price = price_for(model)
+    if price is None:
+        return None
+    return round((prompt_tokens * price.get("input", 0) + completion_tokens * price.get("output", 0)) / 1_000_000, 8)
+
+
+def usage_of(model: str | None, response: Any) -> dict[str, Any]:
+    """Token counts and cost for a provider response (zero for cache hits)."""
+    usage = getattr(response, "usage", None) or {}
+    if not isinstance(usage, dict):
+        usage = {k: getattr(usage, k, None) for k in ("prompt_tokens", "completion_tokens", "total_tokens")}
+    prompt = int(usage.get("prompt_tokens") or 0)
+    completion = int(usage.get("completion_tokens") or 0)
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": int(usage.get("total_tokens") or prompt + completion),
+        "cost_usd": cost(model, prompt, completion),
+    }
+
+
+def total(usages: Iterable[dict[str, Any] | None]) -> dict[str, Any]:
+    """Sum per-call usage (cost stays None when no call had a known price)."""
+    prompt = completion = 0
+    cost_usd: float | None = None
+    for u in usages:
+        if not u:
+            continue
+        prompt += u.get("prompt_tokens") or 0
+        completion += u.get("completion_tokens") or 0
+        if u.get("cost_usd") is not None:
+            cost_usd = (cost_usd or 0.0) + u["cost_usd"]
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": prompt + completion,
+        "cost_usd": None if cost_usd is None else round(cost_usd, 8),
+    }
+
+
+# ---- per-thread tracking for the streaming callback ----
+
+def record(model: str | None, response: Any) -> None:
+    _local.last = usage_of(model, response)
+
+
+def reset() -> None:
+    _local.last = None
+
+
+def last() -> dict[str, Any] | None:
+    """Usage of the most recent LM call on this thread."""
+    return getattr(_local, "last", None)
+
+
+class TokenBudget:
+    """Running token total for one run, shared by all nodes of a flow run."""
+
+    def __init__(self, limit: int | None):
+        self.limit = limit
+        self.used = 0
+
+    @property
+    def exceeded(self) -> bool:
+        return self.limit is not None and self.used > self.limit
+
+    def add(self, usage: dict[str, Any] | None) -> bool:
+        """Count an lm_end event's usage; True once the budget is exceeded."""
+        if usage:
+            self.used += int(usage.get("total_tokens") or 0)
+        return self.exceeded
@@ -0,0 +1,181 @@
+"""
+Process-wide Prometheus metrics, rendered in the text exposition format by
+`GET /metrics`.
+
+A small in-tree registry (counters and histograms with labels) rather than a
+client library: the hot paths only need a lock and a bisect per observation.
+Runner-side timings arrive through the event stream and are aggregated in the
+API process (see `app.run_log.RunRecorder`).
+"""
+
+from __future__ import annotations
+
+import bisect
+import contextvars
+import threading
+from typing import Any, Iterable
+
+# Seconds; roughly Prometheus' defaults, extended for slow LM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(x: float) -> str:
+    if x == float("inf"):
+        return "+Inf"
+    return repr(float(x)) if not float(x).is_integer() else str(int(x))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels.get(n) if labels.get(n) is not None else "") for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0.0)]
+        for key, value in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_fmt(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][idx] += 1
+            series[1][0] += value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            items = sorted((k, (list(c), s[0])) for k, (c, s) in self._series.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, float("inf")), counts):
+                cumulative += n
+                le = 'le="%s"' % _fmt(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+_registry: list[_Metric] = []
+
+
+def render() -> str:
+    return "\n".join(line for m in _registry for line in m.render()) + "\n"
+
+
+# ---- request context ----
+
+# ASGI scope of the request being handled; routing fills in scope["route"]
+# later, so the label is resolved when a metric is observed.
+_request_scope: contextvars.ContextVar[dict | None] = contextvars.ContextVar("request_scope", default=None)
+
+
+def route_label() -> str:
+    scope = _request_scope.get()
+    if scope is None:
+        return "background"
+    if "endpoint" not in scope:
+        return "unmatched"
+    # Template the concrete path back (`/api/flows/{flow_id}/state`); route.path
+    # alone lacks the include_router prefix on some FastAPI versions
+    params = {str(v): k for k, v in (scope.get("path_params") or {}).items()}
+    return "/".join(f"{{{params[seg]}}}" if seg in params else seg for seg in scope["path"].split("/"))
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: exposes the request to `route_label` and counts 5xx responses."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _request_scope.set(scope)
+
+        async def _send(message):
+            if message["type"] == "http.response.start" and message["status"] >= 500:
+                ERRORS.inc(kind="http")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _request_scope.reset(token)
+
+
+# ---- metrics ----
+
+RUNNER_SPAWN_SECONDS = Histogram(
+    "runner_spawn_seconds", "Time to start a runner process until it reports ready", buckets=SLOW_BUCKETS
+)
+RUNNER_FIRST_EVENT_SECONDS = Histogram(
+    "runner_time_to_first_event_seconds", "Time from job submission to the first event line", ("mode",), buckets=SLOW_BUCKETS
+)
+RUNNER_TIMEOUTS = Counter("runner_timeouts_total", "Runner jobs killed for exceeding their timeout")
+RUNNER_CANCELLED = Counter("runner_cancelled_total", "Runner jobs cancelled through the API")
+LM_LATENCY_SECONDS = Histogram("lm_latency_seconds", "LM call latency (lm_start to lm_end)", ("model",), buckets=SLOW_BUCKETS)
+TOOL_LATENCY_SECONDS = Histogram("tool_latency_seconds", "Tool call latency (tool_start to tool_end)", ("tool",))
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "SQLite statement execution time", ("route",), buckets=FAST_BUCKETS)
+STATE_JSON_SECONDS = Histogram(
+    "flow_state_json_seconds", "Flow state JSON encode/decode time", ("op",), buckets=FAST_BUCKETS
+)
+CACHE_HITS = Counter("cache_hits_total", "Cache hits by cache", ("cache",))
+ERRORS = Counter("errors_total", "Errors by kind (run, lm, tool, http)", ("kind",))
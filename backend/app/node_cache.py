@@ -0,0 +1,185 @@
+"""
+Node-level memoization of run results.
+
+A node whose signature, inputs, model, LM params and tools are unchanged since
+its last successful run is answered from the `node_run_cache` table instead of
+being executed again. Unlike the browser's in-memory output cache this
+survives reloads and is shared by everyone using the backend.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import uuid
+from typing import Any, AsyncIterator
+
+from .db import get_connection, run_db
+from .lm_usage import TokenBudget
+from .run_log import RunRecorder
+from .runner_pool import RunnerCancelled, RunnerTimeout, get_pool
+from .utils import now_iso
+
+# Payload fields that determine a node's result
+KEY_FIELDS = (
+    "node_kind",
+    "node_title",
+    "node_description",
+    "inputs_schema",
+    "outputs_schema",
+    "inputs_values",
+    "model",
+    "lm_params",
+)
+
+
+def _canonical(x: Any) -> str:
+    return json.dumps(x, sort_keys=True, default=str, separators=(",", ":"))
+
+
+def node_key(payload: dict[str, Any]) -> str:
+    material = {k: payload.get(k) for k in KEY_FIELDS}
+    tools = payload.get("tools_code") or []
+    material["tools"] = hashlib.sha256(_canonical(tools).encode("utf-8")).hexdigest()
+    return hashlib.sha256(_canonical(material).encode("utf-8")).hexdigest()
+
+
+def wants_cache(payload: dict[str, Any]) -> bool:
+    # Multi-example runs are not memoized; their LM calls still hit the LM cache
+    return payload.get("use_cache", True) is not False and not payload.get("examples")
+
+
+def lookup(key: str) -> dict[str, Any] | None:
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT outputs, reasoning FROM node_run_cache WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if not row:
+            return None
+        conn.execute("UPDATE node_run_cache SET hits = hits + 1 WHERE key = ?", (key,))
+        conn.commit()
+    return {"outputs": json.loads(row["outputs"]), "reasoning": row["reasoning"]}
+
+
+def store(key: str, flow_id: str | None, node_id: str | None, outputs: dict | None, reasoning: Any) -> None:
+    try:
+        outputs_json = json.dumps(outputs or {})
+    except Exception:
+        return  # not JSON-safe, don't memoize
+    with get_connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO node_run_cache (key, flow_id, node_id, outputs, reasoning, created_at, hits)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+            ON CONFLICT(key) DO UPDATE SET
+                flow_id = excluded.flow_id,
+                node_id = excluded.node_id,
+                outputs = excluded.outputs,
+                reasoning = excluded.reasoning,
+                created_at = excluded.created_at
+            """,
+            (key, flow_id, node_id, outputs_json, None if reasoning is None else str(reasoning), now_iso()),
+        )
+        conn.commit()
+
+
+def stats() -> dict[str, Any]:
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) AS entries, COALESCE(SUM(hits), 0) AS hits, MAX(created_at) AS newest FROM node_run_cache"
+        ).fetchone()
+        return dict(row)
+
+
+def clear(flow_id: str | None = None) -> int:
+    with get_connection() as conn:
+        if flow_id:
+            cur = conn.execute("DELETE FROM node_run_cache WHERE flow_id = ?", (flow_id,))
+        else:
+            cur = conn.execute("DELETE FROM node_run_cache")
+        conn.commit()
+        return cur.rowcount
+
+
+def _line(obj: dict[str, Any]) -> bytes:
+    return (json.dumps(obj) + "\n").encode("utf-8")
+
+
+async def memoized_stream(
+    flow_id: str,
+    payload: dict[str, Any],
+    *,
+    budget: TokenBudget | None = None,
+    flow_run_id: str | None = None,
+) -> AsyncIterator[bytes]:
+    """Replay a memoized result as run events, or run the node on the pool and memoize its result.
+
+    With a `budget`, the run is aborted (worker killed) with an `error` event
+    of reason `token_budget` as soon as an `lm_end` pushes usage past it.
+    The run can be cancelled by its `run_id` (taken from the payload or
+    assigned here); cancellation and timeouts (`timeout_s`, `idle_timeout_s`)
+    end the stream with a `cancelled` or `timeout` event.
+    """
+    key = node_key(payload) if wants_cache(payload) else None
+    run_id = payload.get("run_id") or uuid.uuid4().hex
+    payload = {**payload, "run_id": run_id}
+    node_meta = {"id": payload.get("node_id"), "title": payload.get("node_title"), "kind": payload.get("node_kind")}
+    recorder = RunRecorder(flow_id, payload, flow_run_id)
+    try:
+        if key:
+            hit = await run_db(lookup, key)
+            if hit is not None:
+                for ev in (
+                    {"event": "run_start", "run_id": run_id, "node": node_meta, "cached": True},
+                    {"event": "result", "run_id": run_id, "node": node_meta, "outputs": hit["outputs"], "reasoning": hit["reasoning"], "cached": True},
+                    {"event": "run_end", "run_id": run_id, "node": node_meta, "cached": True},
+                ):
+                    recorder.observe(ev)
+                    yield _line(ev)
+                return
+
+        stream = get_pool().stream(
+            payload,
+            timeout=payload.get("timeout_s"),
+            idle_timeout=payload.get("idle_timeout_s"),
+            flow_key=flow_id,
+            run_id=run_id,
+        )
+        try:
+            async for line in stream:
+                try:
+                    ev = json.loads(line)
+                except Exception:
+                    yield line
+                    continue
+                # Recording only enqueues; the run_log writer persists in batches
+                recorder.observe(ev)
+                if key and ev.get("event") == "result":
+                    try:
+                        await run_db(store, key, flow_id, payload.get("node_id"), ev.get("outputs"), ev.get("reasoning"))
+                    except Exception:
+                        pass
+                yield line
+                if budget is not None and ev.get("event") == "lm_end" and budget.add(ev.get("usage")):
+                    err = {
+                        "event": "error",
+                        "node": node_meta,
+                        "reason": "token_budget",
+                        "message": f"Token budget exceeded ({budget.used} > {budget.limit} tokens)",
+                    }
+                    recorder.observe(err)
+                    yield _line(err)
+                    return
+        except (RunnerCancelled, RunnerTimeout) as e:
+            end = {"event": "cancelled" if isinstance(e, RunnerCancelled) else "timeout", "run_id": run_id, "node": node_meta}
+            if isinstance(e, RunnerTimeout):
+                end["reason"] = e.reason
+            end["message"] = str(e)
+            recorder.observe(end)
+            yield _line(end)
+        finally:
+            # Closing the pool stream early kills the worker mid-job
+            await stream.aclose()
+    finally:
+        recorder.close()
@@ -2,15 +2,58 @@ from __future__ import annotations
 
 import json
 import sys
+import threading
+import time
 from typing import Any
 import dspy
+from dspy.utils.callback import BaseCallback
+from . import lm_cache, lm_usage
 from .dspy_signature import build_signature
-from .runner_core import get_lm, parse_tools, build_module, collect_outputs
+from .runner_core import get_lm, parse_tools, build_module, collect_outputs, run_examples
 
- 
+
+class LMCallCollector(BaseCallback):
+    """Collects an `lm_start`/`lm_end` pair per LM call (with usage) for one-shot runs.
+
+    The API replays them into the run recorder, so these runs are accounted
+    like streamed ones. Calls of multi-example runs come from several threads.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.events: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def on_lm_start(self, call_id, instance, inputs):
+        lm_usage.reset()
+        ev = {"event": "lm_start", "ts": int(time.time() * 1000), "call_id": str(call_id), "model": getattr(instance, "model", None)}
+        with self._lock:
+            self.events.append(ev)
+
+    def on_lm_end(self, call_id, outputs, exception=None):
+        ev = {
+            "event": "lm_end",
+            "ts": int(time.time() * 1000),
+            "call_id": str(call_id),
+            "exception": None if exception is None else str(exception),
+            "cache_hit": bool(lm_cache.last_hit()),
+            "usage": lm_usage.last(),
+        }
+        with self._lock:
+            self.events.append(ev)
+
+    def usage(self) -> dict[str, Any]:
+        return lm_usage.total(ev.get("usage") for ev in self.events if ev["event"] == "lm_end")
 
 
 def run(payload: dict) -> dict:
+    """Run a node once and return its outputs (or `examples`), plus `usage` and the `lm_events` it produced."""
+    calls = LMCallCollector()
+    result = _run(payload, calls)
+    return {**result, "usage": calls.usage(), "lm_events": calls.events}
+
+
+def _run(payload: dict, calls: LMCallCollector) -> dict:
     kind = payload.get("node_kind")
     title = payload.get("node_title") or kind or "Node"
     desc = payload.get("node_description")
@@ -20,11 +63,11 @@ def run(payload: dict) -> dict:
     model = payload.get("model")
     lm_params = payload.get("lm_params") or {}
     tools_code = payload.get("tools_code") or []
+    examples = payload.get("examples")
 
     try:
         Sig = build_signature(title.replace(" ", "_"), desc, inputs_schema, outputs_schema)
         lm = get_lm(model, lm_params)
-        dspy.settings.configure(lm=lm)
 
         tools: list[Any] | None = None
         if kind == "agent":
@@ -33,7 +76,17 @@ def run(payload: dict) -> dict:
                 return {"error": "; ".join(errors)}
 
         module = build_module(kind, Sig, tools=tools)
-        pred = module(**inputs_values)
+        # Scope settings to this run so long-lived workers don't leak state between jobs
+        with dspy.context(lm=lm, callbacks=[calls]):
+            if examples:
+                results = run_examples(
+                    module,
+                    [{**inputs_values, **ex} for ex in examples],
+                    outputs_schema,
+                    num_threads=payload.get("num_threads"),
+                )
+                return {"examples": results}
+            pred = module(**inputs_values)
 
         outputs = collect_outputs(pred, outputs_schema)
         reasoning = getattr(pred, "reasoning", None)
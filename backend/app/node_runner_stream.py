@@ -3,28 +3,158 @@ from __future__ import annotations
 import json
 import os
 import sys
+import threading
+import time
 import traceback
 import uuid
-from typing import Any
+from typing import Any, Callable, TextIO
 
 import dspy
 
-from .dspy_streaming import StreamingCallback
+from .dspy_streaming import StreamingCallback, encode_event, tag_rows
 from .dspy_signature import build_signature
-from .runner_core import get_lm, parse_tools, build_module, collect_outputs
+from .runner_core import get_lm, parse_tools, build_module, collect_outputs, run_examples, run_streaming, stream_listeners
+
+
+Emitter = Callable[[dict[str, Any]], None]
+
+# Buffered event lines reach the parent at most this many ms after being written
+EVENT_FLUSH_MS = float(os.environ.get("EVENT_FLUSH_MS", "20"))
+# Stream output fields token by token (`token` events); a payload can opt out
+# with `"stream_tokens": false`
+RUNNER_STREAM_TOKENS = os.environ.get("RUNNER_STREAM_TOKENS", "1").lower() not in ("0", "false", "no")
+# Chunks of one field are merged into at most one `token` event per interval
+TOKEN_COALESCE_MS = float(os.environ.get("TOKEN_COALESCE_MS", "50"))
+# Lines the parent acts on right away: run end, errors and anything that is not
+# a trace event (worker control lines, rate-limit requests, one-shot results)
+_URGENT = frozenset({"run_end", "error"})
 
 
 def _emit(obj: dict[str, Any]):
-    sys.stdout.write(json.dumps(obj) + "\n")
+    sys.stdout.write(encode_event(obj) + "\n")
     sys.stdout.flush()
 
 
-def wrap_tool(fn, run_id: str, node_meta: dict[str, Any], index: int | None = None):
+class EventWriter:
+    """Thread-safe NDJSON emitter that batches flushes.
+
+    Trace events are flushed by a background thread at most `flush_ms` after
+    being written instead of one write syscall per event; urgent lines flush
+    at once. `flush_ms <= 0` flushes every line.
+    """
+
+    def __init__(self, out: TextIO, flush_ms: float = EVENT_FLUSH_MS):
+        self._out = out
+        self._delay = flush_ms / 1000
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        if self._delay > 0:
+            threading.Thread(target=self._flusher, name="event-flush", daemon=True).start()
+
+    def __call__(self, obj: dict[str, Any]) -> None:
+        line = encode_event(obj) + "\n"
+        urgent = self._delay <= 0 or obj.get("event") in _URGENT or "event" not in obj
+        with self._lock:
+            self._out.write(line)
+            if urgent:
+                self._out.flush()
+                return
+        self._dirty.set()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._out.flush()
+
+    def _flusher(self) -> None:
+        while True:
+            self._dirty.wait()
+            time.sleep(self._delay)
+            # Lines written after this point set the flag again
+            self._dirty.clear()
+            self.flush()
+
+
+class TokenCoalescer:
+    """Merges streamed chunks of each output field into rate-bounded `token` events.
+
+    A field's first chunk is emitted at once (time to first token); later
+    chunks are buffered and emitted together at most every `interval_ms`,
+    and whatever is left goes out with the field's last chunk or `close()`.
+
+    When a provider call fails after streaming and is made again, `attempt(True)`
+    drops the buffered chunks and emits one `token_reset` per field already
+    sent in that attempt: clients discard that field's text since its last
+    `token_reset` or `lm_start`, and the new attempt streams it from the start.
+    """
+
+    def __init__(self, emit: Emitter, run_id: str, node_meta: dict[str, Any], interval_ms: float = TOKEN_COALESCE_MS):
+        self._emit = emit
+        self._run_id = run_id
+        self._node_meta = node_meta
+        self._interval = interval_ms / 1000
+        self._bufs: dict[str, list[str]] = {}
+        self._sent: dict[str, float] = {}
+        # Fields with `token` events from the current provider call
+        self._streamed: set[str] = set()
+
+    def __call__(self, field: str, chunk: str, last: bool) -> None:
+        buf = self._bufs.setdefault(field, [])
+        if chunk:
+            buf.append(chunk)
+        now = time.monotonic()
+        if last or now - self._sent.get(field, float("-inf")) >= self._interval:
+            self._flush(field, now, last)
+
+    def attempt(self, retry: bool) -> None:
+        """A provider call starts; with `retry`, the previous one failed and its chunks are void."""
+        if retry:
+            for buf in self._bufs.values():
+                buf.clear()
+            for field in sorted(self._streamed):
+                self._emit({
+                    "event": "token_reset",
+                    "ts": int(time.time() * 1000),
+                    "run_id": self._run_id,
+                    "node": self._node_meta,
+                    "field": field,
+                })
+        self._streamed.clear()
+        # The new call's first chunk of each field goes out at once
+        self._sent.clear()
+
+    def close(self) -> None:
+        for field, buf in self._bufs.items():
+            if buf:
+                self._flush(field, time.monotonic(), True)
+
+    def _flush(self, field: str, now: float, last: bool) -> None:
+        buf = self._bufs[field]
+        if not buf and not last:
+            return
+        self._emit({
+            "event": "token",
+            "ts": int(time.time() * 1000),
+            "run_id": self._run_id,
+            "node": self._node_meta,
+            "field": field,
+            "chunk": "".join(buf),
+            "chunks": len(buf),
+            "last": last,
+        })
+        buf.clear()
+        self._sent[field] = now
+        self._streamed.add(field)
+
+
+def wrap_tool(fn, run_id: str, node_meta: dict[str, Any], index: int | None = None, emit: Emitter = _emit):
     name = getattr(fn, "__name__", str(fn))
 
     def _wrapped(*args, **kwargs):
-        _emit({
+        call_id = uuid.uuid4().hex
+        emit({
             "event": "tool_start",
+            "ts": int(time.time() * 1000),
+            "call_id": call_id,
             "run_id": run_id,
             "node": node_meta,
             "tool": name,
@@ -33,8 +163,10 @@ def wrap_tool(fn, run_id: str, node_meta: dict[str, Any], index: int | None = No
         })
         try:
             out = fn(*args, **kwargs)
-            _emit({
+            emit({
                 "event": "tool_end",
+                "ts": int(time.time() * 1000),
+                "call_id": call_id,
                 "run_id": run_id,
                 "node": node_meta,
                 "tool": name,
@@ -44,8 +176,10 @@ def wrap_tool(fn, run_id: str, node_meta: dict[str, Any], index: int | None = No
             })
             return out
         except Exception as e:  # pragma: no cover
-            _emit({
+            emit({
                 "event": "tool_end",
+                "ts": int(time.time() * 1000),
+                "call_id": call_id,
                 "run_id": run_id,
                 "node": node_meta,
                 "tool": name,
@@ -56,11 +190,22 @@ def wrap_tool(fn, run_id: str, node_meta: dict[str, Any], index: int | None = No
             raise
 
     _wrapped.__name__ = name
+    # Tells StreamingCallback not to report these calls a second time
+    _wrapped.emits_events = True
     return _wrapped
 
 
-def run_stream(payload: dict) -> int:
-    run_id = str(uuid.uuid4())
+def run_stream(payload: dict, emit: Emitter = _emit) -> int:
+    """Run a node, reporting progress through `emit` (stdout NDJSON by default).
+
+    With `examples` (a list of input dicts layered over `inputs_values`) the
+    node runs once per example on a thread pool; events of each example carry
+    its `row`, each finished example emits `example_end`, and the final
+    `result` lists all of them under `examples`. Otherwise string output
+    fields (and `reasoning`) stream as coalesced `token` events.
+    """
+    # Assigned by the API so the run can be cancelled by id
+    run_id = payload.get("run_id") or str(uuid.uuid4())
 
     kind = payload.get("node_kind")
     title = payload.get("node_title") or kind or "Node"
@@ -72,45 +217,78 @@ def run_stream(payload: dict) -> int:
     lm_params = payload.get("lm_params") or {}
     tools_code = payload.get("tools_code") or []
     node_id = payload.get("node_id")
+    examples = payload.get("examples")
 
     node_meta = {"id": node_id, "title": title, "kind": kind}
+    if examples:
+        # Callback and tool events fire on the example threads
+        emit = tag_rows(emit)
 
-    _emit({"event": "run_start", "run_id": run_id, "node": node_meta})
+    emit({"event": "run_start", "run_id": run_id, "node": node_meta})
 
     try:
         Sig = build_signature(title.replace(" ", "_"), desc, inputs_schema, outputs_schema)
 
         # Configure LM + callbacks
         lm = get_lm(model, lm_params)
-        callback = StreamingCallback(_emit, run_id=run_id, node_meta=node_meta)
-        dspy.settings.configure(lm=lm, callbacks=[callback])
+        callback = StreamingCallback(emit, run_id=run_id, node_meta=node_meta)
 
         # Build module and tools
-        if kind == "chainofthought":
-            module = dspy.ChainOfThought(Sig)
-        elif kind == "agent":
-            tools, errors = parse_tools(tools_code or [], wrap=lambda fn, idx: wrap_tool(fn, run_id, node_meta, idx))
+        if kind == "agent":
+            tools, errors = parse_tools(tools_code or [], wrap=lambda fn, idx: wrap_tool(fn, run_id, node_meta, idx, emit))
             if errors:
-                _emit({"event": "error", "run_id": run_id, "node": node_meta, "message": "; ".join(errors)})
+                emit({"event": "error", "run_id": run_id, "node": node_meta, "message": "; ".join(errors)})
                 return 1
             if not tools:
-                _emit({"event": "error", "run_id": run_id, "node": node_meta, "message": "Agent requires at least one valid tool"})
+                emit({"event": "error", "run_id": run_id, "node": node_meta, "message": "Agent requires at least one valid tool"})
                 return 1
             module = build_module(kind, Sig, tools=tools)
         else:
             module = build_module(kind, Sig)
 
-        # Execute
-        pred = module(**inputs_values)
+        # Execute with settings scoped to this run (workers are reused across jobs)
+        with dspy.context(lm=lm, callbacks=[callback]):
+            if examples:
+                results = run_examples(
+                    module,
+                    [{**inputs_values, **ex} for ex in examples],
+                    outputs_schema,
+                    num_threads=payload.get("num_threads"),
+                    on_done=lambda res: emit({"event": "example_end", "run_id": run_id, "node": node_meta, **res}),
+                )
+            else:
+                listeners = []
+                if RUNNER_STREAM_TOKENS and payload.get("stream_tokens", True) is not False:
+                    listeners = stream_listeners(module, [f.get("name") for f in outputs_schema] + ["reasoning"])
+                if listeners:
+                    tokens = TokenCoalescer(emit, run_id, node_meta)
+                    try:
+                        pred = run_streaming(module, inputs_values, listeners, tokens, tokens.attempt)
+                    finally:
+                        tokens.close()
+                else:
+                    pred = module(**inputs_values)
+
+        if examples:
+            emit({
+                "event": "result",
+                "run_id": run_id,
+                "node": node_meta,
+                "outputs": None,
+                "examples": results,
+                "failed": sum(1 for r in results if r["error"]),
+            })
+            emit({"event": "run_end", "run_id": run_id, "node": node_meta})
+            return 0
 
         outputs = collect_outputs(pred, outputs_schema)
 
         reasoning = getattr(pred, "reasoning", None)
-        _emit({"event": "result", "run_id": run_id, "node": node_meta, "outputs": outputs, "reasoning": reasoning})
-        _emit({"event": "run_end", "run_id": run_id, "node": node_meta})
+        emit({"event": "result", "run_id": run_id, "node": node_meta, "outputs": outputs, "reasoning": reasoning})
+        emit({"event": "run_end", "run_id": run_id, "node": node_meta})
         return 0
     except Exception as e:  # pragma: no cover
-        _emit({
+        emit({
             "event": "error",
             "run_id": run_id,
             "node": node_meta,
@@ -127,7 +305,9 @@ def main():
     except Exception as e:
         _emit({"event": "error", "message": f"Invalid payload: {e}"})
         return 1
-    code = run_stream(payload)
+    emit = EventWriter(sys.stdout)
+    code = run_stream(payload, emit=emit)
+    emit.flush()
     return code
 
 
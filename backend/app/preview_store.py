@@ -0,0 +1,157 @@
+"""
+Content-addressed storage for flow preview images.
+
+Previews arrive as data URLs; they are decoded once and written to
+`data/previews/<sha256>.<ext>` so the database only keeps a short reference
+and the bytes can be served directly with strong caching. A downscaled
+thumbnail for the dashboard is generated at upload time when Pillow is
+installed (without it the full image doubles as the thumbnail).
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import threading
+from pathlib import Path
+
+from .db import DATA_DIR, get_connection
+
+try:
+    from PIL import Image  # type: ignore
+except Exception:  # pragma: no cover
+    Image = None  # type: ignore
+
+PREVIEW_DIR = Path(os.environ.get("PREVIEW_DIR", str(DATA_DIR / "previews")))
+PREVIEW_MAX_MB = float(os.environ.get("PREVIEW_MAX_MB", "10"))
+PREVIEW_THUMB_WIDTH = int(os.environ.get("PREVIEW_THUMB_WIDTH", "480"))
+
+_DATA_URL = re.compile(r"^data:(?P<mime>[\w.+-]+/[\w.+-]+)?(?P<params>(;[^;,]*)*?)(?P<b64>;base64)?,", re.I)
+_REF = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+_EXT = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp", "image/gif": "gif", "image/svg+xml": "svg"}
+
+
+class PreviewError(ValueError):
+    """The uploaded preview is not a usable image."""
+
+
+def decode_data_url(url: str) -> tuple[str, bytes]:
+    """Split a `data:` URL into (mime, raw bytes)."""
+    m = _DATA_URL.match(url)
+    if not m:
+        raise PreviewError("Preview must be a data: URL")
+    mime = (m.group("mime") or "").lower()
+    if mime not in _EXT:
+        raise PreviewError(f"Unsupported preview type: {mime or 'unknown'}")
+    body = url[m.end():]
+    # Reject oversized uploads before decoding (base64 is 4/3 the raw size)
+    if len(body) * 3 / 4 > PREVIEW_MAX_MB * 1024 * 1024:
+        raise PreviewError(f"Preview exceeds {PREVIEW_MAX_MB:g} MB")
+    try:
+        raw = base64.b64decode(body, validate=True) if m.group("b64") else body.encode("utf-8")
+    except (binascii.Error, ValueError) as e:
+        raise PreviewError(f"Invalid base64 data: {e}")
+    return mime, raw
+
+
+def path_for(ref: str) -> Path | None:
+    """Filesystem path of a stored blob, or None for malformed references."""
+    if not _REF.match(ref):
+        return None
+    return PREVIEW_DIR / ref
+
+
+def mime_for(ref: str) -> str:
+    return mimetypes.guess_type(ref)[0] or "application/octet-stream"
+
+
+def put_blob(raw: bytes, mime: str) -> str:
+    """Store bytes under their hash (idempotent) and return the reference."""
+    ref = f"{hashlib.sha256(raw).hexdigest()}.{_EXT[mime]}"
+    path = PREVIEW_DIR / ref
+    if not path.exists():
+        PREVIEW_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(raw)
+        os.replace(tmp, path)
+    return ref
+
+
+def make_thumbnail(raw: bytes, mime: str) -> tuple[bytes, str] | None:
+    """Downscale to PREVIEW_THUMB_WIDTH wide; None when Pillow is missing or it would not shrink."""
+    if Image is None or mime == "image/svg+xml":
+        return None
+    try:
+        with Image.open(io.BytesIO(raw)) as im:
+            if im.width <= PREVIEW_THUMB_WIDTH:
+                return None
+            im.thumbnail((PREVIEW_THUMB_WIDTH, PREVIEW_THUMB_WIDTH * 4))
+            out = io.BytesIO()
+            im.convert("RGBA").save(out, format="WEBP", quality=80)
+            return out.getvalue(), "image/webp"
+    except Exception:
+        # Undecodable or unsupported by this Pillow build; serve the full image
+        return None
+
+
+def store_image(url: str) -> dict[str, str | int]:
+    """Decode a data URL and store the image plus its thumbnail; returns refs and size."""
+    mime, raw = decode_data_url(url)
+    ref = put_blob(raw, mime)
+    thumb = make_thumbnail(raw, mime)
+    thumb_ref = put_blob(*thumb) if thumb else ref
+    return {"image_ref": ref, "thumb_ref": thumb_ref, "size": len(raw)}
+
+
+def sweep_orphans() -> int:
+    """Delete blobs no preview row references any more (replaced or deleted flows)."""
+    if not PREVIEW_DIR.exists():
+        return 0
+    with get_connection() as conn:
+        live = {
+            r for row in conn.execute("SELECT image_ref, thumb_ref FROM flow_previews WHERE image_ref IS NOT NULL")
+            for r in (row["image_ref"], row["thumb_ref"])
+        }
+    removed = 0
+    for p in PREVIEW_DIR.iterdir():
+        if p.name not in live and (_REF.match(p.name) or p.name.endswith(".tmp")):
+            try:
+                p.unlink()
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def migrate_inline_previews() -> int:
+    """Move data-URL previews still stored in flow_previews.image out to blob files."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT flow_id, image FROM flow_previews WHERE image_ref IS NULL AND image != ''"
+        ).fetchall()
+    moved = 0
+    for row in rows:
+        try:
+            stored = store_image(row["image"])
+        except PreviewError:
+            # Leave unreadable rows alone; they read as "no preview"
+            continue
+        with get_connection() as conn:
+            conn.execute(
+                "UPDATE flow_previews SET image = '', image_ref = ?, thumb_ref = ?, size = ? WHERE flow_id = ?",
+                (stored["image_ref"], stored["thumb_ref"], stored["size"], row["flow_id"]),
+            )
+        moved += 1
+    if moved:
+        # Give the pages the data URLs occupied back to the filesystem
+        with get_connection() as conn:
+            conn.execute("VACUUM")
+            # VACUUM may renumber flows' rowids, which the name index refers to
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'flows_fts'").fetchone():
+                conn.execute("INSERT INTO flows_fts(flows_fts) VALUES ('rebuild')")
+    return moved
@@ -0,0 +1,150 @@
+"""
+Worker side of the shared LM rate limiter (`app.rate_limiter`).
+
+Inside a runner worker, `acquire` writes a `{"__rate__": "acquire"}` line to
+the protocol stream and blocks the calling thread until the pool answers with
+a grant on stdin; `report` tells the scheduler how many tokens the call used
+and whether the provider answered 429. The time spent waiting is emitted as a
+`queue_wait` event of the current job.
+
+Grants say whether the provider has no limits configured; for
+RATE_LIMIT_UNLIMITED_TTL seconds after such a grant, calls to that model skip
+the round trip (a 429 ends the shortcut at once). Retries of 5xx and
+connection errors wait `retry_delay` first, since the scheduler only backs
+off after 429s.
+
+Outside a worker (no channel attached) every call is permitted immediately.
+"""
+
+from __future__ import annotations
+
+import itertools
+import os
+import random
+import threading
+import time
+from typing import Any, Callable
+
+from .dspy_streaming import current_row
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1").lower() not in ("0", "false", "no")
+# Give up waiting for a permit after this many seconds and call anyway
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", "300"))
+# Retries of a 429/transient failure, each going back through the scheduler
+RATE_LIMIT_RETRIES = int(os.environ.get("RATE_LIMIT_RETRIES", "3"))
+# Base/maximum seconds before retrying a non-429 failure (full jitter)
+RATE_LIMIT_RETRY_BASE = float(os.environ.get("RATE_LIMIT_RETRY_BASE", "0.5"))
+RATE_LIMIT_RETRY_MAX = float(os.environ.get("RATE_LIMIT_RETRY_MAX", "8"))
+# Seconds a grant for an unlimited provider lets calls to that model skip the scheduler
+RATE_LIMIT_UNLIMITED_TTL = float(os.environ.get("RATE_LIMIT_UNLIMITED_TTL", "5"))
+
+_write: Callable[[dict[str, Any]], None] | None = None
+_job: dict[str, Any] = {}
+_ids = itertools.count(1)
+_pending: dict[int, tuple[threading.Event, dict[str, Any]]] = {}
+_lock = threading.Lock()
+# model -> monotonic time until which its provider is known to be unlimited
+_unlimited: dict[str | None, float] = {}
+
+
+def attach(write: Callable[[dict[str, Any]], None]) -> None:
+    """Route permit requests through the worker protocol (called by `app.runner_worker`)."""
+    global _write
+    _write = write if RATE_LIMIT_ENABLED else None
+
+
+def active() -> bool:
+    return _write is not None
+
+
+def set_job(payload: dict[str, Any] | None) -> None:
+    """Remember the running job so queue_wait events can be attributed to its run and node."""
+    _job.clear()
+    if payload:
+        if payload.get("run_id"):
+            _job["run_id"] = payload["run_id"]
+        _job["node"] = {"id": payload.get("node_id"), "title": payload.get("node_title"), "kind": payload.get("node_kind")}
+
+
+def on_reply(msg: dict[str, Any]) -> None:
+    """Deliver a grant read from stdin to the waiting thread."""
+    with _lock:
+        entry = _pending.pop(msg.get("id"), None)
+    if entry is not None:
+        entry[1].update(msg)
+        entry[0].set()
+
+
+def estimate_tokens(messages: list[dict[str, Any]] | None, prompt: str | None, kwargs: dict[str, Any]) -> int:
+    """Rough request size for TPM accounting (~4 chars per token plus the completion cap)."""
+    chars = len(prompt or "")
+    for m in messages or []:
+        content = m.get("content") if isinstance(m, dict) else None
+        chars += len(content) if isinstance(content, str) else len(str(content or ""))
+    return chars // 4 + int(kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or 0)
+
+
+def acquire(model: str | None, tokens: int) -> float:
+    """Block until the scheduler grants a permit; returns the seconds waited."""
+    write = _write
+    if write is None or _unlimited.get(model, 0.0) > time.monotonic():
+        return 0.0
+    req_id = next(_ids)
+    done = threading.Event()
+    reply: dict[str, Any] = {}
+    with _lock:
+        _pending[req_id] = (done, reply)
+    write({"__rate__": "acquire", "id": req_id, "model": model, "tokens": tokens})
+    if not done.wait(RATE_LIMIT_MAX_WAIT):
+        with _lock:
+            _pending.pop(req_id, None)
+        return RATE_LIMIT_MAX_WAIT
+    if reply.get("unlimited"):
+        _unlimited[model] = time.monotonic() + RATE_LIMIT_UNLIMITED_TTL
+    waited = float(reply.get("wait_s") or 0.0)
+    if waited > 0:
+        row = current_row()
+        write({
+            "event": "queue_wait",
+            "ts": int(time.time() * 1000),
+            **_job,
+            **({"row": row} if row is not None else {}),
+            "model": model,
+            "provider": reply.get("provider"),
+            "wait_ms": int(waited * 1000),
+            "tokens": tokens,
+        })
+    return waited
+
+
+def report(model: str | None, estimated: int, used: int | None, status: int | None) -> None:
+    write = _write
+    if write is None:
+        return
+    if status == 429:
+        # The scheduler is about to back off: go back through it
+        _unlimited.pop(model, None)
+    elif _unlimited.get(model, 0.0) > time.monotonic():
+        # Nothing to account against an unlimited provider
+        return
+    write({"__rate__": "report", "model": model, "estimated": estimated, "used": used, "status": status})
+
+
+def retry_delay(attempt: int) -> float:
+    """Seconds to wait before retry number `attempt` (0-based) of a non-429 failure."""
+    return random.uniform(0, min(RATE_LIMIT_RETRY_MAX, RATE_LIMIT_RETRY_BASE * 2 ** attempt))
+
+
+def status_of(exc: BaseException) -> int | None:
+    """HTTP status of a provider error (429 for rate limits), if it has one."""
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int):
+        return status
+    return 429 if type(exc).__name__ == "RateLimitError" else None
+
+
+def retryable(exc: BaseException) -> bool:
+    status = status_of(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(exc).__name__ in ("APIConnectionError", "Timeout", "ServiceUnavailableError", "InternalServerError")
@@ -0,0 +1,271 @@
+"""
+Shared scheduler for LM requests across all runner processes.
+
+Runner workers ask the API process for a permit before every provider call
+(see `app.rate_client`); the pool forwards those requests here. Each provider
+(the prefix of `model`, e.g. `openai` in `openai/gpt-4o-mini`) has token
+buckets for requests and tokens per minute, and waiting requests are queued
+per flow and served round-robin so one large flow cannot starve the others.
+
+429 responses reported back by workers trigger an exponential backoff for the
+provider and cut its effective rate in half; successful calls slowly restore
+it (additive increase, multiplicative decrease).
+
+Limits come from `RATE_LIMITS_PATH` (JSON, default `data/rate_limits.json`):
+
+    {"openai": {"rpm": 500, "tpm": 200000}, "gemini": {"rpm": 15}}
+
+Providers without an entry use `RATE_LIMIT_RPM` / `RATE_LIMIT_TPM` (0 means
+unlimited).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any
+
+from .metrics import Counter, Histogram, SLOW_BUCKETS
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+RATE_LIMITS_PATH = Path(os.environ.get("RATE_LIMITS_PATH", str(DATA_DIR / "rate_limits.json")))
+RATE_LIMIT_RPM = float(os.environ.get("RATE_LIMIT_RPM", "0"))
+RATE_LIMIT_TPM = float(os.environ.get("RATE_LIMIT_TPM", "0"))
+RATE_LIMIT_BACKOFF_BASE = float(os.environ.get("RATE_LIMIT_BACKOFF_BASE", "1.0"))
+RATE_LIMIT_BACKOFF_MAX = float(os.environ.get("RATE_LIMIT_BACKOFF_MAX", "60"))
+# Lowest fraction of the configured rate adaptive backoff may fall to
+RATE_LIMIT_MIN_FACTOR = 0.1
+
+QUEUE_WAIT_SECONDS = Histogram(
+    "lm_queue_wait_seconds", "Time LM requests waited for a rate-limit permit", ("provider",), buckets=SLOW_BUCKETS
+)
+RATE_LIMITED = Counter("lm_rate_limited_total", "429 responses reported by providers", ("provider",))
+
+
+def provider_of(model: str | None) -> str:
+    """Provider prefix of a LiteLLM model name (as passed to `get_lm`)."""
+    if not model:
+        return "default"
+    return model.split("/", 1)[0] if "/" in model else "openai"
+
+
+class _Bucket:
+    """Token bucket refilled continuously at `per_minute / 60` per second."""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.per_minute <= 0
+
+    def refill(self, now: float, factor: float) -> None:
+        if self.unlimited:
+            return
+        rate = self.per_minute * factor / 60
+        self.level = min(self.per_minute, self.level + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_for(self, amount: float, factor: float) -> float:
+        """Seconds until `amount` is available (0 if it already is)."""
+        if self.unlimited:
+            return 0.0
+        # A request larger than the whole bucket only waits for a full bucket
+        amount = min(amount, self.per_minute)
+        missing = amount - self.level
+        return 0.0 if missing <= 0 else missing / (self.per_minute * factor / 60)
+
+    def take(self, amount: float) -> None:
+        if not self.unlimited:
+            self.level -= min(amount, self.per_minute)
+
+    def adjust(self, delta: float) -> None:
+        # Reconcile an estimate with actual usage; the level may go negative (debt)
+        if not self.unlimited:
+            self.level = min(self.per_minute, self.level - delta)
+
+
+class _Waiter:
+    __slots__ = ("tokens", "future", "queued_at")
+
+    def __init__(self, tokens: int, future: asyncio.Future):
+        self.tokens = tokens
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class ProviderScheduler:
+    """Permits for one provider: RPM/TPM buckets, fair per-flow queues and adaptive backoff."""
+
+    def __init__(self, provider: str, rpm: float, tpm: float):
+        self.provider = provider
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        self.factor = 1.0
+        self.backoff = 0.0
+        self.backoff_until = 0.0
+        self._queues: OrderedDict[str, deque[_Waiter]] = OrderedDict()
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.granted = 0
+        self.rate_limited = 0
+        self.wait_s_total = 0.0
+
+    @property
+    def unlimited(self) -> bool:
+        return self.requests.unlimited and self.tokens.unlimited
+
+    async def acquire(self, flow_key: str, tokens: int) -> float:
+        """Wait for a permit; returns the seconds spent queued."""
+        if self.unlimited and time.monotonic() >= self.backoff_until:
+            self.granted += 1
+            return 0.0
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(tokens, future)
+        self._queues.setdefault(flow_key, deque()).append(waiter)
+        self._wake.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Job ended while queued; drop the request
+            q = self._queues.get(flow_key)
+            if q is not None and waiter in q:
+                q.remove(waiter)
+            raise
+        waited = time.monotonic() - waiter.queued_at
+        self.wait_s_total += waited
+        QUEUE_WAIT_SECONDS.observe(waited, provider=self.provider)
+        return waited
+
+    def _next(self) -> tuple[str, _Waiter] | None:
+        # Round-robin over flows: serve the head of the first queue, then
+        # move that flow to the back
+        while self._queues:
+            key, q = next(iter(self._queues.items()))
+            while q and q[0].future.done():
+                q.popleft()
+            if not q:
+                del self._queues[key]
+                continue
+            return key, q[0]
+        return None
+
+    async def _dispatch(self) -> None:
+        while True:
+            nxt = self._next()
+            if nxt is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), 30)
+                except asyncio.TimeoutError:
+                    if not self._queues:
+                        return
+                continue
+            key, waiter = nxt
+            now = time.monotonic()
+            self.requests.refill(now, self.factor)
+            self.tokens.refill(now, self.factor)
+            delay = max(
+                self.backoff_until - now,
+                self.requests.wait_for(1, self.factor),
+                self.tokens.wait_for(waiter.tokens, self.factor),
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            self._queues[key].popleft()
+            self._queues.move_to_end(key)
+            if not waiter.future.done():
+                waiter.future.set_result(None)
+                self.granted += 1
+
+    def report(self, estimated: int, used: int | None, status: int | None) -> None:
+        """Outcome of a permitted call: reconcile tokens and adapt to 429s."""
+        if used is not None:
+            self.tokens.adjust(used - estimated)
+        if status == 429:
+            self.rate_limited += 1
+            RATE_LIMITED.inc(provider=self.provider)
+            self.backoff = min(RATE_LIMIT_BACKOFF_MAX, max(RATE_LIMIT_BACKOFF_BASE, self.backoff * 2))
+            self.backoff_until = time.monotonic() + self.backoff
+            self.factor = max(RATE_LIMIT_MIN_FACTOR, self.factor / 2)
+            self._wake.set()
+        elif status is None:
+            self.backoff = 0.0
+            self.factor = min(1.0, self.factor + 0.05)
+
+    def stats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "rpm": self.requests.per_minute or None,
+            "tpm": self.tokens.per_minute or None,
+            "rate_factor": round(self.factor, 3),
+            "backoff_s": round(max(0.0, self.backoff_until - now), 3),
+            "queued": sum(len(q) for q in self._queues.values()),
+            "flows_queued": len(self._queues),
+            "granted": self.granted,
+            "rate_limited": self.rate_limited,
+            "wait_s_total": round(self.wait_s_total, 3),
+        }
+
+
+class RateLimiter:
+    def __init__(self):
+        self._providers: dict[str, ProviderScheduler] = {}
+        self._limits: dict[str, dict[str, float]] | None = None
+
+    def limits(self) -> dict[str, dict[str, float]]:
+        if self._limits is None:
+            try:
+                self._limits = json.loads(RATE_LIMITS_PATH.read_text())
+            except FileNotFoundError:
+                self._limits = {}
+            except Exception:
+                # A broken limits file should not stop runs; fall back to the env defaults
+                self._limits = {}
+        return self._limits
+
+    def scheduler(self, provider: str) -> ProviderScheduler:
+        s = self._providers.get(provider)
+        if s is None:
+            cfg = self.limits().get(provider) or {}
+            s = self._providers[provider] = ProviderScheduler(
+                provider,
+                float(cfg.get("rpm", RATE_LIMIT_RPM)),
+                float(cfg.get("tpm", RATE_LIMIT_TPM)),
+            )
+        return s
+
+    async def acquire(self, model: str | None, flow_key: str | None, tokens: int) -> float:
+        return await self.scheduler(provider_of(model)).acquire(flow_key or "", tokens)
+
+    def report(self, model: str | None, estimated: int, used: int | None, status: int | None) -> None:
+        self.scheduler(provider_of(model)).report(estimated, used, status)
+
+    def unlimited(self, model: str | None) -> bool:
+        """No limits configured for the model's provider and no 429 backoff in progress."""
+        s = self.scheduler(provider_of(model))
+        return s.unlimited and time.monotonic() >= s.backoff_until
+
+    def stats(self) -> dict[str, Any]:
+        return {p: s.stats() for p, s in sorted(self._providers.items())}
+
+
+_limiter: RateLimiter | None = None
+
+
+def get_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = RateLimiter()
+    return _limiter
@@ -0,0 +1,491 @@
+"""
+Persistent run history: every runner event is recorded in `run_events`, with
+one summary row per node run in `runs` and per flow run in `flow_runs`
+(including token usage and cost, see `app.lm_usage`).
+
+Recording must never slow a stream down, so `RunRecorder` only enqueues rows;
+a background thread drains the queue and writes them in batches (one
+transaction per batch). When the queue is full, rows are dropped and counted
+rather than blocking. Old history is compacted: after RUN_EVENTS_DETAIL_DAYS
+only the rows the aggregate queries need are kept (without payloads), and
+after RUN_EVENTS_RETENTION_DAYS runs are deleted entirely.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any
+
+from . import blob_store
+from .db import get_connection
+from .metrics import CACHE_HITS, ERRORS, LM_LATENCY_SECONDS, TOOL_LATENCY_SECONDS
+
+RUN_EVENTS_ENABLED = os.environ.get("RUN_EVENTS_ENABLED", "1").lower() not in ("0", "false", "no")
+RUN_EVENTS_BATCH = int(os.environ.get("RUN_EVENTS_BATCH", "500"))
+RUN_EVENTS_FLUSH_MS = int(os.environ.get("RUN_EVENTS_FLUSH_MS", "250"))
+RUN_EVENTS_QUEUE_MAX = int(os.environ.get("RUN_EVENTS_QUEUE_MAX", "50000"))
+# Longest string kept per event field; the full payload already went to the client
+RUN_EVENTS_MAX_FIELD = int(os.environ.get("RUN_EVENTS_MAX_FIELD", "2000"))
+RUN_EVENTS_DETAIL_DAYS = float(os.environ.get("RUN_EVENTS_DETAIL_DAYS", "3"))
+RUN_EVENTS_RETENTION_DAYS = float(os.environ.get("RUN_EVENTS_RETENTION_DAYS", "30"))
+RUN_EVENTS_COMPACT_EVERY = float(os.environ.get("RUN_EVENTS_COMPACT_EVERY", "3600"))
+
+# Events kept (without `data`) once a run is past the detail window
+KEEP_AFTER_DETAIL = ("run_start", "run_end", "result", "error", "lm_end", "tool_end")
+
+_EVENT_COLS = (
+    "run_id, flow_id, node_id, event, ts, call_id, model, duration_ms, error, data, "
+    "prompt_tokens, completion_tokens, cost_usd"
+)
+_RUN_COLS = (
+    "run_id, flow_id, node_id, node_kind, model, status, cached, started_at, ended_at, duration_ms, lm_calls, error, "
+    "flow_run_id, prompt_tokens, completion_tokens, cost_usd"
+)
+_FLOW_RUN_COLS = (
+    "flow_run_id, flow_id, status, started_at, ended_at, duration_ms, nodes, "
+    "prompt_tokens, completion_tokens, cost_usd, token_budget, error"
+)
+
+
+def _marks(cols: str) -> str:
+    return ", ".join("?" * len(cols.split(", ")))
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _trim(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > RUN_EVENTS_MAX_FIELD:
+        return value[:RUN_EVENTS_MAX_FIELD] + f"... [{len(value) - RUN_EVENTS_MAX_FIELD} more chars]"
+    if isinstance(value, dict):
+        return {k: _trim(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_trim(v) for v in value]
+    return value
+
+
+class RunRecorder:
+    """Turns one node run's event stream into run_events rows and a runs summary.
+
+    Also the point where runner-side timings (LM and tool latency, cache hits,
+    errors) are aggregated into `app.metrics`, whether or not history is on.
+    """
+
+    def __init__(self, flow_id: str | None, payload: dict[str, Any], flow_run_id: str | None = None):
+        self.flow_id = flow_id
+        self.flow_run_id = flow_run_id
+        self.node_id = payload.get("node_id")
+        self.node_kind = payload.get("node_kind")
+        self.model = payload.get("model")
+        self.run_id: str | None = None
+        self.status = "running"
+        self.cached = False
+        self.error: str | None = None
+        self.started_at = _now_ms()
+        self.lm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd: float | None = None
+        self._lm_starts: dict[str, tuple[int, str | None]] = {}
+        self._tool_starts: dict[str, tuple[int, str | None]] = {}
+        self._closed = False
+
+    def observe(self, ev: dict[str, Any]) -> None:
+        if self._closed:
+            return
+        kind = ev.get("event")
+        ts = ev.get("ts") or _now_ms()
+        if self.run_id is None:
+            self.run_id = ev.get("run_id") or uuid.uuid4().hex
+            self.cached = bool(ev.get("cached"))
+            if self.cached:
+                CACHE_HITS.inc(cache="node")
+            _writer.put_run(self._run_row())
+        call_id = ev.get("call_id")
+        model = None
+        duration = None
+        error = None
+        usage = None
+        if kind == "lm_start":
+            self._lm_starts[call_id] = (ts, ev.get("model"))
+            model = ev.get("model")
+        elif kind == "lm_end":
+            start_ts, model = self._lm_starts.pop(call_id, (None, None))
+            duration = ts - start_ts if start_ts is not None else None
+            error = ev.get("exception")
+            self.lm_calls += 1
+            if duration is not None:
+                LM_LATENCY_SECONDS.observe(duration / 1000, model=model or "unknown")
+            if ev.get("cache_hit"):
+                CACHE_HITS.inc(cache="lm")
+            if error:
+                ERRORS.inc(kind="lm")
+            usage = ev.get("usage")
+            if usage:
+                self.prompt_tokens += usage.get("prompt_tokens") or 0
+                self.completion_tokens += usage.get("completion_tokens") or 0
+                if usage.get("cost_usd") is not None:
+                    self.cost_usd = (self.cost_usd or 0.0) + usage["cost_usd"]
+        elif kind == "tool_start":
+            self._tool_starts[call_id] = (ts, ev.get("tool"))
+        elif kind == "tool_end":
+            start_ts, tool = self._tool_starts.pop(call_id, (None, None))
+            duration = ts - start_ts if start_ts is not None else None
+            error = ev.get("exception") or ev.get("error")
+            if duration is not None:
+                TOOL_LATENCY_SECONDS.observe(duration / 1000, tool=ev.get("tool") or tool or "unknown")
+            if error:
+                ERRORS.inc(kind="tool")
+        elif kind == "error":
+            ERRORS.inc(kind="run")
+            error = ev.get("message")
+            self.status = "error"
+            self.error = error
+        elif kind in ("cancelled", "timeout"):
+            if kind == "timeout":
+                ERRORS.inc(kind="run")
+            error = ev.get("message")
+            self.status = kind
+            self.error = error
+        elif kind == "result" and self.status != "error":
+            self.status = "done"
+        data = {k: v for k, v in ev.items() if k not in ("event", "ts", "run_id", "call_id", "node")}
+        _writer.put_event((
+            self.run_id,
+            self.flow_id,
+            self.node_id,
+            kind,
+            ts,
+            None if call_id is None else str(call_id),
+            model,
+            duration,
+            None if error is None else str(error)[:RUN_EVENTS_MAX_FIELD],
+            json.dumps(_trim(data), default=str),
+            usage.get("prompt_tokens") if usage else None,
+            usage.get("completion_tokens") if usage else None,
+            usage.get("cost_usd") if usage else None,
+        ))
+
+    def close(self, status: str | None = None) -> None:
+        """Finalize the runs row; a run that never finished is recorded as aborted."""
+        if self._closed or self.run_id is None:
+            self._closed = True
+            return
+        self._closed = True
+        if status:
+            self.status = status
+        elif self.status == "running":
+            self.status = "aborted"
+        _writer.put_run(self._run_row(ended_at=_now_ms()))
+
+    def _run_row(self, ended_at: int | None = None) -> tuple:
+        return (
+            self.run_id,
+            self.flow_id,
+            self.node_id,
+            self.node_kind,
+            self.model,
+            self.status,
+            int(self.cached),
+            self.started_at,
+            ended_at,
+            None if ended_at is None else ended_at - self.started_at,
+            self.lm_calls,
+            self.error,
+            self.flow_run_id,
+            self.prompt_tokens,
+            self.completion_tokens,
+            None if self.cost_usd is None else round(self.cost_usd, 8),
+        )
+
+
+def record_flow_run(row: dict[str, Any]) -> None:
+    """Queue a flow_runs upsert (written with the next batch)."""
+    row = {"nodes": 0, "prompt_tokens": 0, "completion_tokens": 0, **row}
+    _writer.put_flow_run(tuple(row.get(c) for c in _FLOW_RUN_COLS.split(", ")))
+
+
+class _Writer:
+    """Background thread draining recorded rows into SQLite in batches."""
+
+    def __init__(self):
+        self._q: queue.Queue[tuple[str, tuple]] = queue.Queue(maxsize=RUN_EVENTS_QUEUE_MAX)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._last_compact = time.monotonic()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._loop, name="run-events", daemon=True)
+                    self._thread.start()
+
+    def _put(self, item: tuple[str, tuple]) -> None:
+        if not RUN_EVENTS_ENABLED:
+            return
+        self._ensure_started()
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def put_event(self, row: tuple) -> None:
+        self._put(("event", row))
+
+    def put_run(self, row: tuple) -> None:
+        self._put(("run", row))
+
+    def put_flow_run(self, row: tuple) -> None:
+        self._put(("flow_run", row))
+
+    def _loop(self) -> None:
+        while not (self._stop.is_set() and self._q.empty()):
+            batch: list[tuple[str, tuple]] = []
+            deadline = time.monotonic() + RUN_EVENTS_FLUSH_MS / 1000
+            while len(batch) < RUN_EVENTS_BATCH:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            if time.monotonic() - self._last_compact >= RUN_EVENTS_COMPACT_EVERY:
+                self._last_compact = time.monotonic()
+                try:
+                    compact()
+                except Exception:
+                    pass
+
+    def _write(self, batch: list[tuple[str, tuple]]) -> None:
+        try:
+            self._insert(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception:
+            # Retry row by row so one bad row does not cost the whole batch
+            for item in batch:
+                try:
+                    self._insert([item])
+                    self.written += 1
+                except Exception:
+                    # History is best-effort; never let a bad row kill the writer
+                    self.dropped += 1
+
+    def _insert(self, batch: list[tuple[str, tuple]]) -> None:
+        events = [row for kind, row in batch if kind == "event"]
+        runs = [row for kind, row in batch if kind == "run"]
+        flow_runs = [row for kind, row in batch if kind == "flow_run"]
+        with get_connection() as conn:
+            if runs:
+                conn.executemany(
+                    f"""
+                    INSERT INTO runs ({_RUN_COLS}) VALUES ({_marks(_RUN_COLS)})
+                    ON CONFLICT(run_id) DO UPDATE SET
+                        status = excluded.status,
+                        ended_at = excluded.ended_at,
+                        duration_ms = excluded.duration_ms,
+                        lm_calls = excluded.lm_calls,
+                        error = excluded.error,
+                        prompt_tokens = excluded.prompt_tokens,
+                        completion_tokens = excluded.completion_tokens,
+                        cost_usd = excluded.cost_usd
+                    """,
+                    runs,
+                )
+            if flow_runs:
+                conn.executemany(
+                    f"""
+                    INSERT INTO flow_runs ({_FLOW_RUN_COLS}) VALUES ({_marks(_FLOW_RUN_COLS)})
+                    ON CONFLICT(flow_run_id) DO UPDATE SET
+                        status = excluded.status,
+                        ended_at = excluded.ended_at,
+                        duration_ms = excluded.duration_ms,
+                        nodes = excluded.nodes,
+                        prompt_tokens = excluded.prompt_tokens,
+                        completion_tokens = excluded.completion_tokens,
+                        cost_usd = excluded.cost_usd,
+                        error = excluded.error
+                    """,
+                    flow_runs,
+                )
+            if events:
+                conn.executemany(f"INSERT INTO run_events ({_EVENT_COLS}) VALUES ({_marks(_EVENT_COLS)})", events)
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": RUN_EVENTS_ENABLED,
+            "queued": self._q.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+        }
+
+
+_writer = _Writer()
+
+
+def writer_stats() -> dict[str, Any]:
+    return _writer.stats()
+
+
+def shutdown() -> None:
+    _writer.stop()
+
+
+# ---- retention ----
+
+def compact(now_ms: int | None = None) -> dict[str, int]:
+    """Apply the retention policy; returns how many rows were slimmed and deleted (and blobs swept)."""
+    now_ms = now_ms or _now_ms()
+    detail_cutoff = now_ms - int(RUN_EVENTS_DETAIL_DAYS * 86_400_000)
+    retention_cutoff = now_ms - int(RUN_EVENTS_RETENTION_DAYS * 86_400_000)
+    keep = ", ".join("?" * len(KEEP_AFTER_DETAIL))
+    with get_connection() as conn:
+        deleted = conn.execute("DELETE FROM run_events WHERE ts < ?", (retention_cutoff,)).rowcount
+        deleted_runs = conn.execute("DELETE FROM runs WHERE started_at < ?", (retention_cutoff,)).rowcount
+        deleted_runs += conn.execute("DELETE FROM flow_runs WHERE started_at < ?", (retention_cutoff,)).rowcount
+        dropped = conn.execute(
+            f"DELETE FROM run_events WHERE ts < ? AND event NOT IN ({keep})",
+            (detail_cutoff, *KEEP_AFTER_DETAIL),
+        ).rowcount
+        slimmed = conn.execute(
+            "UPDATE run_events SET data = NULL WHERE ts < ? AND data IS NOT NULL",
+            (detail_cutoff,),
+        ).rowcount
+    # Slimmed events no longer reference prompt/response blobs
+    blobs = blob_store.sweep(RUN_EVENTS_DETAIL_DAYS)
+    return {"deleted": deleted + dropped, "deleted_runs": deleted_runs, "slimmed": slimmed, "blobs": blobs}
+
+
+# ---- queries ----
+
+def recent_runs(flow_id: str | None = None, limit: int = 50) -> list[dict[str, Any]]:
+    with get_connection() as conn:
+        if flow_id:
+            cur = conn.execute(
+                f"SELECT {_RUN_COLS} FROM runs WHERE flow_id = ? ORDER BY started_at DESC LIMIT ?",
+                (flow_id, limit),
+            )
+        else:
+            cur = conn.execute(f"SELECT {_RUN_COLS} FROM runs ORDER BY started_at DESC LIMIT ?", (limit,))
+        return [dict(r) for r in cur.fetchall()]
+
+
+def run_events(run_id: str) -> list[dict[str, Any]] | None:
+    with get_connection() as conn:
+        if not conn.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone():
+            return None
+        cur = conn.execute(
+            f"SELECT id, {_EVENT_COLS} FROM run_events WHERE run_id = ? ORDER BY id",
+            (run_id,),
+        )
+        rows = []
+        for r in cur.fetchall():
+            d = dict(r)
+            d["data"] = json.loads(d["data"]) if d["data"] else None
+            rows.append(d)
+        return rows
+
+
+def slowest_lm_calls(since_hours: float = 24, limit: int = 20, model: str | None = None) -> list[dict[str, Any]]:
+    since = _now_ms() - int(since_hours * 3_600_000)
+    sql = (
+        "SELECT run_id, flow_id, node_id, call_id, model, ts, duration_ms, error FROM run_events "
+        "WHERE event = 'lm_end' AND ts >= ? AND duration_ms IS NOT NULL"
+    )
+    params: list[Any] = [since]
+    if model:
+        sql += " AND model = ?"
+        params.append(model)
+    sql += " ORDER BY duration_ms DESC LIMIT ?"
+    params.append(limit)
+    with get_connection() as conn:
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+
+def error_rates(since_hours: float = 24, group_by: str = "flow") -> list[dict[str, Any]]:
+    """Error rate per flow, node or model (runs), or per LM model (`lm`, from lm_end events)."""
+    since = _now_ms() - int(since_hours * 3_600_000)
+    if group_by == "lm":
+        sql = """
+            SELECT model AS key, COUNT(*) AS total, SUM(error IS NOT NULL) AS errors,
+                   CAST(AVG(duration_ms) AS INTEGER) AS avg_ms
+            FROM run_events WHERE event = 'lm_end' AND ts >= ?
+            GROUP BY model ORDER BY errors DESC, total DESC
+        """
+    else:
+        col = {"flow": "flow_id", "node": "node_id", "model": "model"}[group_by]
+        sql = f"""
+            SELECT {col} AS key, COUNT(*) AS total, SUM(status = 'error') AS errors,
+                   SUM(status = 'aborted') AS aborted, CAST(AVG(duration_ms) AS INTEGER) AS avg_ms
+            FROM runs WHERE started_at >= ? AND status != 'running'
+            GROUP BY {col} ORDER BY errors DESC, total DESC
+        """
+    with get_connection() as conn:
+        rows = [dict(r) for r in conn.execute(sql, (since,)).fetchall()]
+    for r in rows:
+        r["error_rate"] = round(r["errors"] / r["total"], 4) if r["total"] else 0.0
+    return rows
+
+
+def recent_flow_runs(flow_id: str | None = None, limit: int = 50) -> list[dict[str, Any]]:
+    with get_connection() as conn:
+        if flow_id:
+            cur = conn.execute(
+                f"SELECT {_FLOW_RUN_COLS} FROM flow_runs WHERE flow_id = ? ORDER BY started_at DESC LIMIT ?",
+                (flow_id, limit),
+            )
+        else:
+            cur = conn.execute(f"SELECT {_FLOW_RUN_COLS} FROM flow_runs ORDER BY started_at DESC LIMIT ?", (limit,))
+        return [dict(r) for r in cur.fetchall()]
+
+
+def usage(since_hours: float = 24, group_by: str = "node", flow_id: str | None = None, limit: int = 50) -> list[dict[str, Any]]:
+    """Token and cost totals per node, flow or model, heaviest first."""
+    since = _now_ms() - int(since_hours * 3_600_000)
+    if group_by == "model":
+        # Per LM call, so the model actually used is counted (not the node's default)
+        table, key, runs_expr = "run_events", "model", "COUNT(DISTINCT run_id)"
+        where = "event = 'lm_end' AND ts >= ?"
+    else:
+        table, runs_expr = "runs", "COUNT(*)"
+        key = {"node": "flow_id, node_id", "flow": "flow_id"}[group_by]
+        where = "started_at >= ?"
+    params: list[Any] = [since]
+    if flow_id:
+        where += " AND flow_id = ?"
+        params.append(flow_id)
+    params.append(limit)
+    sql = f"""
+        SELECT {key}, {runs_expr} AS runs,
+               COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+               COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+               COALESCE(SUM(prompt_tokens), 0) + COALESCE(SUM(completion_tokens), 0) AS total_tokens,
+               ROUND(SUM(cost_usd), 6) AS cost_usd
+        FROM {table} WHERE {where}
+        GROUP BY {key} ORDER BY total_tokens DESC LIMIT ?
+    """
+    with get_connection() as conn:
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
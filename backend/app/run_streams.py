@@ -0,0 +1,325 @@
+"""
+Run execution decoupled from the HTTP connection that started it.
+
+`start` drives a run's NDJSON event source (a node or flow run) on a
+background task that appends every line, numbered by `seq`, to a bounded
+per-run ring buffer. Clients `attach` from any offset: buffered lines are
+replayed, then new ones follow as they arrive. Disconnecting only detaches,
+so a run survives tab reloads and dropped proxies and a client can pick it up
+again (`GET /api/runs/{run_id}/stream?offset=` or SSE `Last-Event-ID`).
+
+The producer never waits for clients. A client that falls more than
+RUN_STREAM_SLOW_LAG lines behind a live run is caught up by coalescing:
+progress events (LM/module/tool steps, queue waits, batch progress) are
+skipped, `token` chunks are merged per field, and one `coalesced` line counts
+what was folded.
+
+Results, errors and lifecycle events are never lost to a lagging client:
+when the ring evicts one it moves to a side list that is only trimmed past
+lines every attached client has read. Progress lines that fell out of the
+buffer before a client got them are reported with one `replay_gap` line.
+A finished run stays attachable for RUN_STREAM_TTL
+seconds; a running one nobody has attached to for RUN_STREAM_DETACHED_TIMEOUT
+seconds is cancelled.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Any, AsyncIterator
+
+# Lines kept per run for replay (oldest dropped first), by count and size
+RUN_STREAM_BUFFER = int(os.environ.get("RUN_STREAM_BUFFER", "10000"))
+RUN_STREAM_BUFFER_MB = float(os.environ.get("RUN_STREAM_BUFFER_MB", "16"))
+# Seconds a finished run stays attachable
+RUN_STREAM_TTL = float(os.environ.get("RUN_STREAM_TTL", "300"))
+# Cancel a run nobody has been attached to for this long (0 = never)
+RUN_STREAM_DETACHED_TIMEOUT = float(os.environ.get("RUN_STREAM_DETACHED_TIMEOUT", "900"))
+# A client this many lines behind a live run gets progress events coalesced (0 = never)
+RUN_STREAM_SLOW_LAG = int(os.environ.get("RUN_STREAM_SLOW_LAG", "500"))
+# Comment lines keep idle SSE connections open through proxies
+SSE_PING_S = 15.0
+
+# Intermediate events a lagging client may miss; anything else is always sent
+_PROGRESS = frozenset({
+    "token", "queue_wait", "lm_start", "lm_end", "module_start", "module_end", "tool_start", "tool_end", "batch_progress",
+})
+_EVENT_PREFIX = b'{"event": "'
+
+
+def _over(count: int, size: int) -> bool:
+    return count > RUN_STREAM_BUFFER or size > RUN_STREAM_BUFFER_MB * 1024 * 1024
+
+
+def _kind(line: bytes) -> str | None:
+    """Event name of an encoded line without parsing it (encoders put `event` first)."""
+    if not line.startswith(_EVENT_PREFIX):
+        return None
+    end = line.find(b'"', len(_EVENT_PREFIX))
+    return line[len(_EVENT_PREFIX):end].decode("utf-8", "replace") if end > 0 else None
+
+
+class _Coalescer:
+    """Progress lines a lagging client skipped, folded into a few summary lines."""
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.counts: dict[str, int] = {}
+        self.tokens: dict[tuple, dict[str, Any]] = {}
+
+    def add(self, kind: str, line: bytes) -> None:
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if kind != "token":
+            return
+        try:
+            ev = json.loads(line)
+        except ValueError:
+            return
+        key = (ev.get("run_id"), ev.get("node_id"), ev.get("row"), ev.get("field"))
+        merged = self.tokens.get(key)
+        if merged is None:
+            self.tokens[key] = ev
+            return
+        merged["chunk"] = (merged.get("chunk") or "") + (ev.get("chunk") or "")
+        merged["chunks"] = merged.get("chunks", 1) + ev.get("chunks", 1)
+        for k in ("ts", "last", "seq"):
+            if k in ev:
+                merged[k] = ev[k]
+
+    def flush(self, through: int) -> list[tuple[int | None, bytes]]:
+        """Merged token lines, then one `coalesced` line resumable after `through`."""
+        if not self.counts:
+            return []
+        out: list[tuple[int | None, bytes]] = [(None, (json.dumps(ev) + "\n").encode("utf-8")) for ev in self.tokens.values()]
+        summary = {
+            "event": "coalesced",
+            "run_id": self.run_id,
+            "count": sum(self.counts.values()) - len(self.tokens),
+            "events": self.counts,
+            "seq": through,
+        }
+        out.append((through, (json.dumps(summary) + "\n").encode("utf-8")))
+        self.counts = {}
+        self.tokens = {}
+        return out
+
+
+class RunStream:
+    """Ring buffer of one run's event lines plus the task producing them."""
+
+    def __init__(self, run_id: str, kind: str):
+        self.run_id = run_id
+        self.kind = kind
+        self.started_at = time.time()
+        self.finished_at: float | None = None
+        self.lines: deque[tuple[int, bytes]] = deque()
+        # Non-progress lines evicted from `lines`, still owed to lagging clients
+        self.kept: deque[tuple[int, bytes]] = deque()
+        self.bytes = 0
+        self.kept_bytes = 0
+        # Next seq each attached client will read
+        self._cursors: dict[int, int] = {}
+        self._ids = itertools.count()
+        self.next_seq = 0
+        self.subscribers = 0
+        # Lines lagging clients were sent coalesced instead of one by one
+        self.coalesced = 0
+        self.detached_at: float | None = time.time()
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def first_seq(self) -> int:
+        return self.lines[0][0] if self.lines else self.next_seq
+
+    async def append(self, line: bytes) -> None:
+        seq = self.next_seq
+        self.next_seq += 1
+        # Stamp the position into the JSON object so NDJSON clients can resume
+        if line.endswith(b"}\n") and line != b"{}\n":
+            line = line[:-2] + b', "seq": %d}\n' % seq
+        self.lines.append((seq, line))
+        self.bytes += len(line)
+        while len(self.lines) > 1 and _over(len(self.lines), self.bytes):
+            evicted = self.lines.popleft()
+            self.bytes -= len(evicted[1])
+            if _kind(evicted[1]) not in _PROGRESS:
+                self.kept.append(evicted)
+                self.kept_bytes += len(evicted[1])
+        self._trim_kept()
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _trim_kept(self) -> None:
+        # Only lines every attached client is already past may go
+        low = min(self._cursors.values(), default=self.next_seq)
+        while self.kept and self.kept[0][0] < low and _over(len(self.kept), self.kept_bytes):
+            self.kept_bytes -= len(self.kept.popleft()[1])
+
+    def _line_at(self, offset: int) -> tuple[int, bytes] | None:
+        """First buffered line with seq >= `offset` (kept lines included), None when caught up."""
+        if offset >= self.first_seq:
+            return self.lines[offset - self.first_seq] if offset < self.next_seq else None
+        # Kept seqs all precede the ring's
+        i = bisect_left(self.kept, (offset,))
+        if i < len(self.kept):
+            return self.kept[i]
+        return self.lines[0] if self.lines else None
+
+    async def finish(self) -> None:
+        self.finished_at = time.time()
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def attach(self, offset: int, *, ping: float | None = None) -> AsyncIterator[tuple[int | None, bytes]]:
+        """Yield (seq, line) from `offset` on until the run ends; `(None, b"")` after `ping` idle seconds.
+
+        Lines without a seq of their own (`replay_gap`, merged tokens) come as `(None, line)`.
+        """
+        self.subscribers += 1
+        self.detached_at = None
+        offset = min(max(0, offset), self.next_seq)
+        cursor = next(self._ids)
+        self._cursors[cursor] = offset
+        skipped = _Coalescer(self.run_id)
+        try:
+            while True:
+                nxt = self._line_at(offset)
+                if nxt is not None:
+                    seq, line = nxt
+                    if seq > offset:
+                        for item in skipped.flush(offset - 1):
+                            yield item
+                        # Progress lines never buffered, or evicted before this client read them
+                        gap = {"event": "replay_gap", "run_id": self.run_id, "offset": offset, "oldest": seq, "missed": seq - offset}
+                        yield None, (json.dumps(gap) + "\n").encode("utf-8")
+                    offset = seq + 1
+                    self._cursors[cursor] = offset
+                    if 0 < RUN_STREAM_SLOW_LAG < self.next_seq - offset and not self.done:
+                        kind = _kind(line)
+                        if kind in _PROGRESS:
+                            skipped.add(kind, line)
+                            self.coalesced += 1
+                            continue
+                    for item in skipped.flush(seq - 1):
+                        yield item
+                    yield seq, line
+                    continue
+                for item in skipped.flush(offset - 1):
+                    yield item
+                if self.done:
+                    return
+                async with self._changed:
+                    if offset < self.next_seq or self.done:
+                        continue
+                    try:
+                        async with asyncio.timeout(ping):
+                            await self._changed.wait()
+                    except TimeoutError:
+                        yield None, b""
+        finally:
+            del self._cursors[cursor]
+            self._trim_kept()
+            self.subscribers -= 1
+            if self.subscribers == 0:
+                self.detached_at = time.time()
+
+    def info(self) -> dict[str, Any]:
+        return {
+            "run_id": self.run_id,
+            "kind": self.kind,
+            "done": self.done,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "events": self.next_seq,
+            "first_seq": self.first_seq,
+            "kept": len(self.kept),
+            "buffered_bytes": self.bytes + self.kept_bytes,
+            "subscribers": self.subscribers,
+            "coalesced": self.coalesced,
+        }
+
+
+_streams: dict[str, RunStream] = {}
+_reaper: asyncio.Task | None = None
+
+
+def start(run_id: str, kind: str, source: AsyncIterator[bytes]) -> RunStream:
+    """Run `source` to completion in the background, buffering its lines under `run_id`."""
+    global _reaper
+    if run_id in _streams and not _streams[run_id].done:
+        raise ValueError(f"Run {run_id} is already running")
+    stream = RunStream(run_id, kind)
+    _streams[run_id] = stream
+
+    async def produce() -> None:
+        try:
+            async for line in source:
+                await stream.append(line)
+        except asyncio.CancelledError:
+            await stream.append((json.dumps({"event": "cancelled", "run_id": run_id, "message": "Run stopped"}) + "\n").encode("utf-8"))
+        except Exception as e:
+            # The source broke mid-run: end the stream with an error instead of silently
+            await stream.append((json.dumps({"event": "error", "run_id": run_id, "message": f"Run failed: {e}"}) + "\n").encode("utf-8"))
+        finally:
+            await stream.finish()
+
+    stream.task = asyncio.create_task(produce())
+    if _reaper is None or _reaper.done():
+        _reaper = asyncio.create_task(_reap())
+    return stream
+
+
+def get(run_id: str) -> RunStream | None:
+    return _streams.get(run_id)
+
+
+def cancel(run_id: str) -> bool:
+    """Stop a buffered run's producer (fallback when neither the pool nor the flow executor knows the id)."""
+    stream = _streams.get(run_id)
+    if stream is None or stream.done or stream.task is None:
+        return False
+    stream.task.cancel()
+    return True
+
+
+def active() -> list[dict[str, Any]]:
+    return [s.info() for s in _streams.values()]
+
+
+async def _reap() -> None:
+    while _streams:
+        await asyncio.sleep(min(30.0, RUN_STREAM_TTL))
+        now = time.time()
+        for run_id, s in list(_streams.items()):
+            if s.done and now - (s.finished_at or now) > RUN_STREAM_TTL:
+                _streams.pop(run_id, None)
+            elif (
+                not s.done
+                and RUN_STREAM_DETACHED_TIMEOUT > 0
+                and s.detached_at is not None
+                and now - s.detached_at > RUN_STREAM_DETACHED_TIMEOUT
+                and s.task is not None
+            ):
+                s.task.cancel()
+
+
+async def close() -> None:
+    """Cancel every run still producing (shutdown)."""
+    tasks = [s.task for s in _streams.values() if s.task is not None and not s.task.done()]
+    for t in tasks:
+        t.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    if _reaper is not None:
+        _reaper.cancel()
@@ -1,9 +1,116 @@
 from __future__ import annotations
 
 import ast
+import asyncio
+import hashlib
+import os
+import time
+from queue import Queue
+from types import CodeType
 from typing import Any, Callable, Iterable
 
 import dspy
+from asyncer import syncify
+
+from . import lm_cache, lm_usage, rate_client
+from .dspy_signature import signature_cache_stats
+from .dspy_streaming import example_row
+from .utils import LRUCache
+
+MODULE_CACHE_SIZE = int(os.environ.get("MODULE_CACHE_SIZE", "128"))
+TOOL_CACHE_SIZE = int(os.environ.get("TOOL_CACHE_SIZE", "256"))
+# Threads dspy.Parallel uses when a node runs a list of examples
+RUNNER_EXAMPLE_THREADS = max(1, int(os.environ.get("RUNNER_EXAMPLE_THREADS", "8")))
+
+_modules: LRUCache[Any] = LRUCache(MODULE_CACHE_SIZE)
+# Compiled snippet, or why it was rejected before running
+_tools: LRUCache[tuple[CodeType | None, str | None]] = LRUCache(TOOL_CACHE_SIZE)
+
+
+class StreamAttempt:
+    """Marker CachedLM sends through dspy's stream before (`done=False`) and after each streamed provider call."""
+
+    __slots__ = ("predict_id", "done")
+
+    def __init__(self, predict_id: int | None, done: bool):
+        self.predict_id = predict_id
+        self.done = done
+
+
+def _mark_stream(done: bool) -> None:
+    # Sent in order with the chunks, so `run_streaming` sees where each attempt begins
+    stream = dspy.settings.send_stream
+    if stream is None:
+        return
+    caller = dspy.settings.caller_predict
+    syncify(stream.send)(StreamAttempt(id(caller) if caller else None, done))
+
+
+class CachedLM(dspy.LM):
+    """dspy.LM backed by the shared on-disk cache in `app.lm_cache`.
+
+    DSPy's own per-process cache is bypassed so that hits are only ever served
+    (and reported) by the shared cache. `cache=False` in lm_params opts out.
+    Provider calls (not cache hits) go through the shared rate limiter.
+    """
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        lm_cache.mark_hit(False)
+        lm_usage.reset()
+        use_cache = kwargs.pop("cache", self.cache)
+        if not (use_cache and lm_cache.LM_CACHE_ENABLED):
+            return self._call(prompt, messages, kwargs)
+
+        msgs = messages or [{"role": "user", "content": prompt}]
+        key = lm_cache.make_key(self.model, {**self.kwargs, **kwargs}, msgs)
+        hit = lm_cache.get(key)
+        if hit is not None:
+            # Same convention as DSPy's cache: no tokens were spent on a hit
+            if hasattr(hit, "usage"):
+                hit.usage = {}
+            hit.cache_hit = True
+            lm_cache.mark_hit(True)
+            lm_usage.record(self.model, hit)
+            return hit
+
+        response = self._call(prompt, messages, kwargs)
+        lm_cache.put(key, self.model, response)
+        return response
+
+    def _call(self, prompt, messages, kwargs):
+        """Provider call; inside a worker each attempt first waits for a rate-limit permit."""
+        if not rate_client.active():
+            response = self._attempt(prompt, messages, kwargs)
+            lm_usage.record(self.model, response)
+            return response
+        estimate = rate_client.estimate_tokens(messages, prompt, {**self.kwargs, **kwargs})
+        attempt = 0
+        while True:
+            rate_client.acquire(self.model, estimate)
+            try:
+                response = self._attempt(prompt, messages, kwargs)
+            except Exception as e:
+                status = rate_client.status_of(e) or 500
+                rate_client.report(self.model, estimate, None, status)
+                if attempt >= rate_client.RATE_LIMIT_RETRIES or not rate_client.retryable(e):
+                    raise
+                # Retries go back through the scheduler, which backs off after a 429;
+                # other failures back off here so a down provider is not hammered
+                if status != 429:
+                    time.sleep(rate_client.retry_delay(attempt))
+                attempt += 1
+                continue
+            lm_usage.record(self.model, response)
+            rate_client.report(self.model, estimate, (lm_usage.last() or {}).get("total_tokens"), None)
+            return response
+
+    def _attempt(self, prompt, messages, kwargs):
+        """One provider call. When streaming it is bracketed by `StreamAttempt` markers, so chunks
+        of an attempt that fails (and is retried here or by the adapter fallback) can be discarded."""
+        _mark_stream(False)
+        response = super().forward(prompt=prompt, messages=messages, cache=False, **kwargs)
+        _mark_stream(True)
+        return response
 
 
 def get_lm(model: str | None, lm_params: dict | None) -> Any:
@@ -12,8 +119,11 @@ def get_lm(model: str | None, lm_params: dict | None) -> Any:
     Falls back to default provider when `model` is None.
     """
     params = lm_params or {}
+    if rate_client.active():
+        # Retries are scheduled by CachedLM; LiteLLM's own would bypass the limiter
+        params = {**params, "num_retries": 0}
     if model:
-        return dspy.LM(model=model, **params)
+        return CachedLM(model=model, **params)
     return dspy.LM()
 
 
@@ -32,39 +142,60 @@ def parse_tools(
     - Executes in an isolated namespace containing `dspy`
     - If `wrap` is provided, applies it to the last discovered function with its index
     - Returns (tools, errors)
+
+    Snippets are parsed, validated and compiled once per process and cached by
+    SHA-256 (rejections included). Every call executes the compiled code in a
+    fresh namespace, so module-level state does not carry over between runs
+    and a snippet whose top-level code failed (network, env var) is retried.
     """
     tools: list[Callable[..., Any]] = []
     errors: list[str] = []
 
     for idx, code in enumerate(tools_code):
-        try:
-            tree = ast.parse(code)
-        except Exception as e:
-            errors.append(f"Tool #{idx+1} parse error: {e}")
+        digest = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        compiled, error = _tools.get_or_create(digest, lambda: _compile_tool(code, digest))
+        fn = None
+        if compiled is not None:
+            fn, error = _exec_tool(compiled)
+        if error:
+            errors.append(f"Tool #{idx+1} {error}")
             continue
+        if wrap:
+            fn = wrap(fn, idx)
+        tools.append(fn)
 
-        # Require at least one function definition
-        has_func = any(getattr(n, "name", None) and hasattr(n, "args") for n in tree.body)
-        if not has_func:
-            errors.append(f"Tool #{idx+1} must define at least one function (def ...)")
-            continue
+    return tools, errors
 
-        try:
-            ns: dict[str, Any] = {"dspy": dspy}
-            exec(compile(tree, filename=f"<tool_{idx+1}>", mode="exec"), ns, ns)
-            fns = _discover_functions(ns)
-            if not fns:
-                errors.append(f"Tool #{idx+1} did not define any callable functions")
-                continue
-            fn = fns[-1]
-            if wrap:
-                fn = wrap(fn, idx)
-            tools.append(fn)
-        except Exception as e:
-            errors.append(f"Tool #{idx+1} execution error: {e}")
-            continue
 
-    return tools, errors
+def _compile_tool(code: str, digest: str) -> tuple[CodeType | None, str | None]:
+    """Parse, validate and compile one snippet; returns (code object, error)."""
+    try:
+        tree = ast.parse(code)
+    except Exception as e:
+        return None, f"parse error: {e}"
+
+    # Require at least one function definition
+    has_func = any(getattr(n, "name", None) and hasattr(n, "args") for n in tree.body)
+    if not has_func:
+        return None, "must define at least one function (def ...)"
+
+    try:
+        return compile(tree, filename=f"<tool_{digest[:12]}>", mode="exec"), None
+    except Exception as e:
+        return None, f"parse error: {e}"
+
+
+def _exec_tool(compiled: CodeType) -> tuple[Callable[..., Any] | None, str | None]:
+    """Run a compiled snippet in a fresh namespace; returns (function, error)."""
+    try:
+        ns: dict[str, Any] = {"dspy": dspy}
+        exec(compiled, ns, ns)
+        fns = _discover_functions(ns)
+        if not fns:
+            return None, "did not define any callable functions"
+        return fns[-1], None
+    except Exception as e:
+        return None, f"execution error: {e}"
 
 
 def build_module(kind: str, Sig: Any, *, tools: list[Callable[..., Any]] | None = None) -> Any:
@@ -73,16 +204,38 @@ def build_module(kind: str, Sig: Any, *, tools: list[Callable[..., Any]] | None
     - chainofthought -> ChainOfThought(Sig)
     - agent -> ReAct(Sig, tools=tools)
     - default -> Predict(Sig)
+
+    Predict/ChainOfThought instances are cached per (Signature, kind); agents are
+    always rebuilt because their tools are wrapped per run.
     """
-    if kind == "chainofthought":
-        return dspy.ChainOfThought(Sig)
     if kind == "agent":
         if not tools:
             raise ValueError("Agent requires at least one valid tool")
         return dspy.ReAct(Sig, tools=tools)
+    module = _modules.get_or_create((Sig, kind), lambda: _new_module(kind, Sig))
+    _reset_history(module)
+    return module
+
+
+def _new_module(kind: str, Sig: Any) -> Any:
+    if kind == "chainofthought":
+        return dspy.ChainOfThought(Sig)
     return dspy.Predict(Sig)
 
 
+def _reset_history(module: Any) -> None:
+    # Reused modules would otherwise accumulate every past call's history
+    for _, sub in [(None, module), *module.named_sub_modules()]:
+        history = getattr(sub, "history", None)
+        if isinstance(history, list):
+            history.clear()
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    """Hit/miss counters for the per-process runner caches."""
+    return {"signatures": signature_cache_stats(), "modules": _modules.stats(), "tools": _tools.stats()}
+
+
 def collect_outputs(pred: Any, outputs_schema: list[dict]) -> dict[str, Any]:
     """Extract declared outputs from a DSPy prediction object safely."""
     out: dict[str, Any] = {}
@@ -94,3 +247,123 @@ def collect_outputs(pred: Any, outputs_schema: list[dict]) -> dict[str, Any]:
             out[name] = None
     return out
 
+
+def stream_listeners(module: Any, fields: Iterable[str]) -> list[Any]:
+    """One `StreamListener` per (predictor, field) for the string output fields named in `fields`.
+
+    Listeners are bound to their predictor explicitly, so a field produced by
+    several predictors (or a predictor called in a loop) streams from each.
+    """
+    wanted = set(fields)
+    listeners = []
+    for name, predictor in module.named_predictors():
+        for field, info in predictor.signature.output_fields.items():
+            if field in wanted and info.annotation is str:
+                listeners.append(dspy.streaming.StreamListener(field, predict=predictor, predict_name=name, allow_reuse=True))
+    return listeners
+
+
+def _reset_listener(listener: Any) -> None:
+    # What dspy clears before a reused listener's next stream
+    listener.stream_start = False
+    listener.stream_end = False
+    listener.cache_hit = False
+    listener.field_start_queue = []
+    listener.field_end_queue = Queue()
+
+
+def run_streaming(
+    module: Any,
+    inputs: dict[str, Any],
+    listeners: list[Any],
+    on_chunk: Callable[[str, str, bool], None],
+    on_attempt: Callable[[bool], None] | None = None,
+) -> Any:
+    """Run `module` through `dspy.streamify` and return its Prediction.
+
+    LM calls stream from the provider; `on_chunk(field, text, is_last)` gets
+    every chunk the listeners pick out. `on_attempt(retry)` is called before
+    each streamed provider call; `retry` is True when the previous one failed
+    after streaming (a rate-limit retry or the adapter fallback), whose
+    chunks the caller should then discard. Runs its own event loop (workers
+    call this from a plain thread), so errors raised by the module propagate.
+    """
+    program = dspy.streamify(module, stream_listeners=listeners)
+
+    async def consume() -> Any:
+        pred = None
+        # Predictor of the streamed call that has started but not finished
+        open_id: int | None = None
+        is_open = False
+        async for item in program(**inputs):
+            if isinstance(item, dspy.streaming.StreamResponse):
+                on_chunk(item.signature_field_name, item.chunk, item.is_last_chunk)
+            elif isinstance(item, StreamAttempt):
+                if item.done:
+                    is_open = False
+                    continue
+                retry = is_open
+                if retry:
+                    # Listeners are mid-field from the failed call
+                    for listener in listeners:
+                        if open_id is None or id(listener.predict) == open_id:
+                            _reset_listener(listener)
+                is_open, open_id = True, item.predict_id
+                if on_attempt is not None:
+                    on_attempt(retry)
+            elif isinstance(item, dspy.Prediction):
+                pred = item
+        return pred
+
+    try:
+        return asyncio.run(consume())
+    except BaseExceptionGroup as eg:
+        # streamify runs the module in a task group; surface the module's own error
+        err: BaseException = eg
+        while isinstance(err, BaseExceptionGroup):
+            err = err.exceptions[0]
+        raise err from None
+
+
+def run_examples(
+    module: Any,
+    examples: list[dict[str, Any]],
+    outputs_schema: list[dict],
+    *,
+    num_threads: int | None = None,
+    on_done: Callable[[dict[str, Any]], None] | None = None,
+) -> list[dict[str, Any]]:
+    """Run `module` once per input dict concurrently with dspy.Parallel.
+
+    This is what `Module.batch` does, with each example wrapped so that it runs
+    under `example_row(index)` (events it emits carry the row) and its failure
+    is captured as that row's `error` instead of counting towards Parallel's
+    `max_errors`. Results come back in example order.
+    """
+
+    def call(index: int) -> Callable[..., dict[str, Any]]:
+        def _run(**inputs: Any) -> dict[str, Any]:
+            with example_row(index):
+                try:
+                    pred = module(**inputs)
+                    res = {
+                        "row": index,
+                        "outputs": collect_outputs(pred, outputs_schema),
+                        "reasoning": getattr(pred, "reasoning", None),
+                        "error": None,
+                    }
+                except Exception as e:
+                    res = {"row": index, "outputs": None, "reasoning": None, "error": str(e)}
+                if on_done is not None:
+                    on_done(res)
+                return res
+
+        return _run
+
+    threads = max(1, min(len(examples), num_threads or RUNNER_EXAMPLE_THREADS))
+    parallel = dspy.Parallel(num_threads=threads, max_errors=len(examples) + 1, disable_progress_bar=True)
+    results = parallel([(call(i), ex) for i, ex in enumerate(examples)])
+    return [
+        r if r is not None else {"row": i, "outputs": None, "reasoning": None, "error": "Example did not run"}
+        for i, r in enumerate(results)
+    ]
@@ -0,0 +1,497 @@
+"""
+Supervised pool of warm runner processes.
+
+Spawning `python -m app.node_runner_stream` per run pays for interpreter start-up
+and `import dspy` every time. The pool keeps `RUNNER_POOL_SIZE` long-lived
+`app.runner_worker` processes around instead and hands each job to an idle one
+over its stdin/stdout pipes.
+
+Workers are recycled after `RUNNER_MAX_JOBS` jobs, when they report more than
+`RUNNER_MAX_RSS_MB` of resident memory, or when a job times out, is cancelled
+or is abandoned by its consumer (the only safe way to interrupt a running job
+is to kill it). Jobs have a wall-clock budget and an idle timeout (no output
+for `RUNNER_IDLE_TIMEOUT` seconds); jobs started with a `run_id` can be
+cancelled with `RunnerPool.cancel`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, AsyncIterator
+
+from .metrics import RUNNER_CANCELLED, RUNNER_FIRST_EVENT_SECONDS, RUNNER_SPAWN_SECONDS, RUNNER_TIMEOUTS
+from .rate_limiter import get_limiter, provider_of
+
+RUNNER_POOL_SIZE = max(1, int(os.environ.get("RUNNER_POOL_SIZE", "2")))
+RUNNER_JOB_TIMEOUT = float(os.environ.get("RUNNER_JOB_TIMEOUT", "120"))
+# Kill a job that has produced no output for this long (0 disables)
+RUNNER_IDLE_TIMEOUT = float(os.environ.get("RUNNER_IDLE_TIMEOUT", "90"))
+RUNNER_MAX_JOBS = int(os.environ.get("RUNNER_MAX_JOBS", "200"))
+RUNNER_MAX_RSS_MB = int(os.environ.get("RUNNER_MAX_RSS_MB", "1024"))
+RUNNER_START_TIMEOUT = float(os.environ.get("RUNNER_START_TIMEOUT", "60"))
+
+WORKDIR = Path(__file__).resolve().parents[1]
+# Events can carry whole prompts; asyncio's default 64 KiB line limit is too small
+STREAM_LIMIT = 16 * 1024 * 1024
+CONTROL_PREFIX = b'{"__worker__"'
+# Rate-limit permit requests/reports from `app.rate_client`
+RATE_PREFIX = b'{"__rate__"'
+WORKER_COMMAND = (sys.executable, "-m", "app.runner_worker")
+
+
+class RunnerError(Exception):
+    """The worker died or produced output that does not follow the protocol."""
+
+
+class RunnerTimeout(RunnerError):
+    """A job exceeded its wall-clock budget or went idle; the worker has been killed."""
+
+    def __init__(self, message: str, reason: str = "wall_clock"):
+        super().__init__(message)
+        # "wall_clock" or "idle"
+        self.reason = reason
+
+
+class RunnerCancelled(RunnerError):
+    """The job was cancelled through `RunnerPool.cancel`; the worker has been killed."""
+
+
+def _descendants(pid: int) -> list[int]:
+    """All processes descending from `pid`, from /proc (empty where it is unavailable)."""
+    children: dict[int, list[int]] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return []
+    for name in entries:
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                stat = f.read()
+            # The command name may contain spaces and parentheses; ppid follows the last ")"
+            ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    out: list[int] = []
+    stack = [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            out.append(child)
+            stack.append(child)
+    return out
+
+
+class _Worker:
+    def __init__(self, index: int, proc: asyncio.subprocess.Process):
+        self.index = index
+        self.proc = proc
+        self.started_at = time.time()
+        self.jobs = 0
+        self.busy = False
+        self.busy_ms = 0.0
+        self.rss_kb = 0
+        # Event-loop time the last rate-limit permit was handed to this worker
+        self.granted_at = 0.0
+        self.import_ms: int | None = None
+        self.caches: dict[str, Any] = {}
+        self.stderr_tail: deque[str] = deque(maxlen=50)
+        self._stderr_task: asyncio.Task | None = None
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.returncode is None
+
+    def kill(self) -> None:
+        if not self.alive:
+            return
+        # Tool code may have moved children into a session of their own (setsid);
+        # find them before the worker dies and they are reparented
+        strays = _descendants(self.proc.pid)
+        try:
+            # Workers run in their own session so tool subprocesses die with them
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except Exception:
+            try:
+                self.proc.kill()
+            except Exception:
+                pass
+        for pid in strays:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "index": self.index,
+            "pid": self.proc.pid,
+            "alive": self.alive,
+            "busy": self.busy,
+            "jobs": self.jobs,
+            "busy_ms": int(self.busy_ms),
+            "rss_mb": round(self.rss_kb / 1024, 1),
+            "import_ms": self.import_ms,
+            "caches": self.caches,
+            "uptime_s": int(time.time() - self.started_at),
+        }
+
+
+class _Job:
+    __slots__ = ("run_id", "worker", "cancelled")
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.worker: _Worker | None = None
+        self.cancelled = False
+
+
+class RunnerPool:
+    def __init__(
+        self,
+        size: int = RUNNER_POOL_SIZE,
+        *,
+        job_timeout: float = RUNNER_JOB_TIMEOUT,
+        idle_timeout: float = RUNNER_IDLE_TIMEOUT,
+        max_jobs: int = RUNNER_MAX_JOBS,
+        max_rss_mb: int = RUNNER_MAX_RSS_MB,
+        command: tuple[str, ...] = WORKER_COMMAND,
+    ):
+        self.size = size
+        self.command = command
+        self.job_timeout = job_timeout
+        self.idle_timeout = idle_timeout
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self._workers: dict[int, _Worker] = {}
+        self._idle: asyncio.Queue[_Worker] | None = None
+        self._waiting = 0
+        self._started = False
+        self._start_lock: asyncio.Lock | None = None
+        self._respawns: set[asyncio.Task] = set()
+        self._jobs: dict[str, _Job] = {}
+        self.jobs_total = 0
+        self.recycled = 0
+        self.timeouts = 0
+        self.cancelled = 0
+
+    # ---- lifecycle ----
+    async def start(self) -> None:
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._started:
+                return
+            self._idle = asyncio.Queue()
+            workers = await asyncio.gather(*(self._spawn(i) for i in range(self.size)))
+            for w in workers:
+                self._idle.put_nowait(w)
+            self._started = True
+
+    async def close(self) -> None:
+        for t in list(self._respawns):
+            t.cancel()
+        for w in list(self._workers.values()):
+            w.kill()
+            try:
+                await w.proc.wait()
+            except Exception:
+                pass
+        self._workers.clear()
+        self._started = False
+
+    async def _spawn(self, index: int) -> _Worker:
+        t_spawn = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=str(WORKDIR),
+            env=dict(os.environ),
+            limit=STREAM_LIMIT,
+            start_new_session=True,
+        )
+        w = _Worker(index, proc)
+        w._stderr_task = asyncio.create_task(self._drain_stderr(w))
+        self._workers[index] = w
+        assert proc.stdout is not None
+        try:
+            line = await asyncio.wait_for(proc.stdout.readline(), RUNNER_START_TIMEOUT)
+            hello = json.loads(line)
+            w.import_ms = hello.get("import_ms")
+        except Exception as e:
+            w.kill()
+            raise RunnerError(f"Runner failed to start: {e}; {_tail(w)}")
+        RUNNER_SPAWN_SECONDS.observe(time.perf_counter() - t_spawn)
+        return w
+
+    async def _drain_stderr(self, w: _Worker) -> None:
+        # Keep the pipe from filling up and remember the tail for error reports
+        assert w.proc.stderr is not None
+        while True:
+            line = await w.proc.stderr.readline()
+            if not line:
+                return
+            w.stderr_tail.append(line.decode("utf-8", "replace").rstrip())
+
+    def _respawn(self, index: int) -> None:
+        async def _go():
+            try:
+                w = await self._spawn(index)
+            except Exception:
+                # Retry a little later rather than shrinking the pool forever
+                await asyncio.sleep(1.0)
+                self._respawn(index)
+                return
+            assert self._idle is not None
+            self._idle.put_nowait(w)
+
+        task = asyncio.create_task(_go())
+        self._respawns.add(task)
+        task.add_done_callback(self._respawns.discard)
+
+    async def _acquire(self) -> _Worker:
+        if not self._started:
+            await self.start()
+        assert self._idle is not None
+        self._waiting += 1
+        try:
+            while True:
+                w = await self._idle.get()
+                if w.alive:
+                    w.busy = True
+                    return w
+                # Died while idle (OOM killer, manual kill...): replace it
+                self.recycled += 1
+                self._respawn(w.index)
+        finally:
+            self._waiting -= 1
+
+    def _release(self, w: _Worker, *, recycle: bool) -> None:
+        w.busy = False
+        if not recycle and w.jobs >= self.max_jobs:
+            recycle = True
+        if not recycle and w.rss_kb > self.max_rss_mb * 1024:
+            recycle = True
+        if recycle or not w.alive:
+            w.kill()
+            self.recycled += 1
+            self._respawn(w.index)
+            return
+        assert self._idle is not None
+        self._idle.put_nowait(w)
+
+    # ---- jobs ----
+    async def stream(
+        self,
+        payload: dict,
+        *,
+        mode: str = "stream",
+        timeout: float | None = None,
+        idle_timeout: float | None = None,
+        flow_key: str | None = None,
+        run_id: str | None = None,
+    ) -> AsyncIterator[bytes]:
+        """Run a job and yield the worker's NDJSON lines as they arrive.
+
+        Raises `RunnerTimeout` once the job exceeds `timeout` seconds or
+        produces no output for `idle_timeout` seconds, `RunnerCancelled` after
+        `cancel(run_id)` and `RunnerError` if the worker dies mid-job.
+        Abandoning the iterator early kills the worker. The worker's LM permit
+        requests are queued in the shared rate limiter under `flow_key`.
+        """
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        budget = self.job_timeout if timeout is None else timeout
+        idle = self.idle_timeout if idle_timeout is None else idle_timeout
+        job_ref: _Job | None = None
+        if run_id is not None:
+            if run_id in self._jobs:
+                raise RunnerError(f"Run {run_id} is already running")
+            job_ref = self._jobs[run_id] = _Job(run_id)
+        t_submit = time.perf_counter()
+        try:
+            w = await self._acquire()
+        except BaseException:
+            if job_ref is not None:
+                self._jobs.pop(run_id, None)
+            raise
+        assert w.proc.stdin is not None and w.proc.stdout is not None
+        recycle = True
+        t0 = time.perf_counter()
+        grants: set[asyncio.Task] = set()
+        try:
+            if job_ref is not None:
+                if job_ref.cancelled:
+                    # Cancelled while queued for a worker; it never ran
+                    recycle = False
+                    raise RunnerCancelled("Run cancelled")
+                job_ref.worker = w
+            job = {"mode": mode, "payload": payload, "env": dict(os.environ)}
+            w.proc.stdin.write((json.dumps(job) + "\n").encode("utf-8"))
+            await w.proc.stdin.drain()
+            w.jobs += 1
+            self.jobs_total += 1
+            deadline = loop.time() + budget
+            last_output = loop.time()
+            while True:
+                now = loop.time()
+                wait = deadline - now
+                if idle > 0:
+                    wait = min(wait, last_output + idle - now)
+                try:
+                    line = await asyncio.wait_for(w.proc.stdout.readline(), max(0.0, wait))
+                except asyncio.TimeoutError:
+                    now = loop.time()
+                    if now < deadline and grants:
+                        # Queued for a rate-limit permit: waiting on us, not stalled
+                        last_output = now
+                        continue
+                    if now < deadline and now < w.granted_at + idle:
+                        # A permit was just handed over; the idle clock restarts from there
+                        last_output = w.granted_at
+                        continue
+                    self.timeouts += 1
+                    RUNNER_TIMEOUTS.inc()
+                    if now >= deadline:
+                        raise RunnerTimeout(f"Runner timed out after {budget:g}s")
+                    raise RunnerTimeout(f"Runner produced no output for {idle:g}s", reason="idle")
+                if task is not None and task.cancelling():
+                    # On 3.11 wait_for drops a cancel that races the read completing
+                    raise asyncio.CancelledError
+                last_output = loop.time()
+                if not line:
+                    if job_ref is not None and job_ref.cancelled:
+                        raise RunnerCancelled("Run cancelled")
+                    raise RunnerError(f"Runner exited unexpectedly; {_tail(w)}")
+                if line.startswith(CONTROL_PREFIX):
+                    info = json.loads(line)
+                    w.rss_kb = int(info.get("rss_kb") or 0)
+                    w.caches = info.get("caches") or {}
+                    recycle = False
+                    return
+                if line.startswith(RATE_PREFIX):
+                    self._on_rate(w, json.loads(line), flow_key, grants)
+                    continue
+                if t_submit:
+                    RUNNER_FIRST_EVENT_SECONDS.observe(time.perf_counter() - t_submit, mode=mode)
+                    t_submit = 0.0
+                yield line
+        finally:
+            if job_ref is not None:
+                self._jobs.pop(run_id, None)
+            for g in grants:
+                g.cancel()
+            w.busy_ms += (time.perf_counter() - t0) * 1000
+            self._release(w, recycle=recycle)
+
+    def cancel(self, run_id: str) -> bool:
+        """Cancel a queued or running job by its `run_id`; False if there is none."""
+        job = self._jobs.get(run_id)
+        if job is None or job.cancelled:
+            return False
+        job.cancelled = True
+        self.cancelled += 1
+        RUNNER_CANCELLED.inc()
+        if job.worker is not None:
+            # The reader sees EOF and raises RunnerCancelled
+            job.worker.kill()
+        return True
+
+    def running(self) -> list[str]:
+        return list(self._jobs)
+
+    def _on_rate(self, w: _Worker, msg: dict, flow_key: str | None, grants: set[asyncio.Task]) -> None:
+        limiter = get_limiter()
+        if msg.get("__rate__") == "report":
+            limiter.report(msg.get("model"), int(msg.get("estimated") or 0), msg.get("used"), msg.get("status"))
+            return
+
+        async def grant() -> None:
+            waited = await limiter.acquire(msg.get("model"), flow_key, int(msg.get("tokens") or 0))
+            reply = {
+                "__rate__": "grant",
+                "id": msg.get("id"),
+                "wait_s": round(waited, 4),
+                "provider": provider_of(msg.get("model")),
+                "unlimited": limiter.unlimited(msg.get("model")),
+            }
+            assert w.proc.stdin is not None
+            try:
+                w.proc.stdin.write((json.dumps(reply) + "\n").encode("utf-8"))
+                await w.proc.stdin.drain()
+                w.granted_at = asyncio.get_running_loop().time()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # worker died; the job fails on its own
+
+        task = asyncio.create_task(grant())
+        grants.add(task)
+        task.add_done_callback(grants.discard)
+
+    async def run(
+        self,
+        payload: dict,
+        *,
+        timeout: float | None = None,
+        idle_timeout: float | None = None,
+        flow_key: str | None = None,
+        run_id: str | None = None,
+    ) -> dict:
+        """Run a one-shot job (`app.node_runner.run`) and return its result dict."""
+        last = b""
+        stream = self.stream(payload, mode="run", timeout=timeout, idle_timeout=idle_timeout, flow_key=flow_key, run_id=run_id)
+        async for line in stream:
+            last = line
+        try:
+            return json.loads(last or b"{}")
+        except Exception as e:
+            raise RunnerError(f"Invalid runner output: {e}")
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "size": self.size,
+            "started": self._started,
+            "queue_depth": self._waiting,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "jobs_total": self.jobs_total,
+            "recycled": self.recycled,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "running": len(self._jobs),
+            "job_timeout_s": self.job_timeout,
+            "idle_timeout_s": self.idle_timeout,
+            "max_jobs": self.max_jobs,
+            "max_rss_mb": self.max_rss_mb,
+            "workers": [w.stats() for w in sorted(self._workers.values(), key=lambda w: w.index)],
+        }
+
+
+def _tail(w: _Worker) -> str:
+    return "\n".join(list(w.stderr_tail)[-10:]) or "no stderr output"
+
+
+_pool: RunnerPool | None = None
+
+
+def get_pool() -> RunnerPool:
+    """Return the process-wide pool (workers are started on first use)."""
+    global _pool
+    if _pool is None:
+        _pool = RunnerPool()
+    return _pool
+
+
+async def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
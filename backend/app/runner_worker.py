@@ -0,0 +1,105 @@
+"""
+Long-lived runner process managed by `app.runner_pool`.
+
+The worker imports `dspy` and the runner modules once, then reads one JSON job
+per line from stdin and answers with NDJSON lines on stdout. Every job is
+terminated by a control line starting with `{"__worker__"` so the parent knows
+the worker is free again. Anything the node code prints goes to stderr so it
+cannot corrupt the protocol stream.
+
+While a job runs, stdin also carries rate-limit grants (`{"__rate__": ...}`)
+for `app.rate_client`, so a reader thread dispatches those and queues jobs.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import queue
+import resource
+import sys
+import threading
+import time
+
+_started = time.perf_counter()
+
+import dspy  # noqa: E402,F401  (warm import is the point of this process)
+
+from .node_runner import run  # noqa: E402
+from .node_runner_stream import EventWriter, run_stream  # noqa: E402
+from . import rate_client  # noqa: E402
+from .runner_core import cache_stats  # noqa: E402
+
+
+def _rss_kb() -> int:
+    """Current resident set size in KiB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+    except Exception:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS reports bytes, Linux reports KiB
+        return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _sync_env(env: dict[str, str] | None) -> None:
+    """Mirror the parent's environment so newly saved provider keys are visible."""
+    if env is None:
+        return
+    for k in list(os.environ.keys()):
+        if k not in env:
+            os.environ.pop(k, None)
+    os.environ.update(env)
+
+
+def main() -> int:
+    out = sys.stdout
+    # Keep stdout reserved for the protocol; stray prints from tools land on stderr
+    sys.stdout = sys.stderr
+
+    # LM calls on other threads write rate-limit requests concurrently; trace
+    # events are flushed in batches, control and rate lines at once
+    write = EventWriter(out)
+
+    jobs: queue.Queue[str | None] = queue.Queue()
+
+    def read_stdin() -> None:
+        for line in sys.stdin:
+            if line.startswith('{"__rate__"'):
+                rate_client.on_reply(json.loads(line))
+            elif line.strip():
+                jobs.put(line)
+        jobs.put(None)
+
+    threading.Thread(target=read_stdin, name="stdin", daemon=True).start()
+    rate_client.attach(write)
+    write({"__worker__": "ready", "pid": os.getpid(), "import_ms": int((time.perf_counter() - _started) * 1000)})
+
+    while True:
+        line = jobs.get()
+        if line is None:
+            break
+        t0 = time.perf_counter()
+        try:
+            job = json.loads(line)
+            _sync_env(job.get("env"))
+            payload = job.get("payload") or {}
+            rate_client.set_job(payload)
+            if job.get("mode") == "run":
+                write(run(payload))
+            else:
+                run_stream(payload, emit=write)
+        except Exception as e:
+            write({"event": "error", "message": f"Worker error: {e}"})
+        write({
+            "__worker__": "job_end",
+            "ms": int((time.perf_counter() - t0) * 1000),
+            "rss_kb": _rss_kb(),
+            "caches": cache_stats(),
+        })
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
@@ -10,6 +10,20 @@ class FlowOut(BaseModel):
     updated_at: str
 
 
+class FlowSummaryOut(FlowOut):
+    """Dashboard card: metadata plus node count, last run and thumbnail in one row."""
+    node_count: int = 0
+    last_run_at: Optional[str] = None
+    # Immutable /api/previews URL, when the flow has a preview
+    thumbnail_url: Optional[str] = None
+
+
+class FlowSummaryPage(BaseModel):
+    items: List[FlowSummaryOut]
+    # Pass back as `cursor` for the next page; null on the last page
+    next_cursor: Optional[str] = None
+
+
 class FlowCreate(BaseModel):
     name: str = Field(min_length=1, max_length=200)
 
@@ -22,10 +36,41 @@ class FlowStateOut(BaseModel):
     flow_id: str
     data: Dict[str, Any]
     updated_at: str
+    # Bumped by every save; send it back as base_version for conflict detection
+    version: int = 0
 
 
 class FlowStateIn(BaseModel):
     data: Dict[str, Any]
+    # When set, the save is rejected with 409 unless this is the current version
+    base_version: Optional[int] = None
+
+
+class FlowStatePatchIn(BaseModel):
+    """Delta against `base_version`: node/edge upserts and removals, then RFC 6902 `ops`."""
+    base_version: int = Field(ge=0)
+    ops: List[Dict[str, Any]] = Field(default_factory=list)
+    # Whole nodes/edges keyed by `id`; replaced in place or appended
+    nodes: List[Dict[str, Any]] = Field(default_factory=list)
+    edges: List[Dict[str, Any]] = Field(default_factory=list)
+    # Removing a node also removes its edges
+    remove_nodes: List[str] = Field(default_factory=list)
+    remove_edges: List[str] = Field(default_factory=list)
+
+
+class FlowStatePatchOut(BaseModel):
+    flow_id: str
+    version: int
+    updated_at: str
+    compacted: bool = False
+
+
+class FlowSubgraphOut(BaseModel):
+    """A node and everything upstream of it, read from the normalized tables."""
+    flow_id: str
+    node_id: str
+    nodes: List[Dict[str, Any]]
+    edges: List[Dict[str, Any]]
 
 
 # ---- Flow Schemas (Custom Schemas) ----
@@ -68,6 +113,7 @@ class RunField(BaseModel):
 
 
 class NodeRunIn(BaseModel):
+    node_id: str | None = None
     node_kind: str
     node_title: str | None = None
     node_description: str | None = None
@@ -77,12 +123,45 @@ class NodeRunIn(BaseModel):
     model: str | None = None
     lm_params: dict | None = None
     tools_code: list[str] | None = None
+    # Reuse the memoized result when nothing relevant changed since the last run
+    use_cache: bool = True
+    # Run once per example (input dicts layered over inputs_values) in one worker
+    examples: list[dict] | None = None
+    # Threads for running examples (defaults to RUNNER_EXAMPLE_THREADS)
+    num_threads: int | None = Field(default=None, ge=1, le=64)
+    # Client-chosen id for POST /api/runs/{run_id}/cancel (assigned when omitted)
+    run_id: str | None = Field(default=None, max_length=64)
+    # Wall-clock and no-output limits in seconds (RUNNER_JOB_TIMEOUT / RUNNER_IDLE_TIMEOUT)
+    timeout_s: float | None = Field(default=None, gt=0, le=3600)
+    idle_timeout_s: float | None = Field(default=None, gt=0, le=3600)
+    # Streamed runs emit `token` events per output field (RUNNER_STREAM_TOKENS)
+    stream_tokens: bool = True
 
 
 class NodeRunOut(BaseModel):
     outputs: dict | None = None
     reasoning: str | None = None
     error: str | None = None
+    cached: bool = False
+    # Per-example results ({row, outputs, reasoning, error}) for multi-example runs
+    examples: list[dict] | None = None
+    # Summed over the run's LM calls: prompt/completion/total tokens and cost_usd
+    usage: dict | None = None
+
+
+class FlowBudget(BaseModel):
+    """Max total tokens per run of the flow; runs exceeding it are aborted (null = unlimited)."""
+    token_budget: int | None = Field(default=None, ge=1)
+
+
+class FlowRunIn(BaseModel):
+    """Options for a server-side run of a whole saved flow."""
+    # Max compute nodes in flight (defaults to FLOW_RUN_CONCURRENCY)
+    concurrency: int | None = Field(default=None, ge=1, le=64)
+    # Only run what these nodes need; defaults to everything feeding output nodes
+    node_ids: list[str] | None = None
+    # Wall-clock limit for the whole flow run in seconds
+    timeout_s: float | None = Field(default=None, gt=0, le=86400)
 
 
 # ---- Import/Export ----
@@ -100,11 +179,20 @@ class FlowImportResult(BaseModel):
     flow: FlowOut
 
 
+class FlowBulkImportResult(BaseModel):
+    """Flows created by an NDJSON import, in stream order."""
+    flows: List[FlowOut]
+
+
 class FlowPreviewIn(BaseModel):
     image: str
 
 
 class FlowPreviewOut(BaseModel):
     flow_id: str
-    image: str
+    # Content-addressed, immutable URLs under /api/previews
+    url: str
+    thumbnail_url: str
+    etag: str
+    size: Optional[int] = None
     updated_at: str
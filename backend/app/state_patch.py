@@ -0,0 +1,187 @@
+"""
+Apply flow state deltas: RFC 6902 JSON Patch plus per-node/edge upserts.
+
+Patches are applied copy-on-write: containers along each touched path are
+shallow-copied and everything else is shared with the input document, so the
+input is never mutated. That keeps a failed patch atomic and lets callers hand
+out cached states without defensive deep copies.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+
+class PatchError(ValueError):
+    """A patch could not be applied to the document."""
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def parse_pointer(path: str) -> list[str]:
+    """Split an RFC 6901 JSON Pointer into unescaped reference tokens."""
+    if path == "":
+        return []
+    if not path.startswith("/"):
+        raise PatchError(f"Invalid JSON pointer: {path!r}")
+    return [_unescape(t) for t in path[1:].split("/")]
+
+
+def _index(container: list, token: str, *, allow_end: bool) -> int:
+    if token == "-" and allow_end:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith("0")):
+        raise PatchError(f"Invalid array index: {token!r}")
+    idx = int(token)
+    limit = len(container) if allow_end else len(container) - 1
+    if idx > limit:
+        raise PatchError(f"Array index out of range: {idx}")
+    return idx
+
+
+def _get(doc: Any, tokens: list[str]) -> Any:
+    cur = doc
+    for t in tokens:
+        if isinstance(cur, dict):
+            if t not in cur:
+                raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+            cur = cur[t]
+        elif isinstance(cur, list):
+            cur = cur[_index(cur, t, allow_end=False)]
+        else:
+            raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+    return cur
+
+
+def _set(doc: Any, tokens: list[str], fn) -> Any:
+    """Return a copy of `doc` where the parent of `tokens` is replaced by fn(copied_parent, last_token)."""
+    if not tokens:
+        raise PatchError("Operation on the document root is not supported")
+    head, rest = tokens[0], tokens[1:]
+    if isinstance(doc, dict):
+        out = dict(doc)
+        if not rest:
+            fn(out, head)
+            return out
+        if head not in out:
+            raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+        out[head] = _set(out[head], rest, fn)
+        return out
+    if isinstance(doc, list):
+        out_l = list(doc)
+        if not rest:
+            fn(out_l, head)
+            return out_l
+        idx = _index(out_l, head, allow_end=False)
+        out_l[idx] = _set(out_l[idx], rest, fn)
+        return out_l
+    raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+
+
+def _add(doc: Any, tokens: list[str], value: Any) -> Any:
+    def fn(parent, key):
+        if isinstance(parent, dict):
+            parent[key] = value
+        else:
+            parent.insert(_index(parent, key, allow_end=True), value)
+    return _set(doc, tokens, fn)
+
+
+def _remove(doc: Any, tokens: list[str]) -> Any:
+    def fn(parent, key):
+        if isinstance(parent, dict):
+            if key not in parent:
+                raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+            del parent[key]
+        else:
+            del parent[_index(parent, key, allow_end=False)]
+    return _set(doc, tokens, fn)
+
+
+def _replace(doc: Any, tokens: list[str], value: Any) -> Any:
+    def fn(parent, key):
+        if isinstance(parent, dict):
+            if key not in parent:
+                raise PatchError(f"Path not found: /{'/'.join(tokens)}")
+            parent[key] = value
+        else:
+            parent[_index(parent, key, allow_end=False)] = value
+    return _set(doc, tokens, fn)
+
+
+def apply_json_patch(doc: dict[str, Any], ops: list[dict[str, Any]]) -> dict[str, Any]:
+    """Apply RFC 6902 operations (add, remove, replace, move, copy, test) and return the new document."""
+    for i, op in enumerate(ops):
+        kind = op.get("op")
+        try:
+            path = parse_pointer(op["path"])
+            if kind == "add":
+                doc = _add(doc, path, op["value"])
+            elif kind == "remove":
+                doc = _remove(doc, path)
+            elif kind == "replace":
+                doc = _replace(doc, path, op["value"])
+            elif kind in ("move", "copy"):
+                src = parse_pointer(op["from"])
+                if kind == "move" and path[: len(src)] == src and path != src:
+                    raise PatchError("Cannot move a value into one of its children")
+                value = _get(doc, src)
+                if kind == "move":
+                    doc = _remove(doc, src)
+                doc = _add(doc, path, value)
+            elif kind == "test":
+                if _get(doc, path) != op.get("value"):
+                    raise PatchError(f"Test failed at {op['path']}")
+            else:
+                raise PatchError(f"Unknown op: {kind!r}")
+        except KeyError as e:
+            raise PatchError(f"Operation #{i} is missing {e.args[0]!r}")
+        except PatchError as e:
+            raise PatchError(f"Operation #{i} ({kind}): {e}")
+    return doc
+
+
+def _upsert_by_id(items: list[Any], upserts: list[dict[str, Any]], removes: set[str]) -> list[Any]:
+    # Removal wins over an upsert of the same id; a repeated id keeps its last value
+    replace = {u["id"]: u for u in upserts if u["id"] not in removes}
+    out: list[Any] = []
+    for item in items:
+        item_id = item.get("id") if isinstance(item, dict) else None
+        if item_id in removes:
+            continue
+        if item_id in replace:
+            out.append(replace.pop(item_id))
+        else:
+            out.append(item)
+    # Remaining upserts are new items, appended in request order
+    out.extend(replace.values())
+    return out
+
+
+def apply_state_patch(state: dict[str, Any], patch: dict[str, Any]) -> dict[str, Any]:
+    """Apply a stored delta: node/edge upserts and removals first, then JSON Patch `ops`.
+
+    Removing a node also drops edges attached to it.
+    """
+    nodes_up = patch.get("nodes") or []
+    edges_up = patch.get("edges") or []
+    remove_nodes = set(patch.get("remove_nodes") or [])
+    remove_edges = set(patch.get("remove_edges") or [])
+    for item in (*nodes_up, *edges_up):
+        if not isinstance(item, dict) or not isinstance(item.get("id"), str):
+            raise PatchError("Upserted nodes and edges need a string 'id'")
+
+    if nodes_up or remove_nodes:
+        state = {**state, "nodes": _upsert_by_id(state.get("nodes") or [], nodes_up, remove_nodes)}
+    if remove_nodes:
+        remove_edges |= {
+            e.get("id") for e in state.get("edges") or []
+            if isinstance(e, dict) and (e.get("source") in remove_nodes or e.get("target") in remove_nodes)
+        }
+    if edges_up or remove_edges:
+        state = {**state, "edges": _upsert_by_id(state.get("edges") or [], edges_up, remove_edges)}
+    if patch.get("ops"):
+        state = apply_json_patch(state, patch["ops"])
+    return state
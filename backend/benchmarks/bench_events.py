@@ -0,0 +1,105 @@
+"""
+Micro-benchmark: runner event throughput, old vs single-pass serialization.
+
+"before" mirrors the previous path: every callback field is test-serialized
+with `json.dumps`, the event is serialized again and stdout is flushed per
+line. "after" uses `encode_event` and the batching `EventWriter`. Events are
+written to a pipe drained by a reader thread, like the worker's stdout.
+
+Run from `backend/`:
+
+    uv run python -m benchmarks.bench_events [--events 20000] [--prompt-kb 8]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Any, Callable
+
+from app.dspy_streaming import encode_event
+from app.node_runner_stream import EventWriter
+
+
+def _events(n: int, prompt_kb: int) -> list[Callable[[], dict[str, Any]]]:
+    prompt = "lorem ipsum dolor sit amet " * (prompt_kb * 1024 // 27)
+    trace = [{"thought": f"step {i}", "tool": "search", "observation": "x" * 200} for i in range(20)]
+    shapes = [
+        lambda: {"event": "module_start", "call_id": "c1", "inputs": {"question": "q" * 200, "trajectory": trace}},
+        lambda: {"event": "lm_start", "call_id": "c2", "model": "openai/gpt-4o-mini", "prompt": prompt, "params": {"temperature": 0.0}},
+        lambda: {"event": "lm_end", "call_id": "c2", "response": prompt[: len(prompt) // 4], "exception": None},
+        lambda: {"event": "tool_start", "call_id": "c3", "tool": "search", "inputs": {"args": ["query"], "kwargs": {}}},
+        lambda: {"event": "tool_end", "call_id": "c3", "output": {"hits": [{"title": "t", "body": "b" * 500}] * 5}},
+        lambda: {"event": "module_end", "call_id": "c1", "outputs": {"answer": "a" * 1000}, "exception": None},
+    ]
+    return [shapes[i % len(shapes)] for i in range(n)]
+
+
+def _safe_json(x: Any) -> Any:
+    try:
+        json.dumps(x)
+        return x
+    except Exception:
+        return str(x)
+
+
+def _before(out) -> Callable[[dict[str, Any]], None]:
+    lock = threading.Lock()
+
+    def emit(obj: dict[str, Any]) -> None:
+        obj = {k: _safe_json(v) if isinstance(v, (dict, list)) else v for k, v in obj.items()}
+        line = json.dumps(obj) + "\n"
+        with lock:
+            out.write(line)
+            out.flush()
+
+    return emit
+
+
+def _after(out) -> Callable[[dict[str, Any]], None]:
+    return EventWriter(out)
+
+
+def _run(make_emit, events: list[Callable[[], dict[str, Any]]]) -> tuple[float, int]:
+    r, w = os.pipe()
+    received = 0
+
+    def drain() -> None:
+        nonlocal received
+        while chunk := os.read(r, 1 << 16):
+            received += len(chunk)
+
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    out = os.fdopen(w, "w")
+    emit = make_emit(out)
+    t0 = time.perf_counter()
+    for make in events:
+        emit(make())
+    out.flush()
+    elapsed = time.perf_counter() - t0
+    out.close()
+    reader.join()
+    os.close(r)
+    return len(events) / elapsed, received
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--events", type=int, default=20000)
+    ap.add_argument("--prompt-kb", type=int, default=8)
+    args = ap.parse_args()
+
+    events = _events(args.events, args.prompt_kb)
+    encode_event(events[0]())  # warm up
+    print(f"{'path':>8} {'events/s':>10} {'MB written':>11}")
+    for name, make_emit in (("before", _before), ("after", _after)):
+        rate, nbytes = _run(make_emit, events)
+        print(f"{name:>8} {rate:>10.0f} {nbytes / 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
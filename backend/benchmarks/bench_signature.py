@@ -0,0 +1,45 @@
+"""
+Micro-benchmark: DSPy Signature build cost per field count, uncached vs cached.
+
+Run from `backend/`:
+
+    uv run python -m benchmarks.bench_signature
+"""
+
+from __future__ import annotations
+
+import time
+
+from app.dspy_signature import _build_signature, build_signature, signature_cache_stats
+
+FIELD_COUNTS = (1, 4, 16, 64)
+REPEAT = 200
+
+
+def _schemas(n: int) -> tuple[list[dict], list[dict]]:
+    inputs = [{"name": f"in_{i}", "type": "string", "description": f"input {i}"} for i in range(n)]
+    outputs = [{"name": f"out_{i}", "type": "string", "description": f"output {i}"} for i in range(n)]
+    return inputs, outputs
+
+
+def _per_call_us(fn, *args) -> float:
+    t0 = time.perf_counter()
+    for _ in range(REPEAT):
+        fn(*args)
+    return (time.perf_counter() - t0) / REPEAT * 1e6
+
+
+def main() -> None:
+    print(f"{'fields':>8} {'uncached us':>12} {'cached us':>10} {'per field us':>13}")
+    for n in FIELD_COUNTS:
+        inputs, outputs = _schemas(n)
+        args = (f"Bench{n}", "Benchmark signature", inputs, outputs)
+        uncached = _per_call_us(_build_signature, *args)
+        build_signature(*args)  # warm the cache
+        cached = _per_call_us(build_signature, *args)
+        print(f"{2 * n:>8} {uncached:>12.1f} {cached:>10.1f} {uncached / (2 * n):>13.1f}")
+    print("cache:", signature_cache_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Load test: concurrent GET/PUT of a flow's saved state against a running API.
+
+Start the backend first (`uv run uvicorn main:app --port 8000`), then from `backend/`:
+
+    uv run python -m benchmarks.load_state --concurrency 200 --requests 2000
+
+Half of the requests are PUTs of a graph with `--nodes` nodes, half are GETs.
+A throwaway flow is created for the run and deleted afterwards.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+
+
+def _graph(n: int) -> dict:
+    nodes = [
+        {
+            "id": f"n{i}",
+            "type": "predict",
+            "position": {"x": i * 40, "y": (i % 7) * 60},
+            "data": {"title": f"Node {i}", "inputs": [{"name": "question", "type": "string"}], "outputs": [{"name": "answer", "type": "string"}]},
+        }
+        for i in range(n)
+    ]
+    edges = [{"id": f"e{i}", "source": f"n{i}", "target": f"n{i + 1}"} for i in range(n - 1)]
+    return {"nodes": nodes, "edges": edges}
+
+
+def _pct(sorted_ms: list[float], p: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    idx = min(len(sorted_ms) - 1, int(round(p / 100 * (len(sorted_ms) - 1))))
+    return sorted_ms[idx]
+
+
+async def _main(base: str, concurrency: int, total: int, nodes: int) -> None:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=60) as client:
+        r = await client.post("/api/flows/", json={"name": "load-state-bench"})
+        r.raise_for_status()
+        flow_id = r.json()["id"]
+        graph = _graph(nodes)
+        latencies: dict[str, list[float]] = {"GET": [], "PUT": []}
+        errors = 0
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(i: int) -> None:
+            nonlocal errors
+            method = "PUT" if i % 2 else "GET"
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    if method == "PUT":
+                        resp = await client.put(f"/api/flows/{flow_id}/state", json={"data": graph})
+                    else:
+                        resp = await client.get(f"/api/flows/{flow_id}/state")
+                    if resp.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies[method].append((time.perf_counter() - t0) * 1000)
+
+        order = list(range(total))
+        random.shuffle(order)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in order))
+        wall = time.perf_counter() - t0
+
+        await client.delete(f"/api/flows/{flow_id}")
+
+    print(f"{total} requests, concurrency {concurrency}, {nodes} nodes/state, {wall:.2f}s wall, {total / wall:.0f} req/s, {errors} errors")
+    print(f"{'method':<6} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for method, ms in [*latencies.items(), ("ALL", latencies["GET"] + latencies["PUT"])]:
+        ms = sorted(ms)
+        print(f"{method:<6} {len(ms):>6} {_pct(ms, 50):>9.1f} {_pct(ms, 95):>9.1f} {_pct(ms, 99):>9.1f} {(ms[-1] if ms else 0):>9.1f}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--base", default="http://127.0.0.1:8000")
+    ap.add_argument("--concurrency", type=int, default=200)
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--nodes", type=int, default=50)
+    args = ap.parse_args()
+    asyncio.run(_main(args.base, args.concurrency, args.requests, args.nodes))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,19 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from routes.flows import router as flows_router
 from routes.ai import router as ai_router
 from routes.keys import router as keys_router
-from app.db import init_db
+from routes.runs import router as runs_router
+from routes.admin import router as admin_router
+from routes.previews import router as previews_router
+from app.db import init_db, shutdown_executor
+from app.preview_store import migrate_inline_previews, sweep_orphans
+from app.metrics import MetricsMiddleware, render as render_metrics
+from app.run_log import shutdown as shutdown_run_log
+from app.runner_pool import get_pool, shutdown_pool
+from app.run_streams import close as close_run_streams
 
 # Load .env files (root/.env.local, root/.env)
 try:
@@ -28,6 +37,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Labels DB query timings with the route template and counts 5xx responses
+app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/health")
@@ -35,6 +46,12 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition of runner, LM, tool, DB and serialization metrics."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.on_event("startup")
 def _startup_init_db():
     try:
@@ -42,8 +59,45 @@ def _startup_init_db():
     except Exception:
         # Avoid hard-failing on startup in dev if FS is read-only, etc.
         pass
+    try:
+        # Move legacy data-URL previews to blob files, then drop unreferenced blobs
+        migrate_inline_previews()
+        sweep_orphans()
+    except Exception:
+        pass
+
+
+@app.on_event("startup")
+async def _startup_runner_pool():
+    # Warm the workers up front so the first run doesn't pay for `import dspy`
+    try:
+        await get_pool().start()
+    except Exception:
+        # Workers are started lazily on first run if this fails
+        pass
+
+
+@app.on_event("shutdown")
+async def _shutdown_run_streams():
+    # Stop detached runs before their workers go away
+    await close_run_streams()
+
+
+@app.on_event("shutdown")
+async def _shutdown_runner_pool():
+    await shutdown_pool()
+
+
+@app.on_event("shutdown")
+def _shutdown_db_executor():
+    # Drain buffered run history before the DB goes away
+    shutdown_run_log()
+    shutdown_executor()
 
 
 app.include_router(flows_router, prefix="/api/flows", tags=["flows"])
 app.include_router(keys_router, prefix="/api/keys", tags=["keys"])
 app.include_router(ai_router, prefix="/api/ai", tags=["ai"])
+app.include_router(runs_router, prefix="/api/runs", tags=["runs"])
+app.include_router(admin_router, prefix="/api/admin", tags=["admin"])
+app.include_router(previews_router, prefix="/api/previews", tags=["previews"])
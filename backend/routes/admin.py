@@ -0,0 +1,46 @@
+from fastapi import APIRouter
+
+from app import lm_cache, node_cache
+from app.db import db_stats, run_db
+
+
+router = APIRouter()
+
+
+@router.get("/lm-cache")
+async def lm_cache_stats():
+    """Size, hit counts and per-model breakdown of the shared LM response cache."""
+    return await run_db(lm_cache.stats)
+
+
+@router.get("/lm-cache/entries")
+async def lm_cache_entries(limit: int = 50):
+    return await run_db(lm_cache.entries, limit=max(1, min(limit, 1000)))
+
+
+@router.post("/lm-cache/evict")
+async def lm_cache_evict():
+    """Drop expired entries and trim to the configured size budget now."""
+    return {"removed": await run_db(lm_cache.evict)}
+
+
+@router.delete("/lm-cache")
+async def lm_cache_clear(model: str | None = None):
+    return {"removed": await run_db(lm_cache.clear, model)}
+
+
+@router.get("/node-cache")
+async def node_cache_stats():
+    """Entries and hits of the memoized node results."""
+    return await run_db(node_cache.stats)
+
+
+@router.delete("/node-cache")
+async def node_cache_clear(flow_id: str | None = None):
+    return {"removed": await run_db(node_cache.clear, flow_id)}
+
+
+@router.get("/db")
+async def database_stats():
+    """Connection pool usage plus pool-wait and query-time metrics (in memory, no query)."""
+    return db_stats()
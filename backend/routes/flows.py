@@ -1,564 +1,626 @@
-from typing import AsyncGenerator, List
-from fastapi import APIRouter, HTTPException, Request
+from typing import AsyncGenerator, Iterator, List, Literal, Optional
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from starlette.responses import StreamingResponse
 
-from app.db import get_connection
+from app import batch_runner, flow_store, node_cache, run_streams
+from app.db import run_db
 from app.schemas import (
     FlowOut,
     FlowCreate,
+    FlowSummaryOut,
+    FlowSummaryPage,
     FlowUpdate,
     FlowStateOut,
     FlowStateIn,
+    FlowStatePatchIn,
+    FlowStatePatchOut,
+    FlowSubgraphOut,
     FlowSchemaIn,
     FlowSchemaOut,
     NodeRunIn,
     NodeRunOut,
+    FlowRunIn,
+    FlowBudget,
     FlowExportBundle,
     FlowImportResult,
+    FlowBulkImportResult,
     FlowPreviewIn,
     FlowPreviewOut,
 )
-from app.utils import now_iso, new_id, slugify
-
-import asyncio
-import sys
-import os as _os
-from pathlib import Path
+from app.flow_executor import FlowGraphError, execute_flow
+from app.runner_pool import RunnerCancelled, RunnerError, RunnerTimeout, get_pool
+from app.preview_store import PreviewError
+from app.metrics import CACHE_HITS
+from app.lm_usage import TokenBudget
+from app.run_log import RunRecorder
+from app.state_patch import PatchError
+from routes.previews import preview_response
+from routes.runs import stream_response
+
+import json
+import tempfile
+import uuid
 
 router = APIRouter()
 
+# Flows fetched per page by the bulk export
+EXPORT_PAGE_SIZE = 100
+# Export lines encoded per DB-executor call
+EXPORT_CHUNK_LINES = 500
+# Imports larger than this are spooled to a temp file instead of memory
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024
+
 
 @router.get("/", response_model=List[FlowOut])
-def list_flows():
-    with get_connection() as conn:
-        cur = conn.execute(
-            "SELECT id, name, slug, created_at, updated_at FROM flows ORDER BY created_at DESC"
-        )
-        rows = [dict(row) for row in cur.fetchall()]
-        return rows
+async def list_flows(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    q: Optional[str] = None,
+):
+    """
+    Flows newest-first. With `limit` the result is one keyset page and the
+    cursor for the next page comes back in the `X-Next-Cursor` header.
+    `q` filters by name (prefix match per word).
+    """
+    try:
+        rows, next_cursor = await run_db(flow_store.list_flows, limit, cursor, q)
+    except flow_store.CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
+
+
+@router.get("/summary", response_model=FlowSummaryPage)
+async def list_flow_summaries(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    q: Optional[str] = None,
+):
+    """Dashboard page: flow metadata, node count, last run time and thumbnail URL per flow."""
+    try:
+        rows, next_cursor = await run_db(flow_store.list_summaries, limit, cursor, q)
+    except flow_store.CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    items = []
+    for r in rows:
+        thumb = r.pop("thumb_ref")
+        items.append(FlowSummaryOut(**r, thumbnail_url=f"/api/previews/{thumb}" if thumb else None))
+    return FlowSummaryPage(items=items, next_cursor=next_cursor)
+
+
+async def _export_chunks(lines: Optional[Iterator[bytes]]) -> AsyncGenerator[bytes, None]:
+    """Encode an `export_ndjson` iterator a chunk at a time on the DB executor."""
+    if lines is None:
+        return
+    while chunk := await run_db(flow_store.next_chunk, lines, EXPORT_CHUNK_LINES):
+        yield chunk
+
+
+@router.get("/export.ndjson")
+async def export_flows_ndjson(ids: Optional[List[str]] = Query(None)):
+    """
+    Stream several flows (all of them by default) as one NDJSON export:
+    a header line, then per flow its flow, schema, meta, node and edge records.
+    Flows are loaded one at a time, so memory stays flat however many there are.
+    """
+    async def gen() -> AsyncGenerator[bytes, None]:
+        yield flow_store.ndjson_header()
+        if ids:
+            for fid in ids:
+                async for chunk in _export_chunks(await run_db(flow_store.export_ndjson, fid)):
+                    yield chunk
+            return
+        cursor = None
+        while True:
+            rows, cursor = await run_db(flow_store.list_flows, EXPORT_PAGE_SIZE, cursor)
+            for r in rows:
+                async for chunk in _export_chunks(await run_db(flow_store.export_ndjson, r["id"])):
+                    yield chunk
+            if not cursor:
+                return
+
+    return StreamingResponse(
+        gen(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="flows.ndjson"'},
+    )
+
+
+@router.post("/import.ndjson", response_model=FlowBulkImportResult)
+async def import_flows_ndjson(request: Request):
+    """
+    Import an NDJSON export (one or many flows) with new ids and slugs.
+    The upload is spooled to disk as it arrives and then applied line by line
+    in a single transaction; any bad line rejects the whole import.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        try:
+            flows = await run_db(flow_store.import_ndjson, spool)
+        except flow_store.BundleError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    finally:
+        spool.close()
+    return FlowBulkImportResult(flows=[FlowOut(**f) for f in flows])
 
 
 @router.post("/", response_model=FlowOut)
-def create_flow(payload: FlowCreate):
-    flow_id = new_id()
-    created_at = updated_at = now_iso()
-    base_slug = slugify(payload.name)
-    slug = _unique_slug(base_slug)
-
-    with get_connection() as conn:
-        conn.execute(
-            "INSERT INTO flows (id, name, slug, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
-            (flow_id, payload.name, slug, created_at, updated_at),
-        )
-        conn.commit()
-    return FlowOut(id=flow_id, name=payload.name, slug=slug, created_at=created_at, updated_at=updated_at)
+async def create_flow(payload: FlowCreate):
+    return FlowOut(**await run_db(flow_store.create_flow, payload.name))
 
 
 @router.get("/{flow_id}", response_model=FlowOut)
-def get_flow(flow_id: str):
-    with get_connection() as conn:
-        cur = conn.execute(
-            "SELECT id, name, slug, created_at, updated_at FROM flows WHERE id = ?",
-            (flow_id,),
-        )
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Flow not found")
-        return dict(row)
+async def get_flow(flow_id: str):
+    flow = await run_db(flow_store.get_flow, flow_id)
+    if not flow:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return flow
 
 
 @router.patch("/{flow_id}", response_model=FlowOut)
-def rename_flow(flow_id: str, payload: FlowUpdate):
-    with get_connection() as conn:
-        # validate existence
-        cur = conn.execute("SELECT slug FROM flows WHERE id = ?", (flow_id,))
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Flow not found")
-
-        new_slug_base = slugify(payload.name)
-        slug = _unique_slug(new_slug_base, exclude_id=flow_id)
-        updated_at = now_iso()
-        conn.execute(
-            "UPDATE flows SET name = ?, slug = ?, updated_at = ? WHERE id = ?",
-            (payload.name, slug, updated_at, flow_id),
-        )
-        conn.commit()
-
-        cur = conn.execute(
-            "SELECT id, name, slug, created_at, updated_at FROM flows WHERE id = ?",
-            (flow_id,),
-        )
-        return dict(cur.fetchone())
+async def rename_flow(flow_id: str, payload: FlowUpdate):
+    flow = await run_db(flow_store.rename_flow, flow_id, payload.name)
+    if not flow:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return flow
 
 
 @router.delete("/{flow_id}")
-def delete_flow(flow_id: str):
-    with get_connection() as conn:
-        cur = conn.execute("DELETE FROM flows WHERE id = ?", (flow_id,))
-        if cur.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Flow not found")
-        conn.commit()
+async def delete_flow(flow_id: str):
+    if not await run_db(flow_store.delete_flow, flow_id):
+        raise HTTPException(status_code=404, detail="Flow not found")
     return {"ok": True}
 
 
 @router.get("/{flow_id}/state", response_model=FlowStateOut)
-def get_flow_state(flow_id: str):
-    with get_connection() as conn:
-        # validate flow exists
-        cur = conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Flow not found")
-
-        cur = conn.execute(
-            "SELECT data, updated_at FROM flow_states WHERE flow_id = ?",
-            (flow_id,),
-        )
-        row = cur.fetchone()
-        if not row:
-            # Return an empty default state if none saved yet
-            return FlowStateOut(flow_id=flow_id, data={"nodes": [], "edges": []}, updated_at=now_iso())
-        import json
-        return FlowStateOut(flow_id=flow_id, data=json.loads(row["data"]), updated_at=row["updated_at"])
+async def get_flow_state(flow_id: str):
+    state = await run_db(flow_store.get_state, flow_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return FlowStateOut(flow_id=flow_id, **state)
 
 
 @router.put("/{flow_id}/state", response_model=FlowStateOut)
-def upsert_flow_state(flow_id: str, payload: FlowStateIn):
-    with get_connection() as conn:
-        # validate flow exists
-        cur = conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Flow not found")
-
-        import json
-        updated_at = now_iso()
-        data_json = json.dumps(payload.data)
-
-        # upsert pattern
-        cur = conn.execute(
-            "SELECT 1 FROM flow_states WHERE flow_id = ?",
-            (flow_id,),
-        )
-        if cur.fetchone():
-            conn.execute(
-                "UPDATE flow_states SET data = ?, updated_at = ? WHERE flow_id = ?",
-                (data_json, updated_at, flow_id),
-            )
-        else:
-            conn.execute(
-                "INSERT INTO flow_states (flow_id, data, updated_at) VALUES (?, ?, ?)",
-                (flow_id, data_json, updated_at),
-            )
-        conn.commit()
-        return FlowStateOut(flow_id=flow_id, data=payload.data, updated_at=updated_at)
+async def upsert_flow_state(flow_id: str, payload: FlowStateIn):
+    try:
+        saved = await run_db(flow_store.put_state, flow_id, payload.data, payload.base_version)
+    except flow_store.StateConflict as e:
+        raise _state_conflict(e)
+    if saved is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return FlowStateOut(flow_id=flow_id, data=payload.data, updated_at=saved["updated_at"], version=saved["version"])
+
+
+@router.patch("/{flow_id}/state", response_model=FlowStatePatchOut)
+async def patch_flow_state(flow_id: str, payload: FlowStatePatchIn):
+    """
+    Apply a delta to the saved graph instead of rewriting it. Only the delta is
+    stored; patches are folded back into the snapshot periodically.
+    Returns 409 with the current version if `base_version` is stale.
+    """
+    patch = payload.dict(exclude={"base_version"})
+    try:
+        saved = await run_db(flow_store.patch_state, flow_id, payload.base_version, patch)
+    except flow_store.StateConflict as e:
+        raise _state_conflict(e)
+    except PatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if saved is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return FlowStatePatchOut(flow_id=flow_id, **saved)
+
+
+@router.post("/{flow_id}/state/compact")
+async def compact_flow_state(flow_id: str):
+    res = await run_db(flow_store.compact_state, flow_id)
+    if res is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return res
+
+
+def _state_conflict(e: "flow_store.StateConflict") -> HTTPException:
+    return HTTPException(status_code=409, detail={"message": str(e), "version": e.version})
+
+
+@router.get("/{flow_id}/nodes/{node_id}")
+async def get_flow_node(flow_id: str, node_id: str):
+    """A single node of the saved graph, without loading the whole state."""
+    try:
+        node = await run_db(flow_store.get_node, flow_id, node_id)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    if node is None:
+        raise HTTPException(status_code=404, detail="Node not found")
+    return node
+
+
+@router.get("/{flow_id}/nodes/{node_id}/upstream", response_model=FlowSubgraphOut)
+async def get_flow_node_upstream(flow_id: str, node_id: str):
+    """The node plus every node feeding it (transitively) and the edges between them."""
+    try:
+        sub = await run_db(flow_store.get_upstream, flow_id, node_id)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    if sub is None:
+        raise HTTPException(status_code=404, detail="Node not found")
+    return FlowSubgraphOut(flow_id=flow_id, node_id=node_id, **sub)
 
 
 # ---- Schemas (per-flow custom schemas) ----
 
 @router.get("/{flow_id}/schemas", response_model=list[FlowSchemaOut])
-def list_flow_schemas(flow_id: str):
-    with get_connection() as conn:
-        cur = conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Flow not found")
-        cur = conn.execute(
-            "SELECT id, flow_id, name, description, fields, created_at, updated_at FROM flow_schemas WHERE flow_id = ? ORDER BY created_at DESC",
-            (flow_id,),
-        )
-        import json
-        res = []
-        for row in cur.fetchall():
-            res.append(
-                FlowSchemaOut(
-                    id=row["id"],
-                    flow_id=row["flow_id"],
-                    name=row["name"],
-                    description=row["description"],
-                    fields=json.loads(row["fields"]),
-                    created_at=row["created_at"],
-                    updated_at=row["updated_at"],
-                )
-            )
-        return res
+async def list_flow_schemas(flow_id: str):
+    schemas = await run_db(flow_store.list_schemas, flow_id)
+    if schemas is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return [FlowSchemaOut(**s) for s in schemas]
 
 
 @router.post("/{flow_id}/schemas", response_model=FlowSchemaOut)
-def create_flow_schema(flow_id: str, payload: FlowSchemaIn):
-    with get_connection() as conn:
-        cur = conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Flow not found")
-        import json
-        schema_id = new_id()
-        now = now_iso()
-        conn.execute(
-            "INSERT INTO flow_schemas (id, flow_id, name, description, fields, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (schema_id, flow_id, payload.name, payload.description, json.dumps([f.dict() for f in payload.fields]), now, now),
-        )
-        conn.commit()
-        return FlowSchemaOut(
-            id=schema_id,
-            flow_id=flow_id,
-            name=payload.name,
-            description=payload.description,
-            fields=[f.dict() for f in payload.fields],
-            created_at=now,
-            updated_at=now,
-        )
+async def create_flow_schema(flow_id: str, payload: FlowSchemaIn):
+    fields = [f.dict() for f in payload.fields]
+    schema = await run_db(flow_store.create_schema, flow_id, payload.name, payload.description, fields)
+    if schema is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return FlowSchemaOut(**schema)
 
 
 @router.get("/{flow_id}/schemas/{schema_id}", response_model=FlowSchemaOut)
-def get_flow_schema(flow_id: str, schema_id: str):
-    with get_connection() as conn:
-        cur = conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Flow not found")
-        cur = conn.execute(
-            "SELECT id, flow_id, name, description, fields, created_at, updated_at FROM flow_schemas WHERE id = ? AND flow_id = ?",
-            (schema_id, flow_id),
-        )
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Schema not found")
-        import json
-        return FlowSchemaOut(
-            id=row["id"],
-            flow_id=row["flow_id"],
-            name=row["name"],
-            description=row["description"],
-            fields=json.loads(row["fields"]),
-            created_at=row["created_at"],
-            updated_at=row["updated_at"],
-        )
+async def get_flow_schema(flow_id: str, schema_id: str):
+    if not await run_db(flow_store.flow_exists, flow_id):
+        raise HTTPException(status_code=404, detail="Flow not found")
+    schema = await run_db(flow_store.get_schema, flow_id, schema_id)
+    if schema is None:
+        raise HTTPException(status_code=404, detail="Schema not found")
+    return FlowSchemaOut(**schema)
 
 
 @router.put("/{flow_id}/schemas/{schema_id}", response_model=FlowSchemaOut)
-def update_flow_schema(flow_id: str, schema_id: str, payload: FlowSchemaIn):
-    with get_connection() as conn:
-        cur = conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Flow not found")
-        import json
-        now = now_iso()
-        cur = conn.execute(
-            "UPDATE flow_schemas SET name = ?, description = ?, fields = ?, updated_at = ? WHERE id = ? AND flow_id = ?",
-            (payload.name, payload.description, json.dumps([f.dict() for f in payload.fields]), now, schema_id, flow_id),
-        )
-        if cur.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Schema not found")
-        conn.commit()
-        return FlowSchemaOut(
-            id=schema_id,
-            flow_id=flow_id,
-            name=payload.name,
-            description=payload.description,
-            fields=[f.dict() for f in payload.fields],
-            created_at=now,
-            updated_at=now,
-        )
+async def update_flow_schema(flow_id: str, schema_id: str, payload: FlowSchemaIn):
+    if not await run_db(flow_store.flow_exists, flow_id):
+        raise HTTPException(status_code=404, detail="Flow not found")
+    fields = [f.dict() for f in payload.fields]
+    schema = await run_db(flow_store.update_schema, flow_id, schema_id, payload.name, payload.description, fields)
+    if schema is None:
+        raise HTTPException(status_code=404, detail="Schema not found")
+    return FlowSchemaOut(**schema)
 
 
 @router.delete("/{flow_id}/schemas/{schema_id}")
-def delete_flow_schema(flow_id: str, schema_id: str):
-    with get_connection() as conn:
-        cur = conn.execute("DELETE FROM flow_schemas WHERE id = ? AND flow_id = ?", (schema_id, flow_id))
-        if cur.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Schema not found")
-        conn.commit()
+async def delete_flow_schema(flow_id: str, schema_id: str):
+    if not await run_db(flow_store.delete_schema, flow_id, schema_id):
+        raise HTTPException(status_code=404, detail="Schema not found")
     return {"ok": True}
 
 
-def _unique_slug(base: str, exclude_id: str | None = None) -> str:
-    """Ensure slug uniqueness by suffixing -2, -3, ... when needed."""
-    with get_connection() as conn:
-        slug = base
-        idx = 1
-        while True:
-            params: tuple = (slug,)
-            query = "SELECT id FROM flows WHERE slug = ?"
-            if exclude_id:
-                query += " AND id != ?"
-                params = (slug, exclude_id)
-            cur = conn.execute(query, params)
-            row = cur.fetchone()
-            if not row:
-                return slug
-            idx += 1
-            slug = f"{base}-{idx}"
+# ---- Execution ----
 
+@router.get("/{flow_id}/budget", response_model=FlowBudget)
+async def get_flow_budget(flow_id: str):
+    budget = await run_db(flow_store.get_token_budget, flow_id)
+    if budget is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return budget
+
+
+@router.put("/{flow_id}/budget", response_model=FlowBudget)
+async def set_flow_budget(flow_id: str, payload: FlowBudget):
+    """Set (or clear with null) the token budget applied to each run of the flow."""
+    if not await run_db(flow_store.set_token_budget, flow_id, payload.token_budget):
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return payload
 
-# ---- Execution ----
 
 @router.post("/{flow_id}/run/node", response_model=NodeRunOut)
-def run_node(flow_id: str, payload: NodeRunIn):
-    with get_connection() as conn:
-        cur = conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Flow not found")
-
-    import subprocess
-    import sys
-    import json as _json
-    # Pass current environment (dotenv has already loaded on startup)
-    import os
-    provider_env = dict(os.environ)
+async def run_node(flow_id: str, payload: NodeRunIn):
+    """Run a node and return its outputs with the run's token `usage`.
 
+    Without events to watch, the flow's token budget is checked when the run
+    finishes: a run that went over it is refused with 409 and not memoized.
+    """
+    run_settings = await run_db(flow_store.mark_run, flow_id)
+    if run_settings is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+
+    run_payload = payload.dict()
+    key = node_cache.node_key(run_payload) if node_cache.wants_cache(run_payload) else None
+    if key:
+        hit = await run_db(node_cache.lookup, key)
+        if hit is not None:
+            CACHE_HITS.inc(cache="node")
+            return NodeRunOut(outputs=hit["outputs"], reasoning=hit["reasoning"], cached=True)
+
+    # Runs on a warm worker from the pool (environment is synced per job)
+    run_id = run_payload["run_id"] = payload.run_id or uuid.uuid4().hex
+    recorder = RunRecorder(flow_id, run_payload)
+    recorder.observe({"event": "run_start", "run_id": run_id})
     try:
-        proc = subprocess.run(
-            [sys.executable, "-m", "app.node_runner"],
-            input=_json.dumps(payload.dict()).encode("utf-8"),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=__import__('pathlib').Path(__file__).resolve().parents[1],
-            env=provider_env,
-            timeout=120,
+        data = await get_pool().run(
+            run_payload,
+            timeout=payload.timeout_s,
+            idle_timeout=payload.idle_timeout_s,
+            flow_key=flow_id,
+            run_id=run_id,
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Runner failed to start: {e}")
-
-    if proc.returncode != 0:
-        try:
-            data = _json.loads(proc.stdout.decode("utf-8") or "{}")
-            return NodeRunOut(**data)
-        except Exception:
-            raise HTTPException(status_code=500, detail=proc.stderr.decode("utf-8") or "Runner error")
+    except RunnerCancelled as e:
+        recorder.observe({"event": "cancelled", "message": str(e)})
+        recorder.close()
+        raise HTTPException(status_code=409, detail=str(e))
+    except RunnerTimeout as e:
+        recorder.observe({"event": "timeout", "reason": e.reason, "message": str(e)})
+        recorder.close()
+        raise HTTPException(status_code=504, detail=str(e))
+    except RunnerError as e:
+        recorder.observe({"event": "error", "message": str(e)})
+        recorder.close()
+        raise HTTPException(status_code=500, detail=str(e))
+    for ev in data.pop("lm_events", None) or []:
+        recorder.observe(ev)
+    budget = TokenBudget(run_settings["token_budget"]) if run_settings["token_budget"] else None
+    if budget is not None and budget.add(data.get("usage")):
+        message = f"Token budget exceeded ({budget.used} > {budget.limit} tokens)"
+        recorder.observe({"event": "error", "reason": "token_budget", "message": message})
+        recorder.close()
+        raise HTTPException(status_code=409, detail=message)
+    recorder.observe({"event": "error", "message": data["error"]} if data.get("error") else {"event": "result"})
+    recorder.close()
 
     try:
-        data = _json.loads(proc.stdout.decode("utf-8") or "{}")
-        return NodeRunOut(**data)
+        out = NodeRunOut(**data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Invalid runner output: {e}")
+    if key and not out.error:
+        await run_db(node_cache.store, key, flow_id, payload.node_id, out.outputs, out.reasoning)
+    return out
 
 
 @router.post("/{flow_id}/run/node/stream")
 async def run_node_stream(flow_id: str, request: Request):
     """
     Execute a node and stream structured JSON events (one per line) as the run progresses.
+    Unchanged nodes are answered from the memoized result (`"cached": true`).
 
-    This streams the stdout of a subprocess running `app.node_runner_stream` which emits
-    JSON lines using a DSPy callback and tool wrappers.
+    The node runs on a warm worker from `app.runner_pool`, which executes
+    `app.node_runner_stream` and emits JSON lines using a DSPy callback and tool wrappers.
+    Its run id (`X-Run-Id`, also on every event) can be passed to
+    `POST /api/runs/{run_id}/cancel`; `timeout_s` / `idle_timeout_s` in the body
+    override the pool's limits.
+
+    The run does not depend on this connection: events are buffered in
+    `app.run_streams`, and after a disconnect `GET /api/runs/{run_id}/stream`
+    replays them from any `seq` and follows the run (NDJSON or SSE).
     """
-    with get_connection() as conn:
-        cur = conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Flow not found")
+    run_settings = await run_db(flow_store.mark_run, flow_id)
+    if run_settings is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    budget = TokenBudget(run_settings["token_budget"]) if run_settings["token_budget"] else None
 
     # Read raw JSON body (pass through to runner)
     try:
         payload_bytes = await request.body()
-        # lightweight validation: ensure it is JSON
-        _ = __import__("json").loads(payload_bytes.decode("utf-8") or "{}")
+        payload = json.loads(payload_bytes.decode("utf-8") or "{}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+    run_id = payload.get("run_id") or uuid.uuid4().hex
+    payload["run_id"] = run_id
 
-    provider_env = dict(_os.environ)
-    workdir = Path(__file__).resolve().parents[1]
+    async def event_stream() -> AsyncGenerator[bytes, None]:
+        # Worker lines are buffered as they arrive; cancelling the run closes
+        # this generator, which makes the pool kill and replace the worker.
+        try:
+            async for line in node_cache.memoized_stream(flow_id, payload, budget=budget):
+                # Each line is a JSON object (utf-8)
+                yield line
+        except RunnerError as e:
+            yield (json.dumps({"event": "error", "node": {"id": payload.get("node_id")}, "message": str(e)}) + "\n").encode("utf-8")
 
-    # Start subprocess with pipes
     try:
-        proc = await asyncio.create_subprocess_exec(
-            sys.executable,
-            "-m",
-            "app.node_runner_stream",
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            cwd=str(workdir),
-            env=provider_env,
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Runner failed to start: {e}")
+        stream = run_streams.start(run_id, "node", event_stream())
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return stream_response(request, stream)
 
-    # Send payload
-    assert proc.stdin is not None
-    proc.stdin.write(payload_bytes)
-    await proc.stdin.drain()
-    proc.stdin.close()
 
-    async def event_stream() -> AsyncGenerator[bytes, None]:
-        assert proc.stdout is not None
-        # Stream stdout lines immediately as they arrive
+@router.post("/{flow_id}/run")
+async def run_flow(flow_id: str, request: Request, payload: FlowRunIn | None = None):
+    """
+    Execute the saved flow graph server-side and stream one multiplexed NDJSON
+    event stream. Independent compute nodes run concurrently; every runner event
+    is tagged with `node_id`, framed by `flow_start` and `flow_end`. The
+    `flow_run_id` (`X-Run-Id`, also on `flow_start`) can be passed to
+    `POST /api/runs/{id}/cancel` and to `GET /api/runs/{id}/stream` to re-attach.
+    """
+    opts = payload or FlowRunIn()
+    run_settings = await run_db(flow_store.mark_run, flow_id)
+    if run_settings is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    state = await run_db(flow_store.get_state, flow_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+
+    flow_run_id = uuid.uuid4().hex
+    stream = execute_flow(
+        flow_id,
+        state["data"],
+        concurrency=opts.concurrency,
+        targets=opts.node_ids,
+        token_budget=run_settings["token_budget"],
+        timeout=opts.timeout_s,
+        flow_run_id=flow_run_id,
+    )
+    return stream_response(request, run_streams.start(flow_run_id, "flow", stream))
+
+
+@router.post("/{flow_id}/run/batch")
+async def run_batch(
+    flow_id: str,
+    request: Request,
+    node_id: Optional[str] = None,
+    batch_id: Optional[str] = None,
+    concurrency: Optional[int] = Query(None, ge=1, le=64),
+    format: Optional[Literal["csv", "jsonl"]] = None,
+):
+    """
+    Run one node (`node_id`) or the whole flow once per row of a CSV or JSONL
+    dataset sent as the body, streaming one `row` result per line as rows
+    finish. Pass a previous `batch_id` with the same dataset to resume it:
+    rows that already succeeded are skipped.
+
+    Like node and flow runs, the batch is buffered in `app.run_streams` under
+    its `batch_id`: a slow or dropped client does not hold up or stop it.
+    """
+    run_settings = await run_db(flow_store.mark_run, flow_id)
+    if run_settings is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    state = await run_db(flow_store.get_state, flow_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    try:
+        batch_runner.validate(state["data"], node_id)
+    except FlowGraphError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if batch_id and batch_runner.is_active(batch_id):
+        raise HTTPException(status_code=409, detail="Batch is still running")
+    fmt = format or ("csv" if "csv" in (request.headers.get("content-type") or "") else "jsonl")
+
+    # Spool first: the body can't be read once the response is streaming
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        batch_id, resumed = await run_db(batch_runner.open_batch, batch_id, flow_id, node_id)
+    except batch_runner.BatchConflict as e:
+        spool.close()
+        raise HTTPException(status_code=409, detail=str(e))
+    except BaseException:
+        spool.close()
+        raise
+
+    async def gen() -> AsyncGenerator[bytes, None]:
         try:
-            while True:
-                line = await proc.stdout.readline()
-                if not line:
-                    break
-                # Each line is a JSON object (utf-8)
+            async for line in batch_runner.execute_batch(
+                flow_id,
+                state["data"],
+                batch_runner.read_rows(batch_runner.file_chunks(spool), fmt),
+                batch_id=batch_id,
+                resumed=resumed,
+                node_id=node_id,
+                concurrency=concurrency,
+                token_budget=run_settings["token_budget"],
+            ):
                 yield line
-        except __import__("asyncio").CancelledError:
-            # Client disconnected; terminate the child process
-            try:
-                if proc.returncode is None:
-                    proc.kill()
-            except Exception:
-                pass
-            raise
         finally:
-            # Ensure process exits
-            try:
-                await proc.wait()
-            except Exception:
-                pass
+            spool.close()
 
-    # application/x-ndjson is convenient for line-delimited JSON
-    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+    try:
+        stream = run_streams.start(batch_id, "batch", gen())
+    except ValueError as e:
+        spool.close()
+        raise HTTPException(status_code=409, detail=str(e))
+    return stream_response(request, stream, headers={"X-Batch-Id": batch_id})
 
 
 # ---- Import/Export ----
 
-@router.get("/{flow_id}/export", response_model=FlowExportBundle)
-def export_flow_bundle(flow_id: str):
-    import json
-    with get_connection() as conn:
-        # Flow
-        cur = conn.execute(
-            "SELECT id, name, slug, created_at, updated_at FROM flows WHERE id = ?",
-            (flow_id,),
-        )
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Flow not found")
-        flow = FlowOut(**dict(row))
-
-        # State (optional)
-        cur = conn.execute(
-            "SELECT data FROM flow_states WHERE flow_id = ?",
-            (flow_id,),
-        )
-        srow = cur.fetchone()
-        state = json.loads(srow["data"]) if srow else {"nodes": [], "edges": []}
+@router.get("/{flow_id}/export.ndjson")
+async def export_flow_ndjson(flow_id: str):
+    """Stream one flow as NDJSON (same format as the bulk export)."""
+    lines = await run_db(flow_store.export_ndjson, flow_id)
+    if lines is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
 
-        # Schemas
-        cur = conn.execute(
-            "SELECT id, flow_id, name, description, fields, created_at, updated_at FROM flow_schemas WHERE flow_id = ? ORDER BY created_at ASC",
-            (flow_id,),
-        )
-        schemas: list[FlowSchemaOut] = []
-        for r in cur.fetchall():
-            schemas.append(
-                FlowSchemaOut(
-                    id=r["id"],
-                    flow_id=r["flow_id"],
-                    name=r["name"],
-                    description=r["description"],
-                    fields=json.loads(r["fields"]),
-                    created_at=r["created_at"],
-                    updated_at=r["updated_at"],
-                )
-            )
-
-    return FlowExportBundle(version=1, flow=flow, state=state, schemas=schemas)
+    async def gen() -> AsyncGenerator[bytes, None]:
+        yield flow_store.ndjson_header()
+        async for chunk in _export_chunks(lines):
+            yield chunk
 
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
 
-@router.post("/import", response_model=FlowImportResult)
-def import_flow_bundle(payload: FlowExportBundle):
-    import json
-    # Create flow (new id and slug)
-    name = payload.flow.name
-    flow_id = new_id()
-    created_at = updated_at = now_iso()
-    base_slug = slugify(name)
-    slug = _unique_slug(base_slug)
-
-    with get_connection() as conn:
-        conn.execute(
-            "INSERT INTO flows (id, name, slug, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
-            (flow_id, name, slug, created_at, updated_at),
-        )
 
-        # Re-map schema ids while preserving internal references
-        id_map: dict[str, str] = {}
-        for s in payload.schemas:
-            id_map[s.id] = new_id()
-
-        for s in payload.schemas:
-            new_schema_id = id_map[s.id]
-            # Rewrite field references to new schema ids
-            new_fields: list[dict] = []
-            for f in s.fields:
-                # f may be dict or pydantic model
-                fd = f if isinstance(f, dict) else f.dict()  # type: ignore[attr-defined]
-                # Repoint nested schema references, if present
-                obj_id = fd.get("objectSchemaId")
-                if obj_id and obj_id in id_map:
-                    fd["objectSchemaId"] = id_map[obj_id]
-                arr_id = fd.get("arrayItemSchemaId")
-                if arr_id and arr_id in id_map:
-                    fd["arrayItemSchemaId"] = id_map[arr_id]
-                new_fields.append(fd)
-
-            now = now_iso()
-            conn.execute(
-                "INSERT INTO flow_schemas (id, flow_id, name, description, fields, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (
-                    new_schema_id,
-                    flow_id,
-                    s.name,
-                    s.description,
-                    json.dumps(new_fields),
-                    now,
-                    now,
-                ),
-            )
-
-        # Save state (strip ephemeral runtime if present)
-        state = payload.state or {"nodes": [], "edges": []}
-        try:
-            nodes = state.get("nodes") or []
-            for n in nodes:
-                data = n.get("data") if isinstance(n, dict) else None
-                if isinstance(data, dict):
-                    data.pop("runtime", None)
-        except Exception:
-            # If structure is unexpected, store as-is
-            pass
-
-        conn.execute(
-            "INSERT INTO flow_states (flow_id, data, updated_at) VALUES (?, ?, ?)",
-            (flow_id, json.dumps(state), updated_at),
-        )
+@router.get("/{flow_id}/export", response_model=FlowExportBundle)
+async def export_flow_bundle(flow_id: str):
+    flow = await run_db(flow_store.get_flow, flow_id)
+    if not flow:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    state = await run_db(flow_store.get_state, flow_id)
+    schemas = await run_db(flow_store.list_schemas, flow_id, oldest_first=True)
+    if state is None or schemas is None:
+        # Deleted between reads
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return FlowExportBundle(
+        version=1,
+        flow=FlowOut(**flow),
+        state=state["data"],
+        schemas=[FlowSchemaOut(**s) for s in schemas],
+    )
 
-        conn.commit()
 
-    flow = FlowOut(id=flow_id, name=name, slug=slug, created_at=created_at, updated_at=updated_at)
-    return FlowImportResult(flow=flow)
+@router.post("/import", response_model=FlowImportResult)
+async def import_flow_bundle(payload: FlowExportBundle):
+    # Create flow (new id and slug); schema ids are re-mapped by the store
+    schemas = [
+        {
+            "id": s.id,
+            "name": s.name,
+            "description": s.description,
+            # f may be dict or pydantic model
+            "fields": [f if isinstance(f, dict) else f.dict() for f in s.fields],  # type: ignore[attr-defined]
+        }
+        for s in payload.schemas
+    ]
+    state = payload.state or {"nodes": [], "edges": []}
+    flow = await run_db(flow_store.import_bundle, payload.flow.name, state, schemas)
+    return FlowImportResult(flow=FlowOut(**flow))
 
 
 # ---- Flow Previews ----
 
+def _preview_out(flow_id: str, row: dict) -> FlowPreviewOut:
+    return FlowPreviewOut(
+        flow_id=flow_id,
+        url=f"/api/previews/{row['image_ref']}",
+        thumbnail_url=f"/api/previews/{row['thumb_ref']}",
+        etag=row["image_ref"].split(".", 1)[0],
+        size=row.get("size"),
+        updated_at=row["updated_at"],
+    )
+
+
 @router.get("/{flow_id}/preview", response_model=FlowPreviewOut)
-def get_flow_preview(flow_id: str):
-    with get_connection() as conn:
-        cur = conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Flow not found")
-        cur = conn.execute(
-            "SELECT image, updated_at FROM flow_previews WHERE flow_id = ?",
-            (flow_id,),
-        )
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Preview not found")
-        return FlowPreviewOut(flow_id=flow_id, image=row["image"], updated_at=row["updated_at"])
+async def get_flow_preview(flow_id: str):
+    try:
+        row = await run_db(flow_store.get_preview, flow_id)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    if not row:
+        raise HTTPException(status_code=404, detail="Preview not found")
+    return _preview_out(flow_id, row)
+
+
+@router.get("/{flow_id}/preview/image")
+async def get_flow_preview_image(flow_id: str, request: Request, thumb: bool = False):
+    """Raw preview bytes (or the dashboard thumbnail); revalidates via ETag since the flow's preview can change."""
+    try:
+        row = await run_db(flow_store.get_preview, flow_id)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    if not row:
+        raise HTTPException(status_code=404, detail="Preview not found")
+    return preview_response(request, row["thumb_ref"] if thumb else row["image_ref"], "no-cache")
 
 
 @router.put("/{flow_id}/preview", response_model=FlowPreviewOut)
-def upsert_flow_preview(flow_id: str, payload: FlowPreviewIn):
-    updated_at = now_iso()
-    with get_connection() as conn:
-        cur = conn.execute("SELECT 1 FROM flows WHERE id = ?", (flow_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Flow not found")
-        cur = conn.execute("SELECT 1 FROM flow_previews WHERE flow_id = ?", (flow_id,))
-        if cur.fetchone():
-            conn.execute(
-                "UPDATE flow_previews SET image = ?, updated_at = ? WHERE flow_id = ?",
-                (payload.image, updated_at, flow_id),
-            )
-        else:
-            conn.execute(
-                "INSERT INTO flow_previews (flow_id, image, updated_at) VALUES (?, ?, ?)",
-                (flow_id, payload.image, updated_at),
-            )
-        conn.commit()
-    return FlowPreviewOut(flow_id=flow_id, image=payload.image, updated_at=updated_at)
+async def upsert_flow_preview(flow_id: str, payload: FlowPreviewIn):
+    try:
+        row = await run_db(flow_store.put_preview, flow_id, payload.image)
+    except PreviewError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if row is None:
+        raise HTTPException(status_code=404, detail="Flow not found")
+    return _preview_out(flow_id, row)
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, HTTPException, Request
+from starlette.responses import FileResponse, Response
+
+from app import preview_store
+
+router = APIRouter()
+
+# References are content hashes, so the bytes behind a URL never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Previews are served from the API origin: an uploaded SVG opened directly must
+# not run scripts or load anything, and no response may be sniffed as HTML
+PREVIEW_SECURITY_HEADERS = {
+    "Content-Security-Policy": "default-src 'none'; style-src 'unsafe-inline'; sandbox",
+    "X-Content-Type-Options": "nosniff",
+}
+
+
+def preview_response(request: Request, ref: str, cache_control: str) -> Response:
+    """Serve a stored preview blob with a strong ETag, answering 304 when the client has it."""
+    path = preview_store.path_for(ref)
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Preview not found")
+    etag = f'"{ref.split(".", 1)[0]}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, **PREVIEW_SECURITY_HEADERS}
+    inm = request.headers.get("if-none-match")
+    if inm and (inm.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in inm.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=preview_store.mime_for(ref), headers=headers)
+
+
+@router.get("/{ref}")
+def get_preview_blob(ref: str, request: Request):
+    return preview_response(request, ref, IMMUTABLE)
@@ -0,0 +1,204 @@
+import json
+from typing import Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from app import batch_runner, blob_store, run_log, run_streams
+from app.db import run_db
+from app.flow_executor import cancel_flow_run
+from app.rate_limiter import get_limiter
+from app.runner_pool import get_pool
+from routes.previews import IMMUTABLE
+
+
+router = APIRouter()
+
+# Checkpointed batch rows read per query when streaming results
+BATCH_ROWS_PAGE_SIZE = 500
+
+
+def stream_response(request: Request, stream: "run_streams.RunStream", offset: int = 0, fmt: str | None = None, headers: dict | None = None) -> StreamingResponse:
+    """Attach to a buffered run from `offset` as NDJSON or SSE (`format=sse` or `Accept: text/event-stream`).
+
+    SSE events carry the line's `seq` as `id`, so a reconnecting EventSource
+    resumes after `Last-Event-ID`; NDJSON lines carry it as `"seq"`.
+    """
+    sse = fmt == "sse" or (fmt is None and "text/event-stream" in request.headers.get("accept", ""))
+    last_id = request.headers.get("last-event-id")
+    if last_id and last_id.isdigit():
+        offset = max(offset, int(last_id) + 1)
+    headers = {"X-Run-Id": stream.run_id, **(headers or {})}
+
+    async def ndjson():
+        async for _, line in stream.attach(offset):
+            yield line
+
+    async def sse_events():
+        async for seq, line in stream.attach(offset, ping=run_streams.SSE_PING_S):
+            if not line:
+                yield b": ping\n\n"
+            elif seq is None:
+                yield b"data: " + line[:-1] + b"\n\n"
+            else:
+                yield b"id: %d\ndata: " % seq + line[:-1] + b"\n\n"
+
+    if sse:
+        return StreamingResponse(sse_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", **headers})
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson", headers=headers)
+
+
+@router.get("/pool")
+def pool_stats():
+    """Queue depth and per-worker stats for the warm runner pool."""
+    return get_pool().stats()
+
+
+@router.get("/rate-limits")
+def rate_limits():
+    """Per-provider limiter state: limits, adaptive rate factor, backoff, queue depth and grants."""
+    return get_limiter().stats()
+
+
+@router.get("/recent")
+async def recent_runs(flow_id: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    """Most recent node runs (newest first), optionally for one flow."""
+    return await run_db(run_log.recent_runs, flow_id, limit)
+
+
+@router.get("/lm/slowest")
+async def slowest_lm_calls(
+    since_hours: float = Query(24, gt=0),
+    limit: int = Query(20, ge=1, le=500),
+    model: Optional[str] = None,
+):
+    """Slowest LM calls in the window, by latency from lm_start to lm_end."""
+    return await run_db(run_log.slowest_lm_calls, since_hours, limit, model)
+
+
+@router.get("/errors")
+async def error_rates(
+    since_hours: float = Query(24, gt=0),
+    group_by: Literal["flow", "node", "model", "lm"] = "flow",
+):
+    """Error rates per flow, node or model (runs), or per model over individual LM calls (`lm`)."""
+    return await run_db(run_log.error_rates, since_hours, group_by)
+
+
+@router.get("/flow-runs")
+async def recent_flow_runs(flow_id: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    """Most recent whole-flow runs with their token usage and cost."""
+    return await run_db(run_log.recent_flow_runs, flow_id, limit)
+
+
+@router.get("/usage")
+async def usage(
+    since_hours: float = Query(24, gt=0),
+    group_by: Literal["node", "flow", "model"] = "node",
+    flow_id: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+):
+    """Prompt/completion tokens and cost per node, flow or model, heaviest first."""
+    return await run_db(run_log.usage, since_hours, group_by, flow_id, limit)
+
+
+@router.get("/history")
+def history_stats():
+    """Background writer counters for the run history."""
+    return run_log.writer_stats()
+
+
+@router.post("/history/compact")
+async def compact_history():
+    """Apply the retention policy now instead of waiting for the periodic pass."""
+    return await run_db(run_log.compact)
+
+
+@router.get("/batches")
+async def recent_batches(flow_id: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    """Most recent dataset batches (newest first), optionally for one flow."""
+    return await run_db(batch_runner.recent_batches, flow_id, limit)
+
+
+@router.get("/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    """Batch status, rows/sec of the last attempt and row counts over all attempts."""
+    batch = await run_db(batch_runner.get_batch, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    batch["active"] = batch_runner.is_active(batch_id)
+    return batch
+
+
+@router.get("/batches/{batch_id}/rows")
+async def batch_rows(batch_id: str, status: Optional[Literal["done", "error"]] = None):
+    """Checkpointed row results as NDJSON in row order, read one page at a time."""
+    if await run_db(batch_runner.get_batch, batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    async def gen():
+        after = -1
+        while True:
+            rows = await run_db(batch_runner.batch_rows, batch_id, after, BATCH_ROWS_PAGE_SIZE, status)
+            for r in rows:
+                yield (json.dumps(r) + "\n").encode("utf-8")
+            if len(rows) < BATCH_ROWS_PAGE_SIZE:
+                return
+            after = rows[-1]["row"]
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+
+@router.get("/blobs/{digest}")
+def get_blob(digest: str, request: Request):
+    """Full text of an offloaded prompt/response (`prompt_blob`/`response_blob` on LM events); supports Range."""
+    path = blob_store.path_for(digest)
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Blob not found")
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE}
+    inm = request.headers.get("if-none-match")
+    if inm and (inm.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in inm.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="text/plain; charset=utf-8", headers=headers)
+
+
+@router.get("/streams")
+def run_streams_list():
+    """Runs whose events are buffered for (re-)attaching, running or recently finished."""
+    return run_streams.active()
+
+
+@router.get("/{run_id}/stream")
+async def attach_run(
+    run_id: str,
+    request: Request,
+    offset: int = Query(0, ge=0),
+    format: Optional[Literal["ndjson", "sse"]] = None,
+):
+    """Replay a node or flow run's events from `offset` (or after `Last-Event-ID`) and follow it live."""
+    stream = run_streams.get(run_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Run not found or expired")
+    return stream_response(request, stream, offset, format)
+
+
+@router.post("/{run_id}/cancel")
+async def cancel_run(run_id: str):
+    """Cancel a node run (its worker is killed) or a whole flow run by `flow_run_id`."""
+    if get_pool().cancel(run_id):
+        return {"run_id": run_id, "cancelled": True, "kind": "node"}
+    if cancel_flow_run(run_id):
+        return {"run_id": run_id, "cancelled": True, "kind": "flow"}
+    if run_streams.cancel(run_id):
+        # Not on a worker yet (e.g. memo lookup): stop it where it is
+        return {"run_id": run_id, "cancelled": True, "kind": run_streams.get(run_id).kind}
+    raise HTTPException(status_code=404, detail="Run not found or already finished")
+
+
+@router.get("/{run_id}/events")
+async def run_events(run_id: str):
+    events = await run_db(run_log.run_events, run_id)
+    if events is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return events
@@ -0,0 +1,41 @@
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# Tests import the backend the way main.py does (`app.*`, `routes.*`)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app import db, rate_client, run_log  # noqa: E402
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """A fresh, initialized flows database for one test."""
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "flows.db")
+    monkeypatch.setattr(db, "_pool", None)
+    db.init_db()
+    yield db
+    # Write queued run history here, not into the real database after the test
+    run_log.shutdown()
+    pool = db._pool
+    while pool is not None and not pool._idle.empty():
+        pool._idle.get_nowait().close()
+
+
+@pytest.fixture
+def channel(monkeypatch):
+    """Attach rate_client to a fake worker protocol that grants with `reply`."""
+    sent = []
+    reply = {"wait_s": 0.0, "provider": "openai"}
+
+    def write(msg):
+        sent.append(msg)
+        if msg.get("__rate__") == "acquire":
+            threading.Thread(target=rate_client.on_reply, args=({"id": msg["id"], **reply},)).start()
+
+    monkeypatch.setattr(rate_client, "_write", write)
+    monkeypatch.setattr(rate_client, "_unlimited", {})
+    yield sent, reply
+    rate_client.set_job(None)
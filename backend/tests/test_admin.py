@@ -0,0 +1,20 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import lm_cache
+from routes import admin
+
+
+def test_admin_routes_are_async_and_answer(sqlite_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(lm_cache, "LM_CACHE_PATH", tmp_path / "lm_cache.db")
+    app = FastAPI()
+    app.include_router(admin.router, prefix="/api/admin")
+    client = TestClient(app)
+
+    assert client.get("/api/admin/node-cache").status_code == 200
+    assert client.delete("/api/admin/node-cache").json() == {"removed": 0}
+    assert client.get("/api/admin/lm-cache").status_code == 200
+    assert client.get("/api/admin/lm-cache/entries", params={"limit": 5}).json() == []
+    assert client.post("/api/admin/lm-cache/evict").status_code == 200
+    assert "pool" in client.get("/api/admin/db").json()
+    assert all(r.endpoint.__code__.co_flags & 0x80 for r in admin.router.routes)
@@ -0,0 +1,99 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+from app import batch_runner
+
+
+def _rows(data: bytes, fmt: str, size: int = 7):
+    async def collect():
+        return [r async for r in batch_runner.read_rows(batch_runner.file_chunks(io.BytesIO(data), size), fmt)]
+    return asyncio.run(collect())
+
+
+def test_csv_rows_with_quoted_newlines_and_bad_records():
+    data = '﻿question, context\n"multi\nline, quoted",ctx\n\nonly-one-column\n"a ""b""",c\n'.encode()
+    assert _rows(data, "csv") == [
+        (0, {"question": "multi\nline, quoted", "context": "ctx"}, None),
+        (1, None, "Expected 2 columns, got 1"),
+        (2, {"question": 'a "b"', "context": "c"}, None),
+    ]
+
+
+def test_jsonl_rows_count_invalid_lines_but_not_blank_ones():
+    data = b'{"q": 1}\n\n[1, 2]\nnot json\n{"q": 2}'
+    rows = _rows(data, "jsonl", size=3)
+    assert [(i, r) for i, r, _ in rows] == [(0, {"q": 1}), (1, None), (2, None), (3, {"q": 2})]
+    assert "expected a JSON object" in rows[1][2]
+
+
+def test_oversized_and_unterminated_records(monkeypatch):
+    monkeypatch.setattr(batch_runner, "BATCH_MAX_RECORD_BYTES", 10)
+    with pytest.raises(batch_runner.BatchError, match="exceeds"):
+        _rows(b'{"q": "' + b"x" * 50 + b'"}\n', "jsonl")
+    monkeypatch.setattr(batch_runner, "BATCH_MAX_RECORD_BYTES", 1024)
+    with pytest.raises(batch_runner.BatchError, match="Unterminated"):
+        _rows(b'a\n"open\n', "csv")
+
+
+def test_open_batch_conflicts(sqlite_db):
+    batch_id, resumed = batch_runner.open_batch(None, "flow-1", "n1")
+    assert not resumed
+    assert batch_runner.open_batch(batch_id, "flow-1", "n1") == (batch_id, True)
+    assert batch_runner.get_batch(batch_id)["attempts"] == 2
+    with pytest.raises(batch_runner.BatchConflict):
+        batch_runner.open_batch(batch_id, "flow-1", "other-node")
+    with pytest.raises(batch_runner.BatchConflict):
+        batch_runner.open_batch("missing", "flow-1", "n1")
+
+
+def test_done_rows_page_across_boundaries(sqlite_db, monkeypatch):
+    monkeypatch.setattr(batch_runner, "RESUME_PAGE_SIZE", 2)
+    batch_id, _ = batch_runner.open_batch(None, "f", "n")
+    for i in (0, 1, 3, 4, 5, 9):
+        batch_runner.record_row(batch_id, {"row": i, "status": "done", "outputs": {}})
+    batch_runner.record_row(batch_id, {"row": 6, "status": "error", "error": "boom"})
+
+    async def probe():
+        done = batch_runner._DoneRows(batch_id)
+        return [i for i in range(12) if await done.contains(i)]
+
+    assert asyncio.run(probe()) == [0, 1, 3, 4, 5, 9]
+
+
+def test_resume_only_reruns_rows_that_did_not_succeed(sqlite_db, monkeypatch):
+    calls = []
+    failing = {"q2"}
+
+    async def fake_node_row(flow_id, graph, node_id, row, token_budget):
+        calls.append(row["q"])
+        if row["q"] in failing:
+            return {"status": "error", "error": "provider down", "usage": None}
+        return {"status": "done", "outputs": {"a": row["q"].upper()}, "usage": {"prompt_tokens": 3, "completion_tokens": 1}}
+
+    monkeypatch.setattr(batch_runner, "_run_node_row", fake_node_row)
+    data = b"".join(json.dumps({"q": f"q{i}"}).encode() + b"\n" for i in range(5))
+
+    async def run(batch_id, resumed):
+        rows = batch_runner.read_rows(batch_runner.file_chunks(io.BytesIO(data)), "jsonl")
+        lines = [json.loads(l) async for l in batch_runner.execute_batch("f", {"nodes": [], "edges": []}, rows, batch_id=batch_id, resumed=resumed, node_id="n", concurrency=2)]
+        return lines
+
+    batch_id, _ = batch_runner.open_batch(None, "f", "n")
+    first = asyncio.run(run(batch_id, False))
+    end = first[-1]
+    assert end["event"] == "batch_end" and end["status"] == "error" and end["failed"] == 1
+    assert sorted(calls) == [f"q{i}" for i in range(5)]
+
+    calls.clear()
+    failing.clear()
+    batch_id, resumed = batch_runner.open_batch(batch_id, "f", "n")
+    second = asyncio.run(run(batch_id, resumed))
+    assert calls == ["q2"]
+    end = second[-1]
+    assert end["status"] == "done" and end["skipped"] == 4 and end["done"] == 1
+    assert end["totals"] == {"rows": 5, "done": 5, "failed": 0}
+    stored = batch_runner.batch_rows(batch_id)
+    assert [(r["row"], r["status"], r["outputs"]["a"]) for r in stored] == [(i, "done", f"Q{i}") for i in range(5)]
@@ -0,0 +1,98 @@
+import os
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import blob_store
+from app.dspy_streaming import StreamingCallback
+from routes import runs
+
+
+@pytest.fixture
+def blobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "BLOB_DIR", tmp_path / "blobs")
+    monkeypatch.setattr(blob_store, "EVENT_BLOB_MIN_CHARS", 100)
+    monkeypatch.setattr(blob_store, "EVENT_BLOB_PREVIEW_CHARS", 10)
+    return tmp_path / "blobs"
+
+
+def test_long_fields_are_offloaded_with_a_preview(blobs):
+    text = "é" + "x" * 199
+    ev = {"event": "lm_end", "response": text, "short": "y" * 99}
+    blob_store.offload(ev, "response")
+    blob_store.offload(ev, "short")
+
+    ref = ev["response_blob"]
+    assert ev["response"] == text[:10]
+    assert (ref["chars"], ref["size"]) == (200, 201)
+    assert ref["url"] == f"/api/runs/blobs/{ref['hash']}"
+    assert blob_store.path_for(ref["hash"]).read_text(encoding="utf-8") == text
+    # Below the threshold the field stays inline
+    assert ev["short"] == "y" * 99 and "short_blob" not in ev
+
+
+def test_offloading_can_be_turned_off(blobs, monkeypatch):
+    monkeypatch.setattr(blob_store, "EVENT_BLOB_MIN_CHARS", 0)
+    ev = {"prompt": "x" * 1000}
+    blob_store.offload(ev, "prompt")
+    assert ev == {"prompt": "x" * 1000}
+    assert not blobs.exists()
+
+
+def test_identical_text_is_stored_once_and_refreshed(blobs):
+    digest, _ = blob_store.put_text("same text")
+    path = blob_store.path_for(digest)
+    old = time.time() - 10 * 86_400
+    os.utime(path, (old, old))
+
+    assert blob_store.put_text("same text")[0] == digest
+    assert len(list(blobs.iterdir())) == 1
+    assert path.stat().st_mtime > old
+
+
+def test_sweep_deletes_only_stale_blobs(blobs):
+    stale, _ = blob_store.put_text("stale")
+    fresh, _ = blob_store.put_text("fresh")
+    old = time.time() - 5 * 86_400
+    os.utime(blob_store.path_for(stale), (old, old))
+
+    assert blob_store.sweep(3) == 1
+    assert not blob_store.path_for(stale).exists()
+    assert blob_store.path_for(fresh).exists()
+
+
+def test_path_for_rejects_malformed_hashes(blobs):
+    assert blob_store.path_for("../../etc/passwd") is None
+    assert blob_store.path_for("A" * 64) is None
+    assert blob_store.path_for("a" * 64) == blobs / f"{'a' * 64}.txt"
+
+
+def test_lm_events_offload_long_prompts(blobs):
+    class LM:
+        model = "openai/gpt-4o-mini"
+
+    events = []
+    callback = StreamingCallback(events.append, run_id="r1")
+    callback.on_lm_start("c1", LM(), {"messages": [{"role": "user", "content": "q" * 500}]})
+    (ev,) = events
+    assert len(ev["prompt"]) == 10
+    assert ev["prompt_blob"]["chars"] > 500
+    assert "q" * 500 in blob_store.path_for(ev["prompt_blob"]["hash"]).read_text()
+
+
+def test_blob_route_serves_text_with_etag_and_ranges(blobs):
+    app = FastAPI()
+    app.include_router(runs.router, prefix="/api/runs")
+    client = TestClient(app)
+    digest, _ = blob_store.put_text("hello blob store")
+
+    r = client.get(f"/api/runs/blobs/{digest}")
+    assert r.status_code == 200 and r.text == "hello blob store"
+    assert r.headers["etag"] == f'"{digest}"'
+    assert client.get(f"/api/runs/blobs/{digest}", headers={"If-None-Match": f'"{digest}"'}).status_code == 304
+    r = client.get(f"/api/runs/blobs/{digest}", headers={"Range": "bytes=6-9"})
+    assert r.status_code == 206 and r.text == "blob"
+    assert client.get(f"/api/runs/blobs/{'0' * 64}").status_code == 404
+    assert client.get("/api/runs/blobs/not-a-hash").status_code == 404
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from app import dspy_streaming
+from app.dspy_streaming import _parse_caps, encode_event
+
+
+@pytest.fixture
+def caps(monkeypatch):
+    monkeypatch.setattr(dspy_streaming, "EVENT_FIELD_MAX_CHARS", 50)
+    monkeypatch.setattr(dspy_streaming, "EVENT_FIELD_CAPS", {"prompt": 100})
+    monkeypatch.setattr(dspy_streaming, "_MIN_CAP", 50)
+
+
+def test_parse_caps():
+    assert _parse_caps("prompt=200000, inputs = 8192,,bad") == {"prompt": 200000, "inputs": 8192}
+    assert _parse_caps("") == {}
+
+
+def test_short_events_are_encoded_unchanged(caps):
+    ev = {"event": "lm_end", "response": "ok", "usage": {"total_tokens": 3}}
+    assert json.loads(encode_event(ev)) == ev
+
+
+def test_oversized_fields_are_cut_and_listed(caps):
+    ev = {
+        "event": "lm_start",
+        "call_id": "c1",
+        "prompt": "p" * 80,
+        "response": "r" * 60,
+        "params": {"messages": ["m" * 60]},
+    }
+    out = json.loads(encode_event(ev))
+    # Under its own cap
+    assert out["prompt"] == "p" * 80
+    assert out["response"] == "r" * 50 + "...[truncated 10 chars]"
+    # Structures are replaced by their cut JSON
+    assert isinstance(out["params"], str) and out["params"].startswith('{"messages": ["mmm')
+    assert out["params"].endswith("chars]")
+    assert out["truncated"] == ["response", "params"]
+    assert out["call_id"] == "c1"
+    # The caller's event is left alone
+    assert ev["response"] == "r" * 60 and "truncated" not in ev
+
+
+def test_result_events_are_never_cut(caps):
+    for kind in ("result", "example_end"):
+        ev = {"event": kind, "outputs": {"answer": "a" * 500}}
+        assert json.loads(encode_event(ev)) == ev
+
+
+def test_non_json_values_fall_back_to_str(caps):
+    class Prediction:
+        def __str__(self):
+            return "Prediction(answer='x')"
+
+    out = json.loads(encode_event({"event": "module_end", "outputs": Prediction(), "meta": {(1, 2): "tuple key"}}))
+    assert out["outputs"] == "Prediction(answer='x')"
+    assert out["meta"] == "{(1, 2): 'tuple key'}"
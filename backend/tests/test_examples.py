@@ -0,0 +1,62 @@
+import threading
+
+import litellm
+
+from app import node_runner_stream
+from app.dspy_streaming import example_row, tag_rows
+
+QUESTIONS = ["paris?", "bad", "rome?", "oslo?"]
+
+PAYLOAD = {
+    "node_kind": "predict",
+    "node_title": "QA",
+    "inputs_schema": [{"name": "question", "type": "string"}],
+    "outputs_schema": [{"name": "answer", "type": "string"}],
+    "inputs_values": {"question": "unused"},
+    "model": "openai/gpt-4o-mini",
+    "lm_params": {"cache": False},
+    "examples": [{"question": q} for q in QUESTIONS],
+    "num_threads": 4,
+}
+
+
+def test_tag_rows_only_tags_events_from_an_example_thread():
+    events = []
+    emit = tag_rows(events.append)
+    emit({"event": "run_start"})
+    with example_row(2):
+        emit({"event": "lm_start"})
+        # Other threads are not running this example
+        t = threading.Thread(target=emit, args=({"event": "other"},))
+        t.start()
+        t.join()
+    emit({"event": "run_end"})
+    assert [ev.get("row") for ev in events] == [None, 2, None, None]
+
+
+def test_example_events_and_results_carry_their_row(monkeypatch):
+    def completion(**request):
+        question = request["messages"][-1]["content"].split("[[ ## question ## ]]\n")[1].split("\n")[0]
+        if question == "bad":
+            raise ValueError("provider rejected the request")
+        content = f"[[ ## answer ## ]]\n{question.upper()}\n\n[[ ## completed ## ]]"
+        return litellm.ModelResponse(choices=[{"message": {"role": "assistant", "content": content}}], model="gpt-4o-mini")
+
+    monkeypatch.setattr(litellm, "completion", completion)
+    events = []
+    assert node_runner_stream.run_stream(dict(PAYLOAD), emit=events.append) == 0
+
+    starts = [ev for ev in events if ev["event"] == "module_start"]
+    assert sorted(ev["row"] for ev in starts) == [0, 1, 2, 3]
+    assert all(ev["inputs"]["kwargs"]["question"] == QUESTIONS[ev["row"]] for ev in starts)
+    assert {ev["row"] for ev in events if ev["event"] == "lm_start"} == {0, 1, 2, 3}
+    assert sorted(ev["row"] for ev in events if ev["event"] == "example_end") == [0, 1, 2, 3]
+    assert "row" not in events[0] and "row" not in events[-1]
+
+    result = next(ev for ev in events if ev["event"] == "result")
+    rows = result["examples"]
+    assert [r["row"] for r in rows] == [0, 1, 2, 3]
+    assert [r["outputs"] and r["outputs"]["answer"] for r in rows] == ["PARIS?", None, "ROME?", "OSLO?"]
+    # One failing example is reported on its row and does not fail the others
+    assert result["failed"] == 1
+    assert "provider rejected" in rows[1]["error"]
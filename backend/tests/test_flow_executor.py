@@ -0,0 +1,145 @@
+import asyncio
+import json
+
+import pytest
+
+from app import flow_executor
+from app.flow_executor import FlowGraph, FlowGraphError, execute_flow
+
+
+def _compute(nid, inputs=("question",), llm=None):
+    return {
+        "id": nid,
+        "data": {
+            "kind": "predict",
+            "title": nid.upper(),
+            "inputs": [{"id": f"{nid}-{name}", "name": name, "type": "string"} for name in inputs]
+            + ([{"id": f"{nid}-model", "name": "model", "type": "llm"}] if llm else []),
+            "outputs": [{"id": f"{nid}-answer", "name": "answer", "type": "string"}],
+            **({"llm": llm} if llm else {}),
+        },
+    }
+
+
+def _edge(src, src_port, dst, dst_port):
+    return {"id": f"{src}-{dst}-{dst_port}", "source": src, "sourceHandle": f"out-{src_port}", "target": dst, "targetHandle": f"in-{dst_port}"}
+
+
+def _state():
+    """in -> a -> (b, c) -> out"""
+    nodes = [
+        {"id": "in", "data": {"kind": "input", "outputs": [{"id": "q", "name": "question"}], "values": {"question": "hi"}}},
+        _compute("a", llm={"model": "openai/gpt-4o-mini", "temperature": 0.3}),
+        _compute("b"),
+        _compute("c"),
+        {"id": "out", "data": {"kind": "output", "inputs": [{"id": "x", "name": "x"}, {"id": "y", "name": "y"}]}},
+    ]
+    edges = [
+        _edge("in", "q", "a", "a-question"),
+        _edge("a", "a-answer", "b", "b-question"),
+        _edge("a", "a-answer", "c", "c-question"),
+        _edge("b", "b-answer", "out", "x"),
+        _edge("c", "c-answer", "out", "y"),
+    ]
+    return {"nodes": nodes, "edges": edges}
+
+
+def test_toposort_puts_dependencies_first_and_rejects_cycles():
+    graph = FlowGraph(_state())
+    order = graph.toposort(graph.select())
+    assert sorted(order) == ["a", "b", "c"]
+    assert order[0] == "a"
+    assert graph.select(["b"]) == {"a", "b"}
+
+    state = _state()
+    state["edges"].append(_edge("b", "b-answer", "a", "a-question"))
+    state["edges"] = [e for e in state["edges"] if e["source"] != "in"]
+    graph = FlowGraph(state)
+    with pytest.raises(FlowGraphError, match="cycle"):
+        graph.toposort(graph.select())
+
+
+def test_build_payload_resolves_inputs_model_and_overrides():
+    graph = FlowGraph(_state(), inputs={"question": "from the dataset"})
+    payload = graph.build_payload("a", {})
+    assert payload["inputs_values"] == {"question": "from the dataset"}
+    assert payload["model"] == "openai/gpt-4o-mini"
+    assert payload["lm_params"] == {"temperature": 0.3}
+    assert payload["tools_code"] is None
+
+    assert graph.build_payload("b", {"a": {"answer": "42"}})["inputs_values"] == {"question": "42"}
+    with pytest.raises(FlowGraphError, match="not available"):
+        graph.build_payload("b", {})
+
+
+def _fake_nodes(monkeypatch, behaviour):
+    """Stub node runs: each node id maps to "ok", "error" or "hang"."""
+    started = []
+
+    async def memoized_stream(flow_id, payload, *, budget=None, flow_run_id=None):
+        nid = payload["node_id"]
+        started.append(nid)
+        kind = behaviour.get(nid, "ok")
+        yield (json.dumps({"event": "run_start"}) + "\n").encode()
+        if kind == "hang":
+            await asyncio.Event().wait()
+        if kind == "error":
+            yield (json.dumps({"event": "error", "message": "boom"}) + "\n").encode()
+            return
+        yield (json.dumps({"event": "result", "outputs": {"answer": f"{nid}!"}}) + "\n").encode()
+
+    monkeypatch.setattr(flow_executor.node_cache, "memoized_stream", memoized_stream)
+    return started
+
+
+async def _collect(stream):
+    return [json.loads(line) async for line in stream]
+
+
+def test_all_nodes_done(sqlite_db, monkeypatch):
+    _fake_nodes(monkeypatch, {})
+    events = asyncio.run(_collect(execute_flow("f", _state())))
+    end = events[-1]
+    assert end["event"] == "flow_end" and end["status"] == "done"
+    assert (end["completed"], end["failed"], end["skipped"]) == (3, 0, 0)
+    assert end["outputs"] == {"out": {"x": "b!", "y": "c!"}}
+
+
+def test_failure_skips_downstream_nodes(sqlite_db, monkeypatch):
+    started = _fake_nodes(monkeypatch, {"a": "error"})
+    events = asyncio.run(_collect(execute_flow("f", _state())))
+    assert started == ["a"]
+    assert sorted(ev["node_id"] for ev in events if ev["event"] == "node_skipped") == ["b", "c"]
+    end = events[-1]
+    assert end["status"] == "error"
+    assert (end["completed"], end["failed"], end["skipped"]) == (0, 1, 2)
+
+
+def test_nodes_stopped_in_flight_by_a_timeout_are_skipped_not_failed(sqlite_db, monkeypatch):
+    _fake_nodes(monkeypatch, {"b": "hang", "c": "hang"})
+    events = asyncio.run(_collect(execute_flow("f", _state(), timeout=0.3)))
+    end = events[-1]
+    assert end["status"] == "timeout" and end["reason"] == "wall_clock"
+    assert (end["completed"], end["failed"], end["skipped"]) == (1, 0, 2)
+
+
+def test_cancelled_flow_run_counts_running_nodes_as_skipped(sqlite_db, monkeypatch):
+    _fake_nodes(monkeypatch, {"b": "hang", "c": "hang"})
+
+    async def main():
+        run_id = "fr-cancel"
+        stream = execute_flow("f", _state(), flow_run_id=run_id, concurrency=1)
+        events = []
+        async for line in stream:
+            ev = json.loads(line)
+            events.append(ev)
+            if ev["event"] == "run_start" and ev["node_id"] != "a":
+                # One of b/c is in flight, the other waits for the slot
+                await asyncio.sleep(0.05)
+                assert flow_executor.cancel_flow_run(run_id)
+        return events
+
+    events = asyncio.run(main())
+    end = events[-1]
+    assert end["status"] == "cancelled"
+    assert (end["completed"], end["failed"], end["skipped"]) == (1, 0, 2)
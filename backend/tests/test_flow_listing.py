@@ -0,0 +1,77 @@
+import pytest
+
+from app import flow_store
+from app.db import get_connection
+
+
+def _walk(limit, **kw):
+    seen, cursor = [], None
+    while True:
+        rows, cursor = flow_store.list_flows(limit=limit, cursor=cursor, **kw)
+        seen.extend(r["id"] for r in rows)
+        if cursor is None:
+            return seen
+
+
+def test_keyset_pages_cover_equal_timestamps(sqlite_db):
+    ids = [flow_store.create_flow(f"flow {i}")["id"] for i in range(7)]
+    with get_connection() as conn:
+        # Same created_at for a run of flows: the id breaks the tie
+        conn.execute("UPDATE flows SET created_at = '2026-01-01T00:00:00Z' WHERE id IN (?, ?, ?, ?)", ids[1:5])
+    everything, _ = flow_store.list_flows()
+    paged = _walk(3)
+    assert paged == [r["id"] for r in everything]
+    assert sorted(paged) == sorted(ids)
+    ties = [i for i in paged if i in ids[1:5]]
+    assert ties == sorted(ids[1:5], reverse=True)
+
+
+def test_last_page_has_no_cursor(sqlite_db):
+    for i in range(4):
+        flow_store.create_flow(f"f{i}")
+    rows, cursor = flow_store.list_flows(limit=4)
+    assert len(rows) == 4 and cursor is None
+    rows, cursor = flow_store.list_flows(limit=3)
+    assert len(rows) == 3 and cursor is not None
+
+
+def test_cursor_round_trip_and_garbage():
+    assert flow_store.decode_cursor(flow_store.encode_cursor("2026-01-01T00:00:00Z", "abc")) == ("2026-01-01T00:00:00Z", "abc")
+    with pytest.raises(flow_store.CursorError):
+        flow_store.decode_cursor("not-a-cursor!")
+
+
+def test_name_search_uses_fts_prefixes(sqlite_db):
+    flow_store.create_flow("Customer support triage")
+    flow_store.create_flow("Invoice parser")
+    renamed = flow_store.create_flow("Draft")
+    flow_store.rename_flow(renamed["id"], "Customer churn model")
+    names = lambda q: sorted(r["name"] for r in flow_store.list_flows(q=q)[0])
+    assert names("cust") == ["Customer churn model", "Customer support triage"]
+    assert names("cust supp") == ["Customer support triage"]
+    # FTS syntax characters are taken literally
+    assert names('"invoice" OR') == []
+    assert names("draft") == []
+
+
+@pytest.mark.parametrize("q,expected", [("port", ["Customer support"]), ("100%", ["100% done"]), ("a_b", ["a_b"]), ("%", ["100% done"])])
+def test_like_fallback_without_fts(sqlite_db, monkeypatch, q, expected):
+    for name in ("Customer support", "100% done", "a_b", "axb"):
+        flow_store.create_flow(name)
+    monkeypatch.setattr(flow_store, "_fts", False)
+    assert [r["name"] for r in flow_store.list_flows(q=q)[0]] == expected
+
+
+def test_query_without_words_falls_back_to_like(sqlite_db):
+    flow_store.create_flow("C++ agent")
+    flow_store.create_flow("Plain")
+    assert [r["name"] for r in flow_store.list_flows(q="++")[0]] == ["C++ agent"]
+
+
+def test_summaries_carry_node_counts(sqlite_db):
+    fid = flow_store.create_flow("with nodes")["id"]
+    flow_store.create_flow("empty")
+    flow_store.put_state(fid, {"nodes": [{"id": "a"}, {"id": "b"}], "edges": []})
+    rows, _ = flow_store.list_summaries(limit=10)
+    counts = {r["name"]: r["node_count"] for r in rows}
+    assert counts == {"with nodes": 2, "empty": 0}
@@ -0,0 +1,126 @@
+import litellm
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import flow_store, lm_usage, node_runner, run_log
+from routes import flows
+
+ANSWER = "[[ ## answer ## ]]\nParis\n\n[[ ## completed ## ]]"
+
+PAYLOAD = {
+    "node_id": "n1",
+    "node_kind": "predict",
+    "node_title": "QA",
+    "inputs_schema": [{"name": "question", "type": "string"}],
+    "outputs_schema": [{"name": "answer", "type": "string"}],
+    "inputs_values": {"question": "Capital of France?"},
+    "model": "openai/gpt-4o-mini",
+    "lm_params": {"cache": False},
+    "use_cache": False,
+}
+
+
+def test_price_lookup_falls_back_to_bare_and_prefix_names(monkeypatch):
+    monkeypatch.setattr(lm_usage, "_prices", {"gpt-4o": {"input": 2.5, "output": 10}, "gpt-4o-mini": {"input": 0.15, "output": 0.6}})
+    assert lm_usage.price_for("openai/gpt-4o-mini") == {"input": 0.15, "output": 0.6}
+    # Dated versions use the longest matching prefix
+    assert lm_usage.price_for("openai/gpt-4o-mini-2024-07-18")["input"] == 0.15
+    assert lm_usage.price_for("azure/gpt-4o-2024-08-06")["input"] == 2.5
+    assert lm_usage.price_for("mistral/large") is None
+    assert lm_usage.cost("gpt-4o", 1_000_000, 100_000) == 3.5
+    assert lm_usage.cost("mistral/large", 10, 10) is None
+
+
+def test_token_budget_and_totals():
+    budget = lm_usage.TokenBudget(100)
+    assert not budget.add({"total_tokens": 60})
+    assert not budget.add(None)
+    assert budget.add({"total_tokens": 41})
+    assert lm_usage.TokenBudget(None).add({"total_tokens": 10**9}) is False
+
+    total = lm_usage.total([
+        {"prompt_tokens": 10, "completion_tokens": 2, "cost_usd": None},
+        None,
+        {"prompt_tokens": 5, "completion_tokens": 1, "cost_usd": 0.5},
+    ])
+    assert total == {"prompt_tokens": 15, "completion_tokens": 3, "total_tokens": 18, "cost_usd": 0.5}
+    assert lm_usage.total([])["cost_usd"] is None
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    calls = []
+
+    def completion(**request):
+        calls.append(request)
+        return litellm.ModelResponse(
+            choices=[{"message": {"role": "assistant", "content": ANSWER}}],
+            usage={"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+            model="gpt-4o-mini",
+        )
+
+    monkeypatch.setattr(litellm, "completion", completion)
+    return calls
+
+
+def test_one_shot_run_returns_usage_per_call_and_summed(provider):
+    data = node_runner.run(dict(PAYLOAD, examples=[{"question": "a"}, {"question": "b"}]))
+    assert [r["outputs"] for r in data["examples"]] == [{"answer": "Paris"}] * 2
+    ends = [ev for ev in data["lm_events"] if ev["event"] == "lm_end"]
+    starts = [ev for ev in data["lm_events"] if ev["event"] == "lm_start"]
+    assert len(ends) == len(starts) == 2
+    assert {ev["call_id"] for ev in ends} == {ev["call_id"] for ev in starts}
+    assert all(ev["usage"]["total_tokens"] == 120 for ev in ends)
+    assert data["usage"]["total_tokens"] == 240
+    assert data["usage"]["cost_usd"] == pytest.approx(2 * (100 * 0.15 + 20 * 0.6) / 1e6)
+
+
+class _Pool:
+    def __init__(self, data):
+        self.data = data
+
+    async def run(self, payload, **kwargs):
+        return node_runner.run(payload) if self.data is None else self.data
+
+
+def _client(monkeypatch, data=None):
+    monkeypatch.setattr(flows, "get_pool", lambda: _Pool(data))
+    app = FastAPI()
+    app.include_router(flows.router, prefix="/api/flows")
+    return TestClient(app)
+
+
+def test_run_node_records_and_returns_usage(sqlite_db, provider, monkeypatch):
+    flow_id = flow_store.create_flow("usage")["id"]
+    r = _client(monkeypatch).post(f"/api/flows/{flow_id}/run/node", json=PAYLOAD)
+    assert r.status_code == 200
+    body = r.json()
+    assert body["outputs"] == {"answer": "Paris"}
+    assert body["usage"]["total_tokens"] == 120
+    assert "lm_events" not in body
+
+    run_log.shutdown()
+    (run,) = run_log.recent_runs(flow_id)
+    assert run["status"] == "done"
+    assert (run["lm_calls"], run["prompt_tokens"], run["completion_tokens"]) == (1, 100, 20)
+    assert run["cost_usd"] == pytest.approx(body["usage"]["cost_usd"])
+    assert [u["total_tokens"] for u in run_log.usage(flow_id=flow_id)] == [120]
+
+
+def test_run_node_over_budget_is_refused_and_not_memoized(sqlite_db, provider, monkeypatch):
+    flow_id = flow_store.create_flow("budget")["id"]
+    flow_store.set_token_budget(flow_id, 50)
+    client = _client(monkeypatch)
+    r = client.post(f"/api/flows/{flow_id}/run/node", json=dict(PAYLOAD, use_cache=True))
+    assert r.status_code == 409
+    assert "Token budget exceeded (120 > 50" in r.json()["detail"]
+
+    run_log.shutdown()
+    (run,) = run_log.recent_runs(flow_id)
+    assert run["status"] == "error" and run["prompt_tokens"] == 100
+
+    # Nothing was memoized: the node runs (and is refused) again
+    r = client.post(f"/api/flows/{flow_id}/run/node", json=dict(PAYLOAD, use_cache=True))
+    assert r.status_code == 409
+    assert len(provider) == 2
@@ -0,0 +1,123 @@
+import io
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import flow_store
+from routes import flows
+
+
+def _export(fid):
+    lines = flow_store.export_ndjson(fid)
+    out = flow_store.ndjson_header()
+    while chunk := flow_store.next_chunk(lines, 2):
+        out += chunk
+    return out
+
+
+def _graph(n):
+    nodes = [{"id": f"n{i}", "data": {"kind": "predict", "title": f"N{i}", "runtime": {"x": 1}}} for i in range(n)]
+    edges = [{"id": f"e{i}", "source": f"n{i}", "target": f"n{i + 1}"} for i in range(n - 1)]
+    return {"nodes": nodes, "edges": edges, "viewport": {"zoom": 1}}
+
+
+def test_export_is_lazy_and_keeps_graph_order(sqlite_db):
+    fid = flow_store.create_flow("big")["id"]
+    flow_store.put_state(fid, _graph(5))
+    lines = flow_store.export_ndjson(fid)
+    assert not isinstance(lines, (list, tuple))
+    records = [json.loads(line) for line in flow_store.next_chunk(lines, 100).splitlines()]
+    assert [r["type"] for r in records] == ["flow", "meta"] + ["node"] * 5 + ["edge"] * 4
+    assert [r["node"]["id"] for r in records if r["type"] == "node"] == [f"n{i}" for i in range(5)]
+    assert flow_store.next_chunk(lines, 100) == b""
+    assert flow_store.export_ndjson("missing") is None
+
+
+def test_round_trip_remaps_ids_and_strips_runtime(sqlite_db):
+    fid = flow_store.create_flow("source")["id"]
+    parent = flow_store.create_schema(fid, "Parent", None, [{"name": "child", "type": "object", "objectSchemaId": "later"}])
+    flow_store.put_state(fid, _graph(3))
+
+    created = flow_store.import_ndjson(io.BytesIO(_export(fid)))
+    assert len(created) == 1 and created[0]["id"] != fid and created[0]["slug"] != "source"
+    state = flow_store.get_state(created[0]["id"])["data"]
+    assert [n["id"] for n in state["nodes"]] == ["n0", "n1", "n2"]
+    assert all("runtime" not in n["data"] for n in state["nodes"])
+    assert state["viewport"] == {"zoom": 1}
+    (schema,) = flow_store.list_schemas(created[0]["id"])
+    assert schema["id"] != parent["id"]
+    # Not part of the export: left as it was rather than pointed at a made-up id
+    assert schema["fields"][0]["objectSchemaId"] == "later"
+
+
+def test_references_between_exported_schemas_are_remapped(sqlite_db):
+    fid = flow_store.create_flow("nested")["id"]
+    child = flow_store.create_schema(fid, "Child", None, [{"name": "x", "type": "string"}])
+    flow_store.create_schema(fid, "Parent", None, [
+        {"name": "one", "type": "object", "objectSchemaId": child["id"]},
+        {"name": "many", "type": "array", "arrayItemSchemaId": child["id"]},
+    ])
+    # Put the parent first in the stream, before the schema it references
+    header, flow_line, child_line, parent_line, *rest = _export(fid).splitlines(keepends=True)
+    assert b'"Child"' in child_line
+    body = b"".join([header, flow_line, parent_line, child_line, *rest])
+
+    (flow,) = flow_store.import_ndjson(io.BytesIO(body))
+    by_name = {s["name"]: s for s in flow_store.list_schemas(flow["id"])}
+    new_child = by_name["Child"]["id"]
+    assert new_child != child["id"]
+    assert [f.get("objectSchemaId") or f.get("arrayItemSchemaId") for f in by_name["Parent"]["fields"]] == [new_child, new_child]
+
+
+def test_import_several_flows(sqlite_db):
+    a = flow_store.create_flow("a")["id"]
+    b = flow_store.create_flow("b")["id"]
+    flow_store.put_state(b, _graph(2))
+    body = _export(a) + _export(b).split(b"\n", 1)[1]
+    created = flow_store.import_ndjson(io.BytesIO(body))
+    assert [f["name"] for f in created] == ["a", "b"]
+    assert flow_store.get_state(created[1]["id"])["data"]["nodes"][1]["id"] == "n1"
+
+
+@pytest.mark.parametrize("tail,message", [
+    (b'{"type": "node", "node": {"id": "x"}}\nnot json\n', "Line 5"),
+    (b'{"type": "bogus"}\n', "Unknown record type"),
+    (b'{"type": "flow", "flow": {}}\n', "invalid record"),
+])
+def test_bad_line_rolls_back_the_whole_import(sqlite_db, tail, message):
+    fid = flow_store.create_flow("keep")["id"]
+    body = _export(fid) + b'{"type": "flow", "flow": {"name": "second"}}\n' + tail
+    before, _ = flow_store.list_flows()
+    with pytest.raises(flow_store.BundleError, match=message):
+        flow_store.import_ndjson(io.BytesIO(body))
+    after, _ = flow_store.list_flows()
+    assert [r["id"] for r in after] == [r["id"] for r in before]
+
+
+@pytest.mark.parametrize("body,message", [
+    (b'{"type": "flow", "flow": {"name": "x"}}\n', "Missing header"),
+    (b'{"type": "header", "format": "other", "version": 1}\n', "Unsupported export format"),
+    (flow_store.ndjson_header() + b'{"type": "node", "node": {}}\n', "before any flow"),
+])
+def test_malformed_streams(sqlite_db, body, message):
+    with pytest.raises(flow_store.BundleError, match=message):
+        flow_store.import_ndjson(io.BytesIO(body))
+
+
+def test_export_routes_stream_chunks(sqlite_db, monkeypatch):
+    monkeypatch.setattr(flows, "EXPORT_CHUNK_LINES", 3)
+    fid = flow_store.create_flow("routed")["id"]
+    flow_store.put_state(fid, _graph(10))
+    app = FastAPI()
+    app.include_router(flows.router, prefix="/api/flows")
+    client = TestClient(app)
+
+    one = client.get(f"/api/flows/{fid}/export.ndjson")
+    assert one.status_code == 200
+    types = [json.loads(line)["type"] for line in one.text.splitlines()]
+    assert types == ["header", "flow", "meta"] + ["node"] * 10 + ["edge"] * 9
+    bulk = client.get("/api/flows/export.ndjson", params={"ids": [fid, "missing"]})
+    assert bulk.text == one.text
+    assert client.get("/api/flows/missing/export.ndjson").status_code == 404
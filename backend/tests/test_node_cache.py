@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+from app import node_cache
+from app.lm_usage import TokenBudget
+from app.node_cache import node_key, wants_cache
+from app.runner_pool import RunnerTimeout
+
+PAYLOAD = {
+    "node_id": "n1",
+    "node_kind": "predict",
+    "node_title": "QA",
+    "inputs_schema": [{"name": "question", "type": "string"}],
+    "outputs_schema": [{"name": "answer", "type": "string"}],
+    "inputs_values": {"question": "Capital of France?"},
+    "model": "openai/gpt-4o-mini",
+    "lm_params": {"temperature": 0.0},
+}
+
+
+def test_node_key_covers_what_determines_the_result():
+    key = node_key(PAYLOAD)
+    # Ids and run settings do not change the result
+    assert node_key({**PAYLOAD, "node_id": "n2", "run_id": "r", "timeout_s": 5}) == key
+    # Dict order does not matter
+    assert node_key({**PAYLOAD, "lm_params": {"temperature": 0.0}}) == key
+    assert node_key({**PAYLOAD, "inputs_values": {"question": "Capital of Spain?"}}) != key
+    assert node_key({**PAYLOAD, "model": "openai/gpt-4o"}) != key
+    assert node_key({**PAYLOAD, "tools_code": ["def f(): pass"]}) != key
+
+
+def test_wants_cache_skips_opt_outs_and_multi_example_runs():
+    assert wants_cache(PAYLOAD)
+    assert not wants_cache({**PAYLOAD, "use_cache": False})
+    assert not wants_cache({**PAYLOAD, "examples": [{"question": "a"}]})
+
+
+def _line(obj):
+    return (json.dumps(obj) + "\n").encode()
+
+
+class _Pool:
+    """Stands in for the runner pool; `events` are streamed for every job."""
+
+    def __init__(self, events, error=None):
+        self.events = events
+        self.error = error
+        self.jobs = []
+
+    async def stream(self, payload, **kwargs):
+        self.jobs.append((payload, kwargs))
+        for ev in self.events:
+            yield _line(ev)
+        if self.error is not None:
+            raise self.error
+
+
+RESULT = [
+    {"event": "run_start"},
+    {"event": "lm_start", "call_id": "c1"},
+    {"event": "lm_end", "call_id": "c1", "usage": {"total_tokens": 120}},
+    {"event": "result", "outputs": {"answer": "Paris"}, "reasoning": None},
+    {"event": "run_end"},
+]
+
+
+def _run(payload, **kwargs):
+    async def main():
+        return [json.loads(line) async for line in node_cache.memoized_stream("f", payload, **kwargs)]
+
+    return asyncio.run(main())
+
+
+def test_result_is_memoized_and_replayed(sqlite_db, monkeypatch):
+    pool = _Pool(RESULT)
+    monkeypatch.setattr(node_cache, "get_pool", lambda: pool)
+
+    first = _run(dict(PAYLOAD))
+    assert [ev["event"] for ev in first] == [ev["event"] for ev in RESULT]
+    assert len(pool.jobs) == 1 and pool.jobs[0][1]["flow_key"] == "f"
+
+    replay = _run(dict(PAYLOAD, node_id="n2"))
+    assert len(pool.jobs) == 1
+    assert [ev["event"] for ev in replay] == ["run_start", "result", "run_end"]
+    assert all(ev["cached"] for ev in replay)
+    assert replay[1]["outputs"] == {"answer": "Paris"}
+    assert node_cache.stats()["hits"] == 1
+
+    # Opting out runs the node again
+    _run(dict(PAYLOAD, use_cache=False))
+    assert len(pool.jobs) == 2
+
+    assert node_cache.clear("f") == 1
+    _run(dict(PAYLOAD))
+    assert len(pool.jobs) == 3
+
+
+def test_budget_stops_the_run_before_the_result_is_memoized(sqlite_db, monkeypatch):
+    pool = _Pool(RESULT)
+    monkeypatch.setattr(node_cache, "get_pool", lambda: pool)
+
+    events = _run(dict(PAYLOAD), budget=TokenBudget(100))
+    assert events[-1]["event"] == "error" and events[-1]["reason"] == "token_budget"
+    assert "result" not in [ev["event"] for ev in events]
+    assert node_cache.lookup(node_key(PAYLOAD)) is None
+
+
+def test_timeout_ends_the_stream_with_a_timeout_event(sqlite_db, monkeypatch):
+    pool = _Pool(RESULT[:1], error=RunnerTimeout("Runner produced no output for 5s", reason="idle"))
+    monkeypatch.setattr(node_cache, "get_pool", lambda: pool)
+
+    events = _run(dict(PAYLOAD, run_id="r1", idle_timeout_s=5))
+    end = events[-1]
+    assert (end["event"], end["reason"], end["run_id"]) == ("timeout", "idle", "r1")
+    assert pool.jobs[0][1]["idle_timeout"] == 5
+    assert node_cache.lookup(node_key(PAYLOAD)) is None
@@ -0,0 +1,45 @@
+import base64
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import preview_store
+from routes import previews
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'
+
+
+def _client(tmp_path, monkeypatch):
+    monkeypatch.setattr(preview_store, "PREVIEW_DIR", tmp_path)
+    app = FastAPI()
+    app.include_router(previews.router, prefix="/api/previews")
+    return TestClient(app)
+
+
+def test_svg_preview_is_served_without_script_access(tmp_path, monkeypatch):
+    client = _client(tmp_path, monkeypatch)
+    mime, raw = preview_store.decode_data_url("data:image/svg+xml;base64," + base64.b64encode(SVG).decode())
+    ref = preview_store.put_blob(raw, mime)
+
+    r = client.get(f"/api/previews/{ref}")
+    assert r.status_code == 200 and r.content == SVG
+    assert r.headers["content-type"].startswith("image/svg+xml")
+    assert "default-src 'none'" in r.headers["content-security-policy"]
+    assert "sandbox" in r.headers["content-security-policy"]
+    assert r.headers["x-content-type-options"] == "nosniff"
+
+    again = client.get(f"/api/previews/{ref}", headers={"If-None-Match": r.headers["etag"]})
+    assert again.status_code == 304
+
+
+def test_concurrent_puts_of_the_same_image(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.setattr(preview_store, "PREVIEW_DIR", tmp_path)
+    raw = b"\x89PNG\r\n\x1a\n" + b"x" * 200_000
+    with ThreadPoolExecutor(8) as pool:
+        refs = set(pool.map(lambda _: preview_store.put_blob(raw, "image/png"), range(32)))
+    assert len(refs) == 1
+    (ref,) = refs
+    assert (tmp_path / ref).read_bytes() == raw
+    assert [p.name for p in tmp_path.iterdir()] == [ref]
@@ -0,0 +1,87 @@
+import pytest
+
+from app import rate_client, runner_core
+
+
+def test_user_num_retries_cannot_reenable_litellm_retries(channel):
+    lm = runner_core.get_lm("openai/gpt-4o-mini", {"num_retries": 5, "temperature": 0.2})
+    assert lm.num_retries == 0
+    assert lm.kwargs["temperature"] == 0.2
+
+
+def _acquires(sent):
+    return [m for m in sent if m.get("__rate__") == "acquire"]
+
+
+def test_unlimited_provider_skips_the_round_trip_until_a_429(channel):
+    sent, reply = channel
+    reply["unlimited"] = True
+    rate_client.acquire("openai/gpt-4o-mini", 10)
+    rate_client.acquire("openai/gpt-4o-mini", 10)
+    rate_client.report("openai/gpt-4o-mini", 10, 12, None)
+    assert len(_acquires(sent)) == 1
+    assert not [m for m in sent if m.get("__rate__") == "report"]
+
+    # Another model is not covered by the shortcut
+    rate_client.acquire("anthropic/claude", 10)
+    assert len(_acquires(sent)) == 2
+
+    # A 429 is always reported and ends the shortcut
+    reply["unlimited"] = False
+    rate_client.report("openai/gpt-4o-mini", 10, None, 429)
+    assert sent[-1]["status"] == 429
+    rate_client.acquire("openai/gpt-4o-mini", 10)
+    assert len(_acquires(sent)) == 3
+
+
+def test_limited_provider_goes_through_the_scheduler_every_time(channel):
+    sent, _ = channel
+    for _ in range(3):
+        rate_client.acquire("openai/gpt-4o-mini", 10)
+        rate_client.report("openai/gpt-4o-mini", 10, 12, None)
+    assert len(_acquires(sent)) == 3
+    assert len([m for m in sent if m.get("__rate__") == "report"]) == 3
+
+
+def test_retry_delay_is_jittered_and_capped(monkeypatch):
+    monkeypatch.setattr(rate_client, "RATE_LIMIT_RETRY_BASE", 0.5)
+    monkeypatch.setattr(rate_client, "RATE_LIMIT_RETRY_MAX", 4)
+    delays = [rate_client.retry_delay(a) for a in range(10) for _ in range(50)]
+    assert all(0 <= d <= 4 for d in delays)
+    assert len(set(delays)) > 1
+    assert max(rate_client.retry_delay(0) for _ in range(200)) <= 0.5
+
+
+class _ProviderDown(Exception):
+    status_code = 503
+
+
+class _RateLimited(Exception):
+    status_code = 429
+
+
+@pytest.mark.parametrize("exc,sleeps", [(_ProviderDown, 2), (_RateLimited, 0)])
+def test_cached_lm_backs_off_only_for_non_429_retries(channel, monkeypatch, exc, sleeps):
+    sent, _ = channel
+    monkeypatch.setattr(rate_client, "RATE_LIMIT_RETRIES", 2)
+    slept = []
+    monkeypatch.setattr(runner_core.time, "sleep", slept.append)
+
+    def fail(self, **kwargs):
+        raise exc("nope")
+
+    monkeypatch.setattr(runner_core.dspy.LM, "forward", fail)
+    lm = runner_core.get_lm("openai/gpt-4o-mini", {"cache": False})
+    with pytest.raises(exc):
+        lm._call("hi", None, {})
+    assert len(_acquires(sent)) == 3
+    assert len(slept) == sleeps
+
+
+def test_queue_wait_carries_the_job_run_id(channel):
+    sent, reply = channel
+    reply["wait_s"] = 1.25
+    rate_client.set_job({"run_id": "run-1", "node_id": "n1", "node_title": "Answer", "node_kind": "predict"})
+    assert rate_client.acquire("openai/gpt-4o-mini", 10) == 1.25
+    (wait,) = [m for m in sent if m.get("event") == "queue_wait"]
+    assert wait["run_id"] == "run-1" and wait["node"]["id"] == "n1" and wait["wait_ms"] == 1250
@@ -0,0 +1,95 @@
+from app import blob_store, run_log
+from app.run_log import RunRecorder
+
+PAYLOAD = {"node_id": "n1", "node_kind": "predict", "model": "openai/gpt-4o-mini"}
+DAY_MS = 86_400_000
+
+
+def _record(events, flow_id="f", run_id="r1", **close):
+    recorder = RunRecorder(flow_id, PAYLOAD)
+    for ev in events:
+        recorder.observe({"run_id": run_id, **ev})
+    recorder.close(**close)
+    run_log.shutdown()
+
+
+def test_recorder_pairs_starts_with_ends_and_sums_usage(sqlite_db, monkeypatch):
+    monkeypatch.setattr(run_log, "RUN_EVENTS_MAX_FIELD", 10)
+    usage = {"prompt_tokens": 100, "completion_tokens": 20, "cost_usd": 0.25}
+    _record([
+        {"event": "run_start", "ts": 1_000},
+        {"event": "lm_start", "ts": 1_000, "call_id": "c1", "model": "openai/gpt-4o"},
+        {"event": "lm_start", "ts": 1_100, "call_id": "c2", "model": "openai/gpt-4o-mini"},
+        # Ends arrive out of order; each is matched by call_id
+        {"event": "lm_end", "ts": 1_400, "call_id": "c2", "usage": usage},
+        {"event": "lm_end", "ts": 1_500, "call_id": "c1", "usage": usage, "response": "x" * 50},
+        {"event": "tool_start", "ts": 1_500, "call_id": "t1", "tool": "search"},
+        {"event": "tool_end", "ts": 1_530, "call_id": "t1", "error": "not found"},
+        {"event": "result", "ts": 1_600, "outputs": {"answer": "Paris"}},
+    ])
+
+    (run,) = run_log.recent_runs("f")
+    assert (run["status"], run["lm_calls"], run["prompt_tokens"], run["completion_tokens"]) == ("done", 2, 200, 40)
+    assert run["cost_usd"] == 0.5
+    assert run["ended_at"] is not None
+
+    rows = {(r["event"], r["call_id"]): r for r in run_log.run_events("r1")}
+    assert (rows["lm_end", "c1"]["duration_ms"], rows["lm_end", "c1"]["model"]) == (500, "openai/gpt-4o")
+    assert (rows["lm_end", "c2"]["duration_ms"], rows["lm_end", "c2"]["model"]) == (300, "openai/gpt-4o-mini")
+    assert (rows["tool_end", "t1"]["duration_ms"], rows["tool_end", "t1"]["error"]) == (30, "not found")
+    assert rows["lm_end", "c1"]["data"]["response"] == "x" * 10 + "... [40 more chars]"
+
+
+def test_unfinished_run_is_recorded_as_aborted(sqlite_db):
+    _record([{"event": "run_start"}, {"event": "lm_start", "call_id": "c1"}])
+    (run,) = run_log.recent_runs("f")
+    assert run["status"] == "aborted"
+
+    _record([{"event": "run_start"}, {"event": "timeout", "message": "idle"}], flow_id="g", run_id="r2")
+    (run,) = run_log.recent_runs("g")
+    assert (run["status"], run["error"]) == ("timeout", "idle")
+
+
+def test_writer_retries_a_failed_batch_row_by_row(sqlite_db):
+    writer = run_log._Writer()
+    good = RunRecorder("f", PAYLOAD)
+    good.run_id = "r1"
+    bad_event = ("r1", "f", "n1", "lm_end")  # too few columns
+    flow_run = ("fr1", "f", "done", 0, None, None, 1, 0, 0, None, None, None)
+    writer._write([("run", good._run_row()), ("event", bad_event), ("flow_run", flow_run)])
+
+    assert (writer.written, writer.dropped, writer.batches) == (2, 1, 0)
+    assert [r["run_id"] for r in run_log.recent_runs("f")] == ["r1"]
+    assert [r["flow_run_id"] for r in run_log.recent_flow_runs("f")] == ["fr1"]
+
+
+def test_compact_slims_then_deletes_old_history(sqlite_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "BLOB_DIR", tmp_path / "blobs")
+    monkeypatch.setattr(run_log, "RUN_EVENTS_DETAIL_DAYS", 3)
+    monkeypatch.setattr(run_log, "RUN_EVENTS_RETENTION_DAYS", 30)
+    recorder = RunRecorder("f", PAYLOAD)
+    recorder.started_at = 0
+    for ev in (
+        {"event": "run_start", "ts": 1},
+        {"event": "lm_start", "ts": 2, "call_id": "c1", "prompt": "hi"},
+        {"event": "lm_end", "ts": 3, "call_id": "c1", "response": "hello"},
+        {"event": "result", "ts": 4, "outputs": {"answer": "hello"}},
+    ):
+        recorder.observe({"run_id": "r1", **ev})
+    recorder.close()
+    run_log.shutdown()
+
+    # Inside the detail window nothing changes
+    assert run_log.compact(now_ms=DAY_MS) == {"deleted": 0, "deleted_runs": 0, "slimmed": 0, "blobs": 0}
+
+    counts = run_log.compact(now_ms=5 * DAY_MS)
+    assert (counts["deleted"], counts["slimmed"], counts["deleted_runs"]) == (1, 3, 0)
+    events = run_log.run_events("r1")
+    assert [e["event"] for e in events] == ["run_start", "lm_end", "result"]
+    assert all(e["data"] is None for e in events)
+    # Aggregates still see the kept lm_end
+    assert run_log.slowest_lm_calls(since_hours=10**6, limit=5)[0]["duration_ms"] == 1
+
+    counts = run_log.compact(now_ms=31 * DAY_MS)
+    assert (counts["deleted"], counts["deleted_runs"]) == (3, 1)
+    assert run_log.run_events("r1") is None
@@ -0,0 +1,134 @@
+import asyncio
+import json
+
+import pytest
+
+from app import run_streams
+
+
+def _line(obj):
+    return (json.dumps(obj) + "\n").encode("utf-8")
+
+
+async def _collect(stream, offset=0):
+    return [json.loads(line) async for _, line in stream.attach(offset)]
+
+
+def test_replay_assigns_contiguous_seqs():
+    async def main():
+        stream = run_streams.RunStream("r", "node")
+        for i in range(5):
+            await stream.append(_line({"event": "row", "row": i}))
+        await stream.finish()
+        return await _collect(stream, 2)
+
+    assert [e["seq"] for e in asyncio.run(main())] == [2, 3, 4]
+
+
+def test_evicted_rows_are_kept_for_a_lagging_client(monkeypatch):
+    monkeypatch.setattr(run_streams, "RUN_STREAM_BUFFER", 100)
+
+    async def main():
+        stream = run_streams.RunStream("b", "batch")
+        await stream.append(_line({"event": "batch_start"}))
+        reader = stream.attach(0)
+        # Attached but not reading yet
+        first = await anext(reader)
+        for i in range(300):
+            await stream.append(_line({"event": "batch_progress", "done": i}))
+            await stream.append(_line({"event": "row", "row": i}))
+        await stream.append(_line({"event": "batch_end"}))
+        await stream.finish()
+        return [first[1]] + [line async for _, line in reader], stream
+
+    lines, stream = asyncio.run(main())
+    events = [json.loads(line) for line in lines]
+    rows = [e["row"] for e in events if e["event"] == "row"]
+    assert rows == list(range(300))
+    assert events[-1]["event"] == "batch_end"
+    gaps = [e for e in events if e["event"] == "replay_gap"]
+    assert gaps and all(e["missed"] > 0 for e in gaps)
+    # Only progress lines were lost
+    assert sum(e["missed"] for e in gaps) + len(events) - len(gaps) == 602
+    # Nobody is attached any more: the side list is back under the cap
+    assert len(stream.kept) <= 100
+
+
+def test_kept_lines_are_trimmed_without_subscribers(monkeypatch):
+    monkeypatch.setattr(run_streams, "RUN_STREAM_BUFFER", 10)
+
+    async def main():
+        stream = run_streams.RunStream("b", "batch")
+        for i in range(50):
+            await stream.append(_line({"event": "row", "row": i}))
+        await stream.finish()
+        return stream
+
+    stream = asyncio.run(main())
+    assert len(stream.lines) == 10 and len(stream.kept) == 10
+
+
+def test_lagging_client_gets_tokens_merged(monkeypatch):
+    monkeypatch.setattr(run_streams, "RUN_STREAM_SLOW_LAG", 5)
+
+    async def main():
+        stream = run_streams.RunStream("r", "node")
+        await stream.append(_line({"event": "run_start"}))
+        reader = stream.attach(0)
+        await anext(reader)
+        await stream.append(_line({"event": "lm_start"}))
+        for i in range(20):
+            await stream.append(_line({"event": "token", "field": "answer", "chunk": f"{i} ", "chunks": 1, "last": False}))
+        await stream.append(_line({"event": "lm_end"}))
+        await stream.append(_line({"event": "result", "outputs": {"answer": "done"}}))
+        # Still live, so the backlog is coalesced rather than replayed
+        events = []
+        async for _, line in reader:
+            events.append(json.loads(line))
+            if events[-1]["event"] == "result":
+                break
+        await stream.finish()
+        return events
+
+    events = asyncio.run(main())
+    kinds = [e["event"] for e in events]
+    assert "coalesced" in kinds and kinds[-1] == "result"
+    text = "".join(e["chunk"] for e in events if e["event"] == "token")
+    assert text == "".join(f"{i} " for i in range(20))
+    summary = next(e for e in events if e["event"] == "coalesced")
+    assert summary["events"]["lm_start"] == 1
+
+
+def test_finished_run_replays_without_coalescing(monkeypatch):
+    monkeypatch.setattr(run_streams, "RUN_STREAM_SLOW_LAG", 2)
+
+    async def main():
+        stream = run_streams.RunStream("r", "node")
+        for _ in range(10):
+            await stream.append(_line({"event": "lm_start"}))
+        await stream.finish()
+        return await _collect(stream)
+
+    assert [e["event"] for e in asyncio.run(main())] == ["lm_start"] * 10
+
+
+@pytest.mark.parametrize("line,kind", [(b'{"event": "token", "x": 1}\n', "token"), (b'{"x": 1}\n', None)])
+def test_kind(line, kind):
+    assert run_streams._kind(line) == kind
+
+
+def test_failing_source_ends_with_error_line():
+    async def main():
+        async def source():
+            yield _line({"event": "run_start"})
+            raise RuntimeError("worker pipe closed")
+
+        stream = run_streams.start("broken", "node", source())
+        events = await _collect(stream)
+        await run_streams.close()
+        return events, stream
+
+    events, stream = asyncio.run(main())
+    assert [e["event"] for e in events] == ["run_start", "error"]
+    assert "worker pipe closed" in events[-1]["message"]
+    assert stream.done and stream.task.exception() is None
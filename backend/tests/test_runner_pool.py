@@ -0,0 +1,267 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pytest
+
+from app import runner_pool
+from app.runner_pool import RunnerCancelled, RunnerError, RunnerPool, RunnerTimeout
+
+# Speaks the worker protocol without importing dspy; `payload["do"]` picks the behaviour
+STUB_WORKER = r'''
+import json, os, subprocess, sys, time
+
+def send(msg):
+    sys.stdout.write(json.dumps(msg) + "\n")
+    sys.stdout.flush()
+
+send({"__worker__": "ready", "pid": os.getpid(), "import_ms": 1})
+for line in sys.stdin:
+    job = json.loads(line)
+    payload = job["payload"]
+    do = payload.get("do", "echo")
+    if do == "crash":
+        sys.stderr.write("stub worker crashed\n")
+        sys.exit(3)
+    if do == "hang":
+        time.sleep(60)
+    if do == "idle":
+        send({"event": "run_start"})
+        time.sleep(60)
+    if do == "spawn":
+        sleep = [sys.executable, "-c", "import time; time.sleep(60)"]
+        group = subprocess.Popen(sleep)
+        session = subprocess.Popen(sleep, start_new_session=True)
+        send({"event": "children", "pids": [group.pid, session.pid]})
+        time.sleep(60)
+    if do == "rate":
+        send({"__rate__": "acquire", "id": 7, "model": "openai/gpt-4o-mini", "tokens": 42})
+        grant = json.loads(sys.stdin.readline())
+        send({"__rate__": "report", "model": "openai/gpt-4o-mini", "estimated": 42, "used": 40, "status": 200})
+        send({"event": "granted", **grant})
+    send({"event": "result", "pid": os.getpid(), "mode": job["mode"]})
+    send({"__worker__": "job_end", "ms": 1, "rss_kb": payload.get("rss_kb", 1024), "caches": {}})
+'''
+
+
+@pytest.fixture
+def stub_command(tmp_path):
+    script = tmp_path / "stub_worker.py"
+    script.write_text(STUB_WORKER)
+    return (sys.executable, str(script))
+
+
+def _pool(command, **kwargs):
+    kwargs.setdefault("size", 1)
+    return RunnerPool(command=command, **kwargs)
+
+
+async def _events(pool, payload, **kwargs):
+    return [json.loads(line) async for line in pool.stream(payload, **kwargs)]
+
+
+def test_workers_are_reused_then_recycled_after_max_jobs(stub_command):
+    async def main():
+        pool = _pool(stub_command, max_jobs=2)
+        try:
+            pids = [(await _events(pool, {}))[-1]["pid"] for _ in range(3)]
+            return pids, pool.stats()
+        finally:
+            await pool.close()
+
+    pids, stats = asyncio.run(main())
+    assert pids[0] == pids[1] != pids[2]
+    assert stats["jobs_total"] == 3 and stats["recycled"] == 1
+    assert stats["workers"][0]["jobs"] == 1
+
+
+def test_worker_over_the_memory_limit_is_recycled(stub_command):
+    async def main():
+        pool = _pool(stub_command, max_rss_mb=1)
+        try:
+            first = (await _events(pool, {"rss_kb": 4096}))[-1]["pid"]
+            second = (await _events(pool, {}))[-1]["pid"]
+            return first, second
+        finally:
+            await pool.close()
+
+    first, second = asyncio.run(main())
+    assert first != second
+
+
+def test_control_lines_end_the_job_and_run_returns_the_last_line(stub_command):
+    async def main():
+        pool = _pool(stub_command)
+        try:
+            events = await _events(pool, {})
+            result = await pool.run({})
+            return events, result
+        finally:
+            await pool.close()
+
+    events, result = asyncio.run(main())
+    assert [ev["event"] for ev in events] == ["result"]
+    assert result["mode"] == "run"
+
+
+class _Limiter:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.acquired = []
+        self.reported = []
+
+    async def acquire(self, model, flow_key, tokens):
+        self.acquired.append((model, flow_key, tokens))
+        await asyncio.sleep(self.delay)
+        return self.delay
+
+    def report(self, model, estimated, used, status):
+        self.reported.append((model, estimated, used, status))
+
+    def unlimited(self, model):
+        return False
+
+
+def test_rate_requests_are_granted_through_the_shared_limiter(stub_command, monkeypatch):
+    limiter = _Limiter()
+    monkeypatch.setattr(runner_pool, "get_limiter", lambda: limiter)
+
+    async def main():
+        pool = _pool(stub_command)
+        try:
+            return await _events(pool, {"do": "rate"}, flow_key="flow-1")
+        finally:
+            await pool.close()
+
+    events = asyncio.run(main())
+    # Rate lines are answered by the pool, never yielded to the consumer
+    assert [ev["event"] for ev in events] == ["granted", "result"]
+    grant = events[0]
+    assert (grant["__rate__"], grant["id"], grant["provider"], grant["unlimited"]) == ("grant", 7, "openai", False)
+    assert limiter.acquired == [("openai/gpt-4o-mini", "flow-1", 42)]
+    assert limiter.reported == [("openai/gpt-4o-mini", 42, 40, 200)]
+
+
+def test_crashed_worker_fails_the_job_and_is_respawned(stub_command):
+    async def main():
+        pool = _pool(stub_command)
+        try:
+            before = (await _events(pool, {}))[-1]["pid"]
+            with pytest.raises(RunnerError, match="exited unexpectedly"):
+                await _events(pool, {"do": "crash"})
+            after = (await _events(pool, {}))[-1]["pid"]
+            return before, after, pool.stats()
+        finally:
+            await pool.close()
+
+    before, after, stats = asyncio.run(main())
+    assert before != after
+    assert stats["recycled"] == 1 and stats["workers"][0]["alive"]
+
+
+def test_wall_clock_and_idle_timeouts_kill_the_worker(stub_command):
+    async def main():
+        pool = _pool(stub_command, idle_timeout=0)
+        try:
+            with pytest.raises(RunnerTimeout) as wall:
+                await _events(pool, {"do": "hang"}, timeout=0.3)
+            with pytest.raises(RunnerTimeout) as idle:
+                await _events(pool, {"do": "idle"}, timeout=10, idle_timeout=0.3)
+            # The pool recovers with a fresh worker
+            result = (await _events(pool, {}))[-1]
+            return wall.value, idle.value, result, pool.stats()
+        finally:
+            await pool.close()
+
+    wall, idle, result, stats = asyncio.run(main())
+    assert wall.reason == "wall_clock"
+    assert idle.reason == "idle"
+    assert result["event"] == "result"
+    assert stats["timeouts"] == 2 and stats["recycled"] == 2
+
+
+def _gone(pid, wait=5.0):
+    """True once `pid` has exited (a zombie awaiting its new parent counts)."""
+    end = time.monotonic() + wait
+    while time.monotonic() < end:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                if f.read().rsplit(")", 1)[1].split()[0] == "Z":
+                    return True
+        except FileNotFoundError:
+            return True
+        except OSError:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return True
+        time.sleep(0.05)
+    return False
+
+
+def test_cancel_kills_the_worker_and_every_child_process(stub_command):
+    async def main():
+        pool = _pool(stub_command)
+        try:
+            stream = pool.stream({"do": "spawn"}, run_id="r-cancel")
+            children = json.loads(await stream.__anext__())["pids"]
+            assert pool.running() == ["r-cancel"]
+            assert pool.cancel("r-cancel")
+            assert not pool.cancel("r-cancel")
+            with pytest.raises(RunnerCancelled):
+                await stream.__anext__()
+            result = (await _events(pool, {}))[-1]
+            return children, result, pool.stats()
+        finally:
+            await pool.close()
+
+    children, result, stats = asyncio.run(main())
+    # Both the child in the worker's process group and the one that called setsid
+    assert all(_gone(pid) for pid in children)
+    assert result["event"] == "result"
+    assert stats["cancelled"] == 1 and stats["running"] == 0
+
+
+def test_cancel_before_a_worker_is_free_never_runs_the_job(stub_command):
+    async def main():
+        pool = _pool(stub_command)
+        try:
+            busy = asyncio.create_task(_events(pool, {"do": "hang"}, timeout=0.5))
+            await asyncio.sleep(0.1)
+            queued = asyncio.create_task(_events(pool, {}, run_id="r-queued"))
+            await asyncio.sleep(0.1)
+            assert pool.cancel("r-queued")
+            with pytest.raises(RunnerCancelled):
+                await queued
+            with pytest.raises(RunnerTimeout):
+                await busy
+            return pool.stats()
+        finally:
+            await pool.close()
+
+    stats = asyncio.run(main())
+    # Only the hung job was started; the cancelled one released its worker unused
+    assert stats["jobs_total"] == 1 and stats["recycled"] == 1
+
+
+def test_idle_timer_pauses_while_a_rate_grant_is_pending(stub_command, monkeypatch):
+    limiter = _Limiter(delay=0.6)
+    monkeypatch.setattr(runner_pool, "get_limiter", lambda: limiter)
+
+    async def main():
+        pool = _pool(stub_command)
+        try:
+            events = await _events(pool, {"do": "rate"}, idle_timeout=0.2)
+            # The wall-clock budget still applies to a job stuck behind the limiter
+            with pytest.raises(RunnerTimeout) as wall:
+                await _events(pool, {"do": "rate"}, timeout=0.3, idle_timeout=0.2)
+            return events, wall.value
+        finally:
+            await pool.close()
+
+    events, wall = asyncio.run(main())
+    assert [ev["event"] for ev in events] == ["granted", "result"]
+    assert events[0]["wait_s"] == 0.6
+    assert wall.reason == "wall_clock"
@@ -0,0 +1,120 @@
+import pytest
+
+from app import flow_store
+from app.state_patch import PatchError, apply_json_patch, apply_state_patch, parse_pointer
+
+
+def _doc():
+    return {"nodes": [{"id": "a", "data": {"title": "A"}}, {"id": "b"}], "edges": [], "meta": {"x~y": 1, "p/q": 2}}
+
+
+def test_parse_pointer_unescapes_tokens():
+    assert parse_pointer("") == []
+    assert parse_pointer("/meta/x~0y") == ["meta", "x~y"]
+    assert parse_pointer("/meta/p~1q") == ["meta", "p/q"]
+    with pytest.raises(PatchError):
+        parse_pointer("meta")
+
+
+def test_add_remove_replace():
+    doc = _doc()
+    out = apply_json_patch(doc, [
+        {"op": "add", "path": "/nodes/-", "value": {"id": "c"}},
+        {"op": "add", "path": "/nodes/0", "value": {"id": "z"}},
+        {"op": "remove", "path": "/nodes/2"},
+        {"op": "replace", "path": "/nodes/1/data/title", "value": "A2"},
+        {"op": "add", "path": "/meta/new", "value": None},
+    ])
+    assert [n["id"] for n in out["nodes"]] == ["z", "a", "c"]
+    assert out["nodes"][1]["data"]["title"] == "A2"
+    assert out["meta"]["new"] is None
+    # Copy-on-write: the input is untouched and untouched branches are shared
+    assert doc == _doc()
+    assert out["edges"] is doc["edges"]
+
+
+def test_move_and_copy():
+    out = apply_json_patch(_doc(), [
+        {"op": "copy", "from": "/nodes/0/data", "path": "/nodes/1/data"},
+        {"op": "move", "from": "/meta/x~0y", "path": "/meta/moved"},
+    ])
+    assert out["nodes"][1]["data"] == {"title": "A"}
+    assert out["meta"] == {"p/q": 2, "moved": 1}
+    # Moving onto itself is a no-op
+    same = apply_json_patch(_doc(), [{"op": "move", "from": "/nodes/0", "path": "/nodes/0"}])
+    assert same == _doc()
+
+
+def test_move_into_own_child_is_rejected():
+    with pytest.raises(PatchError, match="children"):
+        apply_json_patch(_doc(), [{"op": "move", "from": "/nodes/0", "path": "/nodes/0/data/inner"}])
+
+
+@pytest.mark.parametrize("op", [
+    {"op": "remove", "path": "/nodes/5"},
+    {"op": "replace", "path": "/meta/missing", "value": 1},
+    {"op": "add", "path": "/nodes/01", "value": 1},
+    {"op": "add", "path": "/missing/deep", "value": 1},
+    {"op": "test", "path": "/meta/p~1q", "value": 3},
+    {"op": "frobnicate", "path": "/meta"},
+    {"op": "add", "path": "/meta/x"},
+    {"op": "remove", "path": ""},
+])
+def test_invalid_ops_raise(op):
+    with pytest.raises(PatchError):
+        apply_json_patch(_doc(), [op])
+
+
+def test_failed_patch_is_atomic():
+    doc = _doc()
+    with pytest.raises(PatchError, match="#1"):
+        apply_json_patch(doc, [{"op": "remove", "path": "/nodes/0"}, {"op": "test", "path": "/meta/p~1q", "value": 0}])
+    assert doc == _doc()
+
+
+def test_upserts_keep_order_and_append_new_ids():
+    state = {"nodes": [{"id": "a"}, {"id": "b", "v": 1}, {"id": "c"}], "edges": []}
+    out = apply_state_patch(state, {"nodes": [{"id": "d"}, {"id": "b", "v": 2}, {"id": "e"}]})
+    assert [(n["id"], n.get("v")) for n in out["nodes"]] == [("a", None), ("b", 2), ("c", None), ("d", None), ("e", None)]
+
+
+def test_upsert_edge_cases():
+    state = {"nodes": [{"id": "a"}, {"id": "b"}], "edges": []}
+    # Removal wins over an upsert of the same id, and a repeated id keeps its last value
+    out = apply_state_patch(state, {"nodes": [{"id": "a", "v": 1}, {"id": "n", "v": 1}, {"id": "n", "v": 2}], "remove_nodes": ["a"]})
+    assert out["nodes"] == [{"id": "b"}, {"id": "n", "v": 2}]
+    with pytest.raises(PatchError):
+        apply_state_patch(state, {"nodes": [{"name": "no id"}]})
+
+
+def test_removing_a_node_drops_its_edges_then_ops_apply():
+    state = {
+        "nodes": [{"id": "a"}, {"id": "b"}, {"id": "c"}],
+        "edges": [{"id": "ab", "source": "a", "target": "b"}, {"id": "bc", "source": "b", "target": "c"}],
+    }
+    out = apply_state_patch(state, {"remove_nodes": ["b"], "ops": [{"op": "add", "path": "/edges/-", "value": {"id": "ac", "source": "a", "target": "c"}}]})
+    assert [n["id"] for n in out["nodes"]] == ["a", "c"]
+    assert [e["id"] for e in out["edges"]] == ["ac"]
+
+
+def test_patch_state_versions_and_replay(sqlite_db, monkeypatch):
+    monkeypatch.setattr(flow_store, "STATE_COMPACT_EVERY", 2)
+    fid = flow_store.create_flow("patched")["id"]
+    assert flow_store.put_state(fid, {"nodes": [{"id": "a"}], "edges": []})["version"] == 1
+
+    assert flow_store.patch_state(fid, 1, {"nodes": [{"id": "b"}]})["version"] == 2
+    with pytest.raises(flow_store.StateConflict) as conflict:
+        flow_store.patch_state(fid, 1, {"nodes": [{"id": "c"}]})
+    assert conflict.value.version == 2
+    with pytest.raises(PatchError):
+        flow_store.patch_state(fid, 2, {"ops": [{"op": "remove", "path": "/nodes/9"}]})
+
+    # A rejected patch leaves nothing behind; the head is rebuilt from snapshot + patch rows
+    flow_store._states.pop(fid)
+    state = flow_store.get_state(fid)
+    assert state["version"] == 2 and [n["id"] for n in state["data"]["nodes"]] == ["a", "b"]
+
+    res = flow_store.patch_state(fid, 2, {"remove_nodes": ["a"]})
+    assert res == {"version": 3, "updated_at": res["updated_at"], "compacted": True}
+    flow_store._states.pop(fid)
+    assert [n["id"] for n in flow_store.get_state(fid)["data"]["nodes"]] == ["b"]
@@ -0,0 +1,109 @@
+import litellm
+from litellm import ModelResponseStream
+from litellm.types.utils import Delta, StreamingChoices
+
+from app import node_runner_stream, rate_client, runner_core
+
+TEXT = "The capital of France is Paris, which has been its seat of government for centuries."
+ANSWER = f"[[ ## answer ## ]]\n{TEXT}\n\n[[ ## completed ## ]]"
+
+PAYLOAD = {
+    "node_kind": "predict",
+    "node_title": "QA",
+    "inputs_schema": [{"name": "question", "type": "string"}],
+    "outputs_schema": [{"name": "answer", "type": "string"}],
+    "inputs_values": {"question": "Capital of France?"},
+    "model": "openai/gpt-4o-mini",
+    "lm_params": {"cache": False},
+}
+
+
+class _ProviderDown(Exception):
+    status_code = 503
+
+
+def _chunks(text, size=4):
+    for i in range(0, len(text), size):
+        yield ModelResponseStream(choices=[StreamingChoices(delta=Delta(content=text[i:i + size]))])
+
+
+def _fake_provider(monkeypatch, fail_after: int):
+    """Stream ANSWER; the first call dies after `fail_after` chunks."""
+    calls = []
+
+    async def acompletion(**request):
+        calls.append(request)
+        first = len(calls) == 1
+
+        async def gen():
+            for n, chunk in enumerate(_chunks(ANSWER)):
+                if first and n == fail_after:
+                    raise _ProviderDown("connection reset mid-stream")
+                yield chunk
+
+        return gen()
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    return calls
+
+
+def _field_text(events, field):
+    """What a client that honours `token_reset` shows for `field`."""
+    text = ""
+    for ev in events:
+        if ev.get("field") != field:
+            continue
+        if ev["event"] == "token_reset":
+            text = ""
+        elif ev["event"] == "token":
+            text += ev["chunk"]
+    return text
+
+
+def test_retry_after_a_streamed_chunk_resets_the_field(channel, monkeypatch):
+    monkeypatch.setattr(rate_client, "RATE_LIMIT_RETRY_BASE", 0)
+    # Past the listener's look-ahead: part of the answer is out when the provider fails
+    calls = _fake_provider(monkeypatch, fail_after=18)
+    events = []
+    assert node_runner_stream.run_stream(dict(PAYLOAD), emit=events.append) == 0
+
+    assert len(calls) == 2
+    kinds = [ev["event"] for ev in events]
+    first_reset = kinds.index("token_reset")
+    assert "token" in kinds[:first_reset]
+    assert [ev["field"] for ev in events if ev["event"] == "token_reset"] == ["answer"]
+    assert _field_text(events, "answer").strip() == TEXT
+    result = next(ev for ev in events if ev["event"] == "result")
+    assert result["outputs"] == {"answer": TEXT}
+
+
+def test_failure_before_any_chunk_needs_no_reset(channel, monkeypatch):
+    monkeypatch.setattr(rate_client, "RATE_LIMIT_RETRY_BASE", 0)
+    _fake_provider(monkeypatch, fail_after=0)
+    events = []
+    assert node_runner_stream.run_stream(dict(PAYLOAD), emit=events.append) == 0
+    assert not [ev for ev in events if ev["event"] == "token_reset"]
+    assert _field_text(events, "answer").strip() == TEXT
+
+
+def test_coalescer_drops_buffered_chunks_of_a_failed_attempt():
+    events = []
+    tokens = node_runner_stream.TokenCoalescer(events.append, "r1", {"id": "n1"}, interval_ms=60_000)
+    tokens.attempt(False)
+    tokens("answer", "Hel", False)
+    tokens("answer", "lo wor", False)
+    tokens.attempt(True)
+    tokens("answer", "Hi", False)
+    tokens("answer", " there", True)
+    tokens.close()
+    assert [(ev["event"], ev.get("chunk")) for ev in events] == [
+        ("token", "Hel"),
+        ("token_reset", None),
+        ("token", "Hi"),
+        ("token", " there"),
+    ]
+
+
+def test_mark_stream_is_a_no_op_outside_streamify():
+    # No dspy stream open: plain (non-streamed) runs are unaffected
+    runner_core._mark_stream(False)
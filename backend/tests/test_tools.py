@@ -0,0 +1,53 @@
+from app import runner_core
+
+COUNTER = """
+calls = []
+
+def count(x: str) -> int:
+    calls.append(x)
+    return len(calls)
+"""
+
+NEEDS_ENV = """
+import os
+TOKEN = os.environ["TOOL_TEST_TOKEN"]
+
+def whoami() -> str:
+    return TOKEN
+"""
+
+
+def test_module_globals_do_not_leak_between_runs():
+    (first,), _ = runner_core.parse_tools([COUNTER])
+    assert first("a") == 1 and first("b") == 2
+    (second,), errors = runner_core.parse_tools([COUNTER])
+    assert not errors
+    assert second("c") == 1
+
+
+def test_execution_errors_are_retried(monkeypatch):
+    monkeypatch.delenv("TOOL_TEST_TOKEN", raising=False)
+    tools, errors = runner_core.parse_tools([NEEDS_ENV])
+    assert tools == [] and "execution error" in errors[0]
+    monkeypatch.setenv("TOOL_TEST_TOKEN", "t-1")
+    (whoami,), errors = runner_core.parse_tools([NEEDS_ENV])
+    assert not errors and whoami() == "t-1"
+
+
+def test_rejected_snippets_are_cached_and_reported_per_index():
+    bad = "def broken(:\n    pass"
+    hits = runner_core._tools.hits
+    _, errors = runner_core.parse_tools([COUNTER, bad, "x = 1"])
+    _, again = runner_core.parse_tools([bad])
+    assert errors[0].startswith("Tool #2 parse error")
+    assert errors[1] == "Tool #3 must define at least one function (def ...)"
+    assert again[0].startswith("Tool #1 parse error")
+    assert runner_core._tools.hits > hits
+
+
+def test_wrap_gets_the_last_function_and_its_index():
+    code = "def helper():\n    return 1\n\ndef tool(q: str) -> str:\n    return q.upper()\n"
+    seen = []
+    tools, _ = runner_core.parse_tools(["def a():\n    return 0\n", code], wrap=lambda fn, i: seen.append((fn.__name__, i)) or fn)
+    assert seen == [("a", 0), ("tool", 1)]
+    assert tools[1]("x") == "X"
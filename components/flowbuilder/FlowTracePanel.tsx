@@ -8,6 +8,7 @@ import { Textarea } from "@/components/ui/textarea";
 import { Accordion, AccordionItem, AccordionTrigger, AccordionContent } from "@/components/ui/accordion";
 import { Loader2, Bot, Wrench, Brain, CheckCircle2, AlertTriangle } from "lucide-react";
 import type { TypedNodeData, Port } from "@/components/flowbuilder/types";
+import { api, type BlobRef } from "@/lib/api";
 
 type RunInputs = Record<string, any>;
 
@@ -417,7 +418,7 @@ function groupByNode(items: { nodeId: string; nodeTitle: string; nodeKind: strin
 
 // ---- Step grouping helpers ----
 type Step =
-  | { type: 'lm'; title: string; running: boolean; prompt?: string; response?: string; exception?: any }
+  | { type: 'lm'; title: string; running: boolean; prompt?: string; response?: string; promptBlob?: BlobRef; responseBlob?: BlobRef; exception?: any }
   | { type: 'tool'; title: string; running: boolean; tool?: string; inputs?: any; output?: any; exception?: any; call_id?: string | number | null; index?: number | null }
   | { type: 'thinking'; title: string; running: boolean; outputs?: any; exception?: any; placeholder?: boolean }
   | { type: 'result'; title: string; running: false; outputs?: any }
@@ -430,6 +431,9 @@ function buildSteps(events: any[]): Step[] {
 
   // Pending maps for grouping
   let pendingLM: any | null = null;
+  // Output text streamed (`token` events) by the LM call in progress, per field
+  let streamed: Record<string, string> = {};
+  const streamedText = () => Object.entries(streamed).map(([f, t]) => `[${f}]\n${t}`).join('\n\n') || undefined;
   const pendingToolsByKey: Record<string, any> = {};
 
   const toolKey = (e: any) => {
@@ -443,14 +447,23 @@ function buildSteps(events: any[]): Step[] {
       case 'lm_start':
         // Close any previous unclosed LM step as running, then start new
         if (pendingLM) {
-          steps.push({ type: 'lm', title: 'LM', running: true, prompt: pendingLM.prompt });
+          steps.push({ type: 'lm', title: 'LM', running: true, prompt: pendingLM.prompt, promptBlob: pendingLM.prompt_blob });
         }
         pendingLM = e;
+        streamed = {};
+        break;
+      case 'token':
+        streamed[e.field] = (streamed[e.field] || '') + (e.chunk || '');
+        break;
+      case 'token_reset':
+        // A retried LM call streams the field again from the start
+        delete streamed[e.field];
         break;
       case 'lm_end': {
         const prompt = pendingLM?.prompt;
-        steps.push({ type: 'lm', title: 'LM', running: false, prompt, response: e.response, exception: e.exception });
+        steps.push({ type: 'lm', title: 'LM', running: false, prompt, promptBlob: pendingLM?.prompt_blob, response: e.response, responseBlob: e.response_blob, exception: e.exception });
         pendingLM = null;
+        streamed = {};
         break;
       }
       case 'tool_start': {
@@ -506,7 +519,7 @@ function buildSteps(events: any[]): Step[] {
   }
 
   // If an LM is still pending, keep as running
-  if (pendingLM) steps.push({ type: 'lm', title: 'LM', running: true, prompt: pendingLM.prompt });
+  if (pendingLM) steps.push({ type: 'lm', title: 'LM', running: true, prompt: pendingLM.prompt, promptBlob: pendingLM.prompt_blob, response: streamedText() });
 
   return steps;
 }
@@ -521,6 +534,36 @@ function stepIcon(t: Step['type']) {
   return null;
 }
 
+// Long prompts/responses arrive as a preview plus a blob reference; fetch the rest on demand
+function BlobText({ preview, blob }: { preview?: string; blob?: BlobRef }) {
+  const [full, setFull] = useState<string | null>(null);
+  const [loading, setLoading] = useState(false);
+  const load = async () => {
+    if (!blob) return;
+    setLoading(true);
+    try {
+      setFull(await api.getRunBlob(blob));
+    } catch {
+      // Swept or unreachable: keep showing the preview
+    } finally {
+      setLoading(false);
+    }
+  };
+  return (
+    <div className="p-2 text-[12px] whitespace-pre-wrap">
+      {full ?? preview}
+      {blob && full === null && (
+        <>
+          {"\u2026 "}
+          <button type="button" className="text-[11px] text-muted-foreground underline" onClick={load} disabled={loading}>
+            {loading ? "Loading\u2026" : `Show all (${Math.ceil(blob.size / 1024)} KB)`}
+          </button>
+        </>
+      )}
+    </div>
+  );
+}
+
 function renderStepBody(step: Step) {
   switch (step.type) {
     case 'lm':
@@ -529,13 +572,13 @@ function renderStepBody(step: Step) {
           {step.prompt && (
             <div>
               <div className="text-[11px] font-medium text-muted-foreground">Prompt</div>
-              <div className="p-2 text-[12px] whitespace-pre-wrap">{step.prompt}</div>
+              <BlobText preview={step.prompt} blob={step.promptBlob} />
             </div>
           )}
           {step.response && (
             <div>
               <div className="text-[11px] font-medium text-muted-foreground">Response</div>
-              <div className="p-2 text-[12px] whitespace-pre-wrap">{step.response}</div>
+              <BlobText preview={step.response} blob={step.responseBlob} />
             </div>
           )}
           {step.exception && <div className="text-[11px] text-red-600">{String(step.exception)}</div>}
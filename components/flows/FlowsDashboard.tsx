@@ -1,7 +1,7 @@
 "use client";
 
 import { useEffect, useMemo, useState } from "react";
-import { api, type Flow, type FlowExportBundle } from "@/lib/api";
+import { api, API_BASE, type Flow, type FlowExportBundle, type FlowSummary } from "@/lib/api";
 import Link from "next/link";
 import { useRef } from "react";
 import { Upload } from "lucide-react";
@@ -36,8 +36,20 @@ export default function FlowsDashboard() {
     setLoading(true);
     setError(null);
     try {
-      const data = await api.listFlows();
-      setFlows(data);
+      // Summaries carry the thumbnail URL, so no per-flow preview requests
+      const items: FlowSummary[] = [];
+      let cursor: string | null | undefined;
+      do {
+        const page = await api.listFlowSummaries({ limit: 200, cursor });
+        items.push(...page.items);
+        cursor = page.next_cursor;
+      } while (cursor);
+      setFlows(items);
+      const next: Record<string, string> = {};
+      for (const f of items) {
+        if (f.thumbnail_url) next[f.id] = `${API_BASE}${f.thumbnail_url}`;
+      }
+      setPreviews(next);
     } catch (e: any) {
       setError(e?.message || "Failed to load flows");
     } finally {
@@ -49,23 +61,6 @@ export default function FlowsDashboard() {
     load();
   }, []);
 
-  // Load previews lazily after flows
-  useEffect(() => {
-    let cancelled = false;
-    async function loadPreviews() {
-      const next: Record<string, string> = {};
-      for (const f of flows) {
-        try {
-          const p = await api.getFlowPreview(f.id);
-          next[f.id] = p.image;
-        } catch {}
-      }
-      if (!cancelled) setPreviews(next);
-    }
-    if (flows.length) loadPreviews();
-    return () => { cancelled = true; };
-  }, [flows]);
-
   async function onCreate() {
     if (!createName.trim()) return;
     const created = await api.createFlow(createName.trim());
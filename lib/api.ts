@@ -6,6 +6,17 @@ export type Flow = {
   updated_at: string;
 };
 
+export type FlowSummary = Flow & {
+  node_count: number;
+  last_run_at?: string | null;
+  thumbnail_url?: string | null;
+};
+
+export type FlowSummaryPage = {
+  items: FlowSummary[];
+  next_cursor?: string | null;
+};
+
 export type FlowState = {
   flow_id: string;
   data: {
@@ -15,6 +26,16 @@ export type FlowState = {
     [k: string]: any;
   };
   updated_at: string;
+  version?: number;
+};
+
+export type FlowStatePatch = {
+  base_version: number;
+  ops?: { op: string; path: string; from?: string; value?: any }[];
+  nodes?: any[];
+  edges?: any[];
+  remove_nodes?: string[];
+  remove_edges?: string[];
 };
 
 // Schemas API types (server-side models)
@@ -56,10 +77,23 @@ export type FlowImportResult = {
 
 export type FlowPreview = {
   flow_id: string;
-  image: string;
+  // Content-addressed paths under /api/previews (prefix with API_BASE)
+  url: string;
+  thumbnail_url: string;
+  etag: string;
+  size?: number | null;
   updated_at: string;
 };
 
+// Reference to an LM prompt/response stored server-side (`prompt_blob` /
+// `response_blob` on lm_start/lm_end events; the field itself is a preview)
+export type BlobRef = {
+  hash: string;
+  size: number;
+  chars: number;
+  url: string;
+};
+
 export const API_BASE = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
 const BASE = `${API_BASE}/api`;
 
@@ -81,6 +115,13 @@ async function http<T>(input: RequestInfo, init?: RequestInit): Promise<T> {
 
 export const api = {
   listFlows: () => http<Flow[]>(`${BASE}/flows/`),
+  listFlowSummaries: (opts: { limit?: number; cursor?: string | null; q?: string } = {}) => {
+    const params = new URLSearchParams();
+    if (opts.limit) params.set("limit", String(opts.limit));
+    if (opts.cursor) params.set("cursor", opts.cursor);
+    if (opts.q) params.set("q", opts.q);
+    return http<FlowSummaryPage>(`${BASE}/flows/summary?${params}`);
+  },
   createFlow: (name: string) =>
     http<Flow>(`${BASE}/flows/`, {
       method: "POST",
@@ -100,6 +141,14 @@ export const api = {
       method: "PUT",
       body: JSON.stringify({ data }),
     }),
+  patchFlowState: (id: string, patch: FlowStatePatch) =>
+    http<{ flow_id: string; version: number; updated_at: string; compacted: boolean }>(
+      `${BASE}/flows/${id}/state`,
+      {
+        method: "PATCH",
+        body: JSON.stringify(patch),
+      }
+    ),
   listFlowSchemas: (flowId: string) =>
     http<ApiFlowSchema[]>(`${BASE}/flows/${flowId}/schemas`),
   createFlowSchema: (
@@ -172,14 +221,42 @@ export const api = {
       cache: "no-store",
     }
   ),
+  // Server-side run of the whole saved flow (multiplexed NDJSON tagged by node_id)
+  runFlowStream: (flowId: string, data: { concurrency?: number; node_ids?: string[] } = {}) => fetch(
+    `${BASE}/flows/${flowId}/run`,
+    {
+      method: "POST",
+      body: JSON.stringify(data),
+      headers: { "Content-Type": "application/json" },
+      cache: "no-store",
+    }
+  ),
   // Import/Export
   exportFlow: (flowId: string) => http<FlowExportBundle>(`${BASE}/flows/${flowId}/export`),
   importFlow: (bundle: FlowExportBundle) =>
     http<FlowImportResult>(`${BASE}/flows/import`, { method: "POST", body: JSON.stringify(bundle) }),
+  // NDJSON export of the given flows (all when omitted); use as a download href
+  exportFlowsNdjsonUrl: (flowIds?: string[]) => {
+    const params = new URLSearchParams();
+    for (const id of flowIds || []) params.append("ids", id);
+    return `${BASE}/flows/export.ndjson${flowIds?.length ? `?${params}` : ""}`;
+  },
+  importFlowsNdjson: (body: Blob | string) =>
+    http<{ flows: Flow[] }>(`${BASE}/flows/import.ndjson`, {
+      method: "POST",
+      body,
+      headers: { "Content-Type": "application/x-ndjson" },
+    }),
   // Previews
   getFlowPreview: (flowId: string) => http<FlowPreview>(`${BASE}/flows/${flowId}/preview`),
   setFlowPreview: (flowId: string, image: string) =>
     http<FlowPreview>(`${BASE}/flows/${flowId}/preview`, { method: "PUT", body: JSON.stringify({ image }) }),
+  // Full text of an offloaded prompt/response
+  getRunBlob: async (ref: BlobRef) => {
+    const res = await fetch(`${API_BASE}${ref.url}`);
+    if (!res.ok) throw new Error(`Request failed: ${res.status}`);
+    return res.text();
+  },
   // AI
   chat: (data: { model: string; messages: { role: 'system' | 'user' | 'assistant'; content: string }[]; temperature?: number }) =>
     http<{ content: string }>(`${BASE}/ai/chat`, { method: 'POST', body: JSON.stringify(data) }),